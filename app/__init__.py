@@ -1,14 +1,58 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+import importlib
 import os
+import threading
 from dotenv import load_dotenv
+from app.routing import RoutingSession, init_routing
 
 # Cargar variables de entorno
 load_dotenv()
 
 # Inicializar extensiones
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Blueprints de la API: (módulo, atributo, prefijo)
+BLUEPRINTS = [
+    ('app.routes.auth_routes', 'auth_bp', '/api/auth'),
+    ('app.routes.product_routes', 'product_bp', '/api/products'),
+    ('app.routes.user_routes', 'user_bp', '/api/users'),
+    ('app.routes.sales_routes', 'sales_bp', '/api/sales'),
+    ('app.routes.category_routes', 'category_bp', '/api/categories'),
+    ('app.routes.location_routes', 'location_bp', '/api/locations'),
+    ('app.routes.batch_routes', 'batch_bp', '/api/batch'),
+    ('app.routes.metrics_routes', 'metrics_bp', '/metrics'),
+    ('app.routes.admin_routes', 'admin_bp', '/api/admin'),
+]
+
+def register_blueprints(app):
+    """Importar y registrar todos los blueprints de la API"""
+    for module_name, attribute, url_prefix in BLUEPRINTS:
+        module = importlib.import_module(module_name)
+        app.register_blueprint(getattr(module, attribute), url_prefix=url_prefix)
+
+class LazyBlueprints:
+    """
+    Middleware WSGI que registra los blueprints justo antes del primer request.
+
+    Así el arranque del proceso no paga la importación de las rutas; el
+    registro ocurre antes de que Flask marque la app como iniciada.
+    """
+    
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.registered = False
+        self.lock = threading.Lock()
+    
+    def __call__(self, environ, start_response):
+        if not self.registered:
+            with self.lock:
+                if not self.registered:
+                    register_blueprints(self.app)
+                    self.registered = True
+        return self.wsgi_app(environ, start_response)
 
 def create_app():
     app = Flask(__name__)
@@ -18,25 +62,109 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///database/ecommerce.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['JSON_AS_ASCII'] = False  # Para caracteres especiales en JSON
+    app.config['SCHEMA_MODE'] = os.getenv('SCHEMA_MODE', 'create')  # create, verify, skip
+    app.config['LAZY_BLUEPRINTS'] = os.getenv('LAZY_BLUEPRINTS', 'False').lower() in ('true', '1')
+    
+    # Réplica de solo lectura (opcional)
+    replica_url = os.getenv('REPLICA_DATABASE_URL')
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {'replica': replica_url}
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+    app.config['REPLICA_SYNC_INTERVAL'] = float(os.getenv('REPLICA_SYNC_INTERVAL', 0))
+    
+    # Reservas de stock del carrito
+    app.config['RESERVATION_TTL_SECONDS'] = int(os.getenv('RESERVATION_TTL_SECONDS', 900))
+    app.config['RESERVATION_SWEEP_INTERVAL'] = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 60))
+    
+    # Métricas (/metrics); METRICS_DIR las comparte entre workers
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'True').lower() in ('true', '1')
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    
+    # Registro de consultas lentas
+    app.config['SLOW_QUERY_ENABLED'] = os.getenv('SLOW_QUERY_ENABLED', 'True').lower() in ('true', '1')
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100))
+    app.config['SLOW_QUERY_LOG'] = os.getenv('SLOW_QUERY_LOG')
+    app.config['SLOW_QUERY_LOG_MAX_BYTES'] = int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 5000000))
+    app.config['SLOW_QUERY_LOG_TAIL_BYTES'] = int(os.getenv('SLOW_QUERY_LOG_TAIL_BYTES', 1000000))
+    
+    # Barrido de carritos abandonados (CART_SWEEP_MODE: delete o archive)
+    app.config['CART_MAX_AGE_DAYS'] = float(os.getenv('CART_MAX_AGE_DAYS', 30))
+    app.config['CART_SWEEP_MODE'] = os.getenv('CART_SWEEP_MODE', 'delete')
+    app.config['CART_SWEEP_BATCH_SIZE'] = int(os.getenv('CART_SWEEP_BATCH_SIZE', 500))
+    app.config['CART_SWEEP_PAUSE'] = float(os.getenv('CART_SWEEP_PAUSE', 0.05))
+    app.config['CART_SWEEP_INTERVAL'] = float(os.getenv('CART_SWEEP_INTERVAL', 0))
+    
+    # Archivo de ventas antiguas en particiones por año
+    app.config['SALES_ARCHIVE_MONTHS'] = int(os.getenv('SALES_ARCHIVE_MONTHS', 12))
+    app.config['SALES_ARCHIVE_BATCH_SIZE'] = int(os.getenv('SALES_ARCHIVE_BATCH_SIZE', 200))
+    app.config['SALES_ARCHIVE_PAUSE'] = float(os.getenv('SALES_ARCHIVE_PAUSE', 0.05))
+    app.config['SALES_ARCHIVE_INTERVAL'] = float(os.getenv('SALES_ARCHIVE_INTERVAL', 0))
+    
+    # Outbox de eventos (OUTBOX_SINKS: file, log, webhook separados por coma)
+    app.config['OUTBOX_SINKS'] = os.getenv('OUTBOX_SINKS', '')
+    app.config['OUTBOX_FILE'] = os.getenv('OUTBOX_FILE', 'outbox_events.jsonl')
+    app.config['OUTBOX_WEBHOOK_URL'] = os.getenv('OUTBOX_WEBHOOK_URL')
+    app.config['OUTBOX_POLL_INTERVAL'] = float(os.getenv('OUTBOX_POLL_INTERVAL', 2))
+    app.config['OUTBOX_BATCH_SIZE'] = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+    app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+    
+    # Índices de búsqueda en memoria (se reconstruyen tras N segundos; 0 = nunca)
+    app.config['SEARCH_INDEX_MAX_AGE'] = float(os.getenv('SEARCH_INDEX_MAX_AGE', 300))
+    
+    # Analítica de ventas (columnas en memoria renovadas tras N segundos)
+    app.config['ANALYTICS_CACHE_SECONDS'] = float(os.getenv('ANALYTICS_CACHE_SECONDS', 60))
+    app.config['ANALYTICS_CHUNK_SIZE'] = int(os.getenv('ANALYTICS_CHUNK_SIZE', 200000))
+    app.config['ANALYTICS_SNAPSHOT_DIR'] = os.getenv('ANALYTICS_SNAPSHOT_DIR')
+    app.config['ANALYTICS_SNAPSHOT_INTERVAL'] = float(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL', 60))
+    
+    # Productos comprados juntos
+    app.config['RELATED_TOP_K'] = int(os.getenv('RELATED_TOP_K', 20))
+    app.config['RELATED_INDEX_MAX_AGE'] = float(os.getenv('RELATED_INDEX_MAX_AGE', 300))
+    app.config['RELATED_REBUILD_CHUNK_SIZE'] = int(os.getenv('RELATED_REBUILD_CHUNK_SIZE', 1000))
+    app.config['RELATED_REBUILD_INTERVAL'] = float(os.getenv('RELATED_REBUILD_INTERVAL', 0))
+    
+    # Límite de peticiones por IP/usuario (RATE_LIMIT_STORAGE: memory o sqlite)
+    app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() in ('true', '1')
+    app.config['RATE_LIMIT_STORAGE'] = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+    app.config['RATE_LIMIT_SQLITE_PATH'] = os.getenv('RATE_LIMIT_SQLITE_PATH', 'database/rate_limit.db')
+    app.config['RATE_LIMIT_RULES'] = os.getenv('RATE_LIMIT_RULES')
+    app.config['RATE_LIMIT_TRUSTED_PROXIES'] = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
+    
+    # Idempotency-Key en checkout y carrito
+    app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+    app.config['IDEMPOTENCY_LOCK_SECONDS'] = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 60))
+    app.config['IDEMPOTENCY_WAIT_SECONDS'] = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 10))
+    app.config['IDEMPOTENCY_PURGE_INTERVAL'] = float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', 3600))
+    
+    # Stream de cambios de stock y precio (/api/products/stream)
+    app.config['PRODUCT_STREAM_MAX_IDS'] = int(os.getenv('PRODUCT_STREAM_MAX_IDS', 50))
+    app.config['PRODUCT_STREAM_MAX_SUBSCRIBERS'] = int(os.getenv('PRODUCT_STREAM_MAX_SUBSCRIBERS', 1000))
+    app.config['PRODUCT_STREAM_KEEPALIVE_SECONDS'] = float(os.getenv('PRODUCT_STREAM_KEEPALIVE_SECONDS', 15))
+    app.config['PRODUCT_STREAM_COALESCE_SECONDS'] = float(os.getenv('PRODUCT_STREAM_COALESCE_SECONDS', 0.1))
+    app.config['PRODUCT_STREAM_POLL_INTERVAL'] = float(os.getenv('PRODUCT_STREAM_POLL_INTERVAL', 5))
     
     # Inicializar extensiones con la app
     db.init_app(app)
     CORS(app)  # Permitir CORS para frontend
     
-    # Registrar blueprints
-    from app.routes.auth_routes import auth_bp
-    from app.routes.product_routes import product_bp
-    from app.routes.user_routes import user_bp
-    from app.routes.sales_routes import sales_bp
-    from app.routes.category_routes import category_bp
-    from app.routes.location_routes import location_bp
-    
-    app.register_blueprint(auth_bp, url_prefix='/api/auth')
-    app.register_blueprint(product_bp, url_prefix='/api/products')
-    app.register_blueprint(user_bp, url_prefix='/api/users')
-    app.register_blueprint(sales_bp, url_prefix='/api/sales')
-    app.register_blueprint(category_bp, url_prefix='/api/categories')
-    app.register_blueprint(location_bp, url_prefix='/api/locations')
+    if app.config['METRICS_ENABLED']:
+        from app.metrics import init_metrics
+        init_metrics(app, db)
+    
+    if app.config['SLOW_QUERY_ENABLED']:
+        from app.slow_queries import init_slow_query_log
+        init_slow_query_log(app, db)
+    
+    if app.config['RATE_LIMIT_ENABLED']:
+        from app.rate_limit import init_rate_limit
+        init_rate_limit(app)
+    
+    # Registrar blueprints (en el primer request si LAZY_BLUEPRINTS está activo)
+    if app.config['LAZY_BLUEPRINTS']:
+        app.wsgi_app = LazyBlueprints(app, app.wsgi_app)
+    else:
+        register_blueprints(app)
     
     # Ruta de prueba
     @app.route('/')
@@ -50,12 +178,56 @@ def create_app():
                 'users': '/api/users',
                 'sales': '/api/sales',
                 'categories': '/api/categories',
-                'locations': '/api/locations'
+                'locations': '/api/locations',
+                'batch': '/api/batch',
+                'metrics': '/metrics',
+                'admin': '/api/admin'
             }
         }
     
-    # Crear tablas si no existen
-    with app.app_context():
-        db.create_all()
+    # Crear o verificar tablas según SCHEMA_MODE
+    from app.schema import ensure_schema
+    from app.migrations import register_migration_commands
+    ensure_schema(app)
+    register_migration_commands(app)
+    
+    # Enrutar lecturas a la réplica si está configurada
+    if replica_url:
+        init_routing(app, db)
+    
+    # Liberar reservas vencidas
+    from app.reservations import release_expired, start_reservation_sweeper
+    
+    @app.cli.command('release-reservations')
+    def release_reservations_command():
+        """Liberar reservas de stock vencidas"""
+        print(f'Reservas liberadas: {release_expired()}')
+    
+    if app.config['RESERVATION_SWEEP_INTERVAL']:
+        start_reservation_sweeper(app, app.config['RESERVATION_SWEEP_INTERVAL'])
+    
+    # Entrega de eventos del outbox
+    from app.outbox import init_outbox
+    init_outbox(app)
+    
+    # Tareas de mantenimiento
+    from app.maintenance import init_maintenance
+    init_maintenance(app)
+    
+    # Snapshot columnar para la analítica
+    from app.snapshot import init_snapshot
+    init_snapshot(app)
+    
+    # Productos comprados juntos
+    from app.recommendations import init_recommendations
+    init_recommendations(app)
+    
+    # Limpieza de claves de idempotencia
+    from app.idempotency import init_idempotency
+    init_idempotency(app)
+    
+    # Listado desnormalizado de productos
+    from app.product_listing import init_product_listing
+    init_product_listing(app)
     
     return app
\ No newline at end of file
@@ -0,0 +1,251 @@
+from flask import current_app
+from app import db
+from app.models import Product, Category, product_categories
+from sqlalchemy import select
+import threading
+import time
+
+# ===============================
+# ANALÍTICA DE VENTAS VECTORIZADA
+# ===============================
+#
+# Los detalles de venta (activos y archivados, vista sales_detail_all) se
+# leen por bloques a arreglos de NumPy, una columna por arreglo, y todas las
+# agrupaciones se hacen con np.bincount sobre claves densas en lugar de recorrer
+# objetos del ORM. NumPy es opcional: sin él la app arranca igual y los
+# endpoints de analítica responden 503.
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+INTERVALS = ('day', 'week', 'month')
+
+# Día desde 1970-01-01 calculado en SQLite, para no convertir fechas en Python
+DETAIL_COLUMNS_SQL = (
+    '"id_Sale", "id_Product", COALESCE(amount, 0), COALESCE("ValueSale", 0), '
+    'CAST(julianday("DateSales") - 2440587.5 AS INTEGER)'
+)
+DETAILS_SQL = f'SELECT {DETAIL_COLUMNS_SQL} FROM sales_detail_all WHERE "DateSales" IS NOT NULL'
+
+def available():
+    return np is not None
+
+class SalesColumns:
+    """Detalles de venta en arreglos paralelos"""
+
+    def __init__(self, sale, product, amount, value, day):
+        self.sale = sale
+        self.product = product
+        self.amount = amount
+        self.value = value
+        self.day = day
+
+    def __len__(self):
+        return len(self.value)
+
+    def between(self, since=None, until=None):
+        """Filtrar por día (numpy.datetime64 o None)"""
+        mask = np.ones(len(self), dtype=bool)
+        if since is not None:
+            mask &= self.day >= since.astype('datetime64[D]').astype(np.int64)
+        if until is not None:
+            mask &= self.day < until.astype('datetime64[D]').astype(np.int64)
+        if mask.all():
+            return self
+        return SalesColumns(self.sale[mask], self.product[mask], self.amount[mask], self.value[mask], self.day[mask])
+
+ROW_DTYPE = np.dtype([('sale', 'i8'), ('product', 'i8'), ('amount', 'i8'), ('value', 'f8'), ('day', 'i8')]) if np else None
+
+def load_columns(chunk_size=200000):
+    """Leer sales_detail_all por bloques a arreglos de NumPy"""
+    # Cursor del driver: devuelve tuplas, que NumPy convierte mucho más rápido que Row
+    cursor = db.session.connection().connection.cursor()
+    chunks = []
+    try:
+        cursor.execute(DETAILS_SQL)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.fromiter(rows, dtype=ROW_DTYPE, count=len(rows)))
+    finally:
+        cursor.close()
+
+    data = np.concatenate(chunks) if chunks else np.empty(0, dtype=ROW_DTYPE)
+    return SalesColumns(**{name: np.ascontiguousarray(data[name]) for name in data.dtype.names})
+
+class ColumnCache:
+    """Copia en memoria de las columnas, renovada cada ANALYTICS_CACHE_SECONDS"""
+
+    def __init__(self):
+        self.columns = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        max_age = current_app.config.get('ANALYTICS_CACHE_SECONDS', 60)
+        with self.lock:
+            if self.columns is None or time.monotonic() - self.loaded_at > max_age:
+                self.columns = load_columns(current_app.config.get('ANALYTICS_CHUNK_SIZE', 200000))
+                self.loaded_at = time.monotonic()
+            return self.columns
+
+columns_cache = ColumnCache()
+
+# ===============================
+# AGRUPACIONES
+# ===============================
+
+def group_index(keys):
+    """
+    Claves distintas (ordenadas) y, para cada fila, la posición de su clave.
+
+    Equivale a np.unique(keys, return_inverse=True), pero con claves densas
+    (días, ids de producto o de venta) marca el rango en un arreglo en O(n) en
+    lugar de ordenar, que con millones de filas es un orden de magnitud más
+    lento. Si el rango es mucho mayor que el número de filas, ordena.
+    """
+    if not len(keys):
+        return keys, np.zeros(0, dtype=np.int64)
+    low = keys.min()
+    span = int(keys.max() - low) + 1
+    if span > 4 * len(keys) + 1024:
+        return np.unique(keys, return_inverse=True)
+
+    offsets = keys - low
+    seen = np.zeros(span, dtype=bool)
+    seen[offsets] = True
+    positions = np.cumsum(seen) - 1
+    return np.flatnonzero(seen) + low, positions[offsets]
+
+def bucket_days(days, interval):
+    """Primer día del período (día, semana desde el lunes o mes) de cada fila"""
+    if interval == 'day':
+        return days
+    if interval == 'week':
+        # 1970-01-01 fue jueves: (día + 3) % 7 es la distancia al lunes
+        return days - (days + 3) % 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]')
+    return months.astype('datetime64[D]').astype(np.int64)
+
+def revenue_series(columns, interval='day'):
+    """
+    Ingresos, unidades y ventas por período. Cada venta cuenta una vez, en
+    el período de su primer detalle.
+    """
+    if not len(columns):
+        return []
+
+    # Agrupar primero por día (O(n)) y luego los pocos días por período
+    days, day_inverse = group_index(columns.day)
+    periods, day_period = group_index(bucket_days(days, interval))
+    revenue = np.bincount(day_period, weights=np.bincount(day_inverse, weights=columns.value), minlength=len(periods))
+    units = np.bincount(day_period, weights=np.bincount(day_inverse, weights=columns.amount), minlength=len(periods))
+
+    sales, sale_inverse = group_index(columns.sale)
+    first_day = np.full(len(sales), len(days) - 1, dtype=np.int64)
+    np.minimum.at(first_day, sale_inverse, day_inverse)
+    orders = np.bincount(day_period[first_day], minlength=len(periods))
+
+    dates = periods.astype('datetime64[D]').astype(str)
+    return [
+        {'period': date, 'revenue': round(float(r), 2), 'units': int(u), 'orders': int(o)}
+        for date, r, u, o in zip(dates, revenue, units, orders)
+    ]
+
+def product_totals(columns):
+    """(ids, ingresos, unidades) por producto"""
+    ids, inverse = group_index(columns.product)
+    revenue = np.bincount(inverse, weights=columns.value, minlength=len(ids))
+    units = np.bincount(inverse, weights=columns.amount, minlength=len(ids))
+    return ids, revenue, units
+
+def top_products(columns, limit=10, by='revenue'):
+    """Productos con más ingresos (o unidades)"""
+    if not len(columns):
+        return []
+
+    ids, revenue, units = product_totals(columns)
+    ranking = revenue if by == 'revenue' else units
+    limit = min(limit, len(ids))
+    top = np.argpartition(-ranking, limit - 1)[:limit]
+    top = top[np.argsort(-ranking[top], kind='stable')]
+
+    names = dict(db.session.query(Product.id_Product, Product.ProductName).filter(
+        Product.id_Product.in_(ids[top].tolist())
+    ).all())
+    return [{
+        'id_Product': int(ids[i]),
+        'ProductName': names.get(int(ids[i])),
+        'revenue': round(float(revenue[i]), 2),
+        'units': int(units[i])
+    } for i in top]
+
+def category_breakdown(columns):
+    """
+    Ingresos y unidades por categoría. Un producto con varias categorías
+    suma en cada una, así que los totales pueden superar el total general.
+    """
+    if not len(columns):
+        return []
+
+    ids, revenue, units = product_totals(columns)
+    links = np.array([tuple(row) for row in db.session.execute(
+        select(product_categories.c.id_Product, product_categories.c.id_Category)
+    )], dtype=np.int64).reshape(-1, 2)
+    if not len(links):
+        return []
+
+    # Posición de cada producto del vínculo en `ids`; se descartan los que no tuvieron ventas
+    positions = np.searchsorted(ids, links[:, 0])
+    positions[positions >= len(ids)] = 0
+    sold = ids[positions] == links[:, 0]
+    link_positions = positions[sold]
+    categories, inverse = np.unique(links[sold, 1], return_inverse=True)
+
+    category_revenue = np.bincount(inverse, weights=revenue[link_positions], minlength=len(categories))
+    category_units = np.bincount(inverse, weights=units[link_positions], minlength=len(categories))
+    category_products = np.bincount(inverse, minlength=len(categories))
+
+    names = dict(db.session.query(Category.id_Category, Category.CategoryName).all())
+    order = np.argsort(-category_revenue, kind='stable')
+    return [{
+        'id_Category': int(categories[i]),
+        'CategoryName': names.get(int(categories[i])),
+        'revenue': round(float(category_revenue[i]), 2),
+        'units': int(category_units[i]),
+        'products_sold': int(category_products[i])
+    } for i in order]
+
+def order_percentiles(columns, percentiles=(50, 90, 95, 99)):
+    """Percentiles del valor y de las unidades por venta"""
+    if not len(columns):
+        return {'orders': 0}
+
+    _, inverse = group_index(columns.sale)
+    order_value = np.bincount(inverse, weights=columns.value)
+    order_units = np.bincount(inverse, weights=columns.amount)
+    value_points = np.percentile(order_value, percentiles)
+    unit_points = np.percentile(order_units, percentiles)
+
+    return {
+        'orders': int(len(order_value)),
+        'average_value': round(float(order_value.mean()), 2),
+        'value': {f'p{p:g}': round(float(v), 2) for p, v in zip(percentiles, value_points)},
+        'units': {f'p{p:g}': float(v) for p, v in zip(percentiles, unit_points)}
+    }
+
+def sales_totals(columns, since):
+    """
+    (ventas, ingresos, ventas desde `since`) para /api/sales/stats. Solo
+    cuenta ventas con detalles, y `since` (numpy.datetime64) se redondea al día.
+    """
+    if not len(columns):
+        return 0, 0.0, 0
+
+    since_day = since.astype('datetime64[D]').astype(np.int64)
+    total_sales = len(group_index(columns.sale)[0])
+    recent_sales = len(group_index(columns.sale[columns.day >= since_day])[0])
+    return total_sales, float(columns.value.sum()), recent_sales
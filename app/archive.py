@@ -0,0 +1,318 @@
+from flask import current_app
+from app import db
+from app.models import Sales, SalesDetail, SalesArchiveSummary, TemporalSales, Product, Users
+from sqlalchemy import Table, Column, MetaData, and_, bindparam, select, text, func, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+import re
+import time
+
+# ===============================
+# ARCHIVO HISTÓRICO DE VENTAS
+# ===============================
+#
+# Las ventas más antiguas que SALES_ARCHIVE_MONTHS se mueven, junto con sus
+# detalles, a tablas por año (sales_archive_<año>, sales_detail_archive_<año>)
+# en la misma base de datos. Así sales y sales_detail, y sus índices, solo
+# guardan la historia reciente.
+#
+# Las vistas sales_all y sales_detail_all unen las tablas activas con todas
+# las particiones; las crea la migración 0004_sales_archive_views y se
+# recrean cada vez que se agrega una partición. Los items de carrito ya
+# comprados de esas ventas se eliminan de temporal_sales (su contenido queda
+# en el detalle archivado).
+#
+# sales_archive_summary guarda las ventas e ingresos de cada partición y se
+# actualiza en la misma transacción que mueve cada lote: los totales y las
+# comprobaciones de ventas de un producto o usuario consultan primero las
+# tablas activas y solo bajan al archivo cuando hace falta.
+
+SALES_COLUMNS = [column.name for column in Sales.__table__.columns]
+DETAIL_COLUMNS = [column.name for column in SalesDetail.__table__.columns]
+PARTITION_NAME = re.compile(r'^sales_archive_(\d{4})$')
+
+# Vistas con los tipos de los modelos, fuera de db.metadata para que
+# create_all no intente crearlas como tablas
+views = MetaData()
+sales_all = Table('sales_all', views, *[Column(c.name, c.type) for c in Sales.__table__.columns])
+sales_detail_all = Table('sales_detail_all', views, *[Column(c.name, c.type) for c in SalesDetail.__table__.columns])
+
+def quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+def column_list(columns):
+    return ', '.join(quote(name) for name in columns)
+
+def partition_tables(year):
+    return f'sales_archive_{year}', f'sales_detail_archive_{year}'
+
+def partition_years(connection):
+    """Años con partición de archivo"""
+    names = inspect(connection).get_table_names()
+    return sorted(int(match.group(1)) for match in map(PARTITION_NAME.match, names) if match)
+
+def ensure_partition(connection, year):
+    """Crear las tablas de un año si no existen. Devuelve True si se crearon."""
+    sales_table, detail_table = partition_tables(year)
+    if inspect(connection).has_table(sales_table):
+        return False
+
+    connection.execute(text(
+        f'CREATE TABLE {sales_table} AS SELECT {column_list(SALES_COLUMNS)} FROM sales WHERE 0'
+    ))
+    connection.execute(text(
+        f'CREATE TABLE {detail_table} AS SELECT {column_list(DETAIL_COLUMNS)} FROM sales_detail WHERE 0'
+    ))
+    ensure_partition_indexes(connection, year)
+    return True
+
+def ensure_partition_indexes(connection, year):
+    sales_table, detail_table = partition_tables(year)
+    connection.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{sales_table}_id ON {sales_table} ("id_Sale")'))
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{sales_table}_user ON {sales_table} ("iD_User")'))
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{detail_table}_sale ON {detail_table} ("id_Sale")'))
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{detail_table}_product ON {detail_table} ("id_Product")'))
+    # Lectura incremental por id (snapshot de analítica)
+    connection.execute(text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{detail_table}_id ON {detail_table} ("id_SalesDetails")'
+    ))
+
+def rebuild_views(connection):
+    """Recrear sales_all y sales_detail_all con las particiones existentes"""
+    years = partition_years(connection)
+    for view, hot_table, columns, index in (
+        ('sales_all', 'sales', SALES_COLUMNS, 0),
+        ('sales_detail_all', 'sales_detail', DETAIL_COLUMNS, 1)
+    ):
+        selects = [f'SELECT {column_list(columns)} FROM {hot_table}'] + [
+            f'SELECT {column_list(columns)} FROM {partition_tables(year)[index]}' for year in years
+        ]
+        connection.execute(text(f'DROP VIEW IF EXISTS {view}'))
+        connection.execute(text(f'CREATE VIEW {view} AS ' + ' UNION ALL '.join(selects)))
+
+def ensure_views(connection):
+    """Crear las vistas si no existen, los índices que falten en las particiones y el resumen por año"""
+    years = partition_years(connection)
+    for year in years:
+        ensure_partition_indexes(connection, year)
+    existing = set(inspect(connection).get_view_names())
+    if not {'sales_all', 'sales_detail_all'} <= existing:
+        rebuild_views(connection)
+
+    connection.execute(SalesArchiveSummary.__table__.delete())
+    for year in years:
+        sales_table, detail_table = partition_tables(year)
+        add_to_summary(
+            connection, year,
+            connection.execute(text(f'SELECT count(*) FROM {sales_table}')).scalar(),
+            connection.execute(text(f'SELECT coalesce(sum("ValueSale"), 0) FROM {detail_table}')).scalar()
+        )
+
+def add_to_summary(connection, year, sales_count, revenue):
+    summary = SalesArchiveSummary.__table__
+    statement = sqlite_insert(summary).values(Year=year, SalesCount=sales_count, Revenue=revenue)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[summary.c.Year],
+        set_={'SalesCount': summary.c.SalesCount + sales_count, 'Revenue': summary.c.Revenue + revenue}
+    ))
+
+def archive_cutoff(months, now=None):
+    """Primer instante que se conserva en las tablas activas (`months` meses atrás)"""
+    now = now or datetime.utcnow()
+    month_index = now.year * 12 + now.month - 1 - months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+def archive_sales(months=None, batch_size=None, pause=None, dry_run=False):
+    """
+    Mover a las particiones por año las ventas anteriores al corte, en lotes
+    con una transacción cada uno.
+
+    Returns:
+        dict: ventas y detalles movidos, lotes, particiones creadas y segundos
+    """
+    config = current_app.config
+    months = config['SALES_ARCHIVE_MONTHS'] if months is None else months
+    batch_size = batch_size or config['SALES_ARCHIVE_BATCH_SIZE']
+    pause = config['SALES_ARCHIVE_PAUSE'] if pause is None else pause
+
+    start = time.perf_counter()
+    cutoff = archive_cutoff(months)
+    # La venta y el detalle con el id más alto se quedan en las tablas activas:
+    # SQLite asigna max(id) + 1, y si se movieran los ids nuevos repetirían
+    # ids archivados (el snapshot de analítica lee por id creciente)
+    keep = {
+        db.session.execute(select(func.max(Sales.id_Sale))).scalar(),
+        db.session.execute(
+            select(SalesDetail.id_Sale).order_by(SalesDetail.id_SalesDetails.desc()).limit(1)
+        ).scalar()
+    } - {None}
+    old_sales = and_(Sales.DateCreated < cutoff, Sales.id_Sale.notin_(keep))
+
+    if dry_run:
+        count = db.session.execute(select(func.count()).select_from(Sales).where(old_sales)).scalar()
+        return {'sales': count, 'details': 0, 'batches': 0, 'partitions': [],
+                'seconds': time.perf_counter() - start, 'cutoff': cutoff.isoformat(), 'dry_run': True}
+
+    moved_sales = moved_details = batches = 0
+    created = []
+
+    while True:
+        rows = db.session.execute(
+            select(Sales.id_Sale, Sales.DateCreated).where(old_sales).order_by(Sales.id_Sale).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        by_year = {}
+        for row in rows:
+            by_year.setdefault(row.DateCreated.year, []).append(row.id_Sale)
+
+        connection = db.session.connection()
+        new_partitions = [year for year in by_year if ensure_partition(connection, year)]
+        for year, ids in by_year.items():
+            sales_table, detail_table = partition_tables(year)
+            connection.execute(text(
+                f'INSERT INTO {sales_table} ({column_list(SALES_COLUMNS)}) '
+                f'SELECT {column_list(SALES_COLUMNS)} FROM sales WHERE "id_Sale" IN :ids'
+            ).bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+            moved_details += connection.execute(text(
+                f'INSERT INTO {detail_table} ({column_list(DETAIL_COLUMNS)}) '
+                f'SELECT {column_list(DETAIL_COLUMNS)} FROM sales_detail WHERE "id_Sale" IN :ids'
+            ).bindparams(bindparam('ids', expanding=True)), {'ids': ids}).rowcount
+            revenue = connection.execute(
+                select(func.coalesce(func.sum(SalesDetail.ValueSale), 0)).where(SalesDetail.id_Sale.in_(ids))
+            ).scalar()
+            add_to_summary(connection, year, len(ids), revenue)
+
+        ids = [row.id_Sale for row in rows]
+        db.session.execute(SalesDetail.__table__.delete().where(SalesDetail.id_Sale.in_(ids)))
+        db.session.execute(TemporalSales.__table__.delete().where(TemporalSales.id_Sale.in_(ids)))
+        db.session.execute(Sales.__table__.delete().where(Sales.id_Sale.in_(ids)))
+        if new_partitions:
+            rebuild_views(connection)
+            created.extend(new_partitions)
+        db.session.commit()
+
+        moved_sales += len(ids)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return {'sales': moved_sales, 'details': moved_details, 'batches': batches, 'partitions': created,
+            'seconds': time.perf_counter() - start, 'cutoff': cutoff.isoformat()}
+
+# ===============================
+# LECTURA DE VENTAS ARCHIVADAS
+# ===============================
+
+def detail_dicts(rows, products):
+    return [{
+        'id_SalesDetails': row.id_SalesDetails,
+        'id_Product': row.id_Product,
+        'id_Sale': row.id_Sale,
+        'id_TemporalSales': row.id_TemporalSales,
+        'DateSales': row.DateSales.isoformat() if row.DateSales else None,
+        'amount': row.amount,
+        'ValueSale': row.ValueSale,
+        'product': products[row.id_Product].to_dict() if row.id_Product in products else None
+    } for row in rows]
+
+def find_sale(sale_id):
+    """
+    Venta archivada con la misma forma que Sales.to_dict(include_details=True),
+    o None si no existe.
+    """
+    sale = db.session.execute(select(sales_all).where(sales_all.c.id_Sale == sale_id)).first()
+    if sale is None:
+        return None
+
+    details = db.session.execute(
+        select(sales_detail_all).where(sales_detail_all.c.id_Sale == sale_id)
+        .order_by(sales_detail_all.c.id_SalesDetails)
+    ).all()
+    product_ids = {row.id_Product for row in details}
+    products = {
+        product.id_Product: product
+        for product in Product.query.filter(Product.id_Product.in_(product_ids)).all()
+    } if product_ids else {}
+    user_name = db.session.query(Users.UserName).filter_by(iD_User=sale.iD_User).scalar()
+
+    return {
+        'id_Sale': sale.id_Sale,
+        'DescripcionSale': sale.DescripcionSale,
+        'iD_User': sale.iD_User,
+        'DateCreated': sale.DateCreated.isoformat() if sale.DateCreated else None,
+        'user': user_name,
+        'details': detail_dicts(details, products),
+        'total': sum(row.ValueSale for row in details),
+        'archived': True
+    }
+
+def iter_sales(chunk_size=500):
+    """Todas las ventas (activas y archivadas) con sus detalles, por bloques"""
+    last_id = 0
+    while True:
+        sales = db.session.execute(
+            select(sales_all).where(sales_all.c.id_Sale > last_id).order_by(sales_all.c.id_Sale).limit(chunk_size)
+        ).all()
+        if not sales:
+            return
+
+        details = {}
+        for row in db.session.execute(
+            select(sales_detail_all).where(sales_detail_all.c.id_Sale.in_([sale.id_Sale for sale in sales]))
+            .order_by(sales_detail_all.c.id_SalesDetails)
+        ):
+            details.setdefault(row.id_Sale, []).append({
+                'id_SalesDetails': row.id_SalesDetails,
+                'id_Product': row.id_Product,
+                'amount': row.amount,
+                'ValueSale': row.ValueSale
+            })
+
+        for sale in sales:
+            items = details.get(sale.id_Sale, [])
+            yield {
+                'id_Sale': sale.id_Sale,
+                'DescripcionSale': sale.DescripcionSale,
+                'iD_User': sale.iD_User,
+                'DateCreated': sale.DateCreated.isoformat() if sale.DateCreated else None,
+                'details': items,
+                'total': sum(item['ValueSale'] for item in items)
+            }
+        last_id = sales[-1].id_Sale
+
+def totals():
+    """Número de ventas e ingresos totales incluyendo las archivadas"""
+    archived_sales, archived_revenue = db.session.execute(select(
+        func.coalesce(func.sum(SalesArchiveSummary.SalesCount), 0),
+        func.coalesce(func.sum(SalesArchiveSummary.Revenue), 0)
+    )).one()
+    return (
+        db.session.execute(select(func.count()).select_from(Sales)).scalar() + archived_sales,
+        (db.session.execute(select(func.sum(SalesDetail.ValueSale))).scalar() or 0) + archived_revenue
+    )
+
+def exists_in_partitions(index, column, value):
+    """Buscar `column = value` en las particiones, de la más reciente a la más antigua"""
+    connection = db.session.connection()
+    years = connection.execute(select(SalesArchiveSummary.Year).order_by(SalesArchiveSummary.Year.desc())).scalars()
+    for year in years.all():
+        table = partition_tables(year)[index]
+        if connection.execute(
+            text(f'SELECT 1 FROM {table} WHERE {quote(column)} = :value LIMIT 1'), {'value': value}
+        ).first() is not None:
+            return True
+    return False
+
+def product_has_sales(product_id):
+    hot = db.session.execute(
+        select(SalesDetail.id_SalesDetails).where(SalesDetail.id_Product == product_id).limit(1)
+    ).first()
+    return hot is not None or exists_in_partitions(1, 'id_Product', product_id)
+
+def user_has_sales(user_id):
+    hot = db.session.execute(select(Sales.id_Sale).where(Sales.iD_User == user_id).limit(1)).first()
+    return hot is not None or exists_in_partitions(0, 'iD_User', user_id)
@@ -0,0 +1,34 @@
+import threading
+
+# ===============================
+# HILOS DE FONDO
+# ===============================
+#
+# Los hilos no sobreviven a un fork: si la app se crea en el proceso maestro
+# de un servidor pre-fork (gunicorn con preload_app), los hilos iniciados en
+# create_app quedarían solo en el maestro. Con defer_threads() activo, los
+# hilos se anotan y cada worker los inicia después del fork con
+# start_deferred_threads().
+
+deferred = None
+
+def defer_threads():
+    """Anotar los hilos en lugar de iniciarlos (llamar antes de create_app)"""
+    global deferred
+    if deferred is None:
+        deferred = []
+
+def start_thread(target, name):
+    """Iniciar `target` en un hilo daemon, o anotarlo si los hilos están diferidos"""
+    if deferred is not None:
+        deferred.append((target, name))
+        return None
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def start_deferred_threads():
+    """Iniciar en este proceso los hilos anotados"""
+    global deferred
+    pending, deferred = deferred or [], None
+    return [start_thread(target, name) for target, name in pending]
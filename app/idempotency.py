@@ -0,0 +1,205 @@
+from flask import request, jsonify, current_app
+from app import db
+from app.models import IdempotencyKey
+from app.security import decode_request_token
+from app.maintenance import start_periodic_job
+from sqlalchemy import select, or_, and_, tuple_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from functools import wraps
+import click
+import hashlib
+import threading
+import time
+
+# ===============================
+# IDEMPOTENCY-KEY
+# ===============================
+#
+# Los endpoints decorados con @idempotent aceptan el header Idempotency-Key.
+# La primera petición con una clave inserta su fila en idempotency_key
+# (clave primaria: usuario + clave), se ejecuta y guarda el código y el cuerpo
+# de la respuesta. Los reintentos con la misma clave devuelven esa respuesta
+# sin volver a ejecutar el endpoint, con el header Idempotent-Replayed.
+#
+# Un duplicado que llega mientras la primera ejecución sigue en curso espera
+# a que termine (hasta IDEMPOTENCY_WAIT_SECONDS). Si el proceso que la tomó
+# muere, la fila queda bloqueada hasta LockedUntil y luego otro puede
+# tomarla. Las respuestas 5xx y 409 no se guardan: la transacción del
+# endpoint se deshizo (error o conflicto con otra petición) y el cliente puede
+# reintentar con la misma clave.
+#
+# Las filas se leen y escriben en conexiones propias (db.engine), nunca con
+# db.session: dentro de /api/batch las subpeticiones comparten la sesión y un
+# commit aquí confirmaría lo que otra dejó pendiente.
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+keys = IdempotencyKey.__table__
+
+# Despierta a los duplicados que esperan en este proceso; los de otros
+# procesos se enteran al volver a leer la fila
+finished = threading.Condition()
+
+def request_fingerprint():
+    """Hash del método, la ruta y el cuerpo: una clave no puede reutilizarse con otra petición"""
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.full_path}\n'.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def key_filter(user_id, key):
+    return and_(keys.c.iD_User == user_id, keys.c.Key == key)
+
+def lookup(user_id, key):
+    with db.engine.connect() as connection:
+        return connection.execute(select(keys).where(key_filter(user_id, key))).first()
+
+def claim(user_id, key, fingerprint):
+    """
+    Tomar la clave para ejecutar la petición.
+
+    Returns:
+        Row | None: None si esta petición la tomó; si no, la fila existente
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    values = {
+        'Fingerprint': fingerprint,
+        'StatusCode': None,
+        'ResponseBody': None,
+        'LockedUntil': now + timedelta(seconds=config['IDEMPOTENCY_LOCK_SECONDS']),
+        'ExpiresAt': now + timedelta(seconds=config['IDEMPOTENCY_TTL_SECONDS']),
+        'DateCreated': now
+    }
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(keys.insert().values(iD_User=user_id, Key=key, **values))
+        return None
+    except IntegrityError:
+        pass
+
+    # Vencida, o abandonada por un proceso que no llegó a guardar la respuesta
+    with db.engine.begin() as connection:
+        taken = connection.execute(
+            keys.update().where(
+                key_filter(user_id, key),
+                or_(keys.c.ExpiresAt < now, and_(keys.c.StatusCode.is_(None), keys.c.LockedUntil < now))
+            ).values(**values)
+        ).rowcount
+    if taken:
+        return None
+    return lookup(user_id, key)
+
+def finish(user_id, key, response):
+    """Guardar la respuesta, o liberar la clave si fue un error del servidor o un conflicto"""
+    try:
+        with db.engine.begin() as connection:
+            if response is None or response.status_code >= 500 or response.status_code == 409:
+                connection.execute(keys.delete().where(key_filter(user_id, key)))
+            else:
+                connection.execute(keys.update().where(key_filter(user_id, key)).values(
+                    StatusCode=response.status_code,
+                    ResponseBody=response.get_data(as_text=True)
+                ))
+    except Exception as e:
+        # La fila queda en curso hasta LockedUntil; después otro reintento la toma
+        print(f'Error guardando la respuesta idempotente: {e}')
+    with finished:
+        finished.notify_all()
+
+def replay(row):
+    response = current_app.response_class(row.ResponseBody, status=row.StatusCode, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(view):
+    """Aceptar Idempotency-Key en un endpoint autenticado"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres'}), 400
+
+        # Sin usuario no hay con qué asociar la clave: el endpoint responde 401
+        try:
+            payload = decode_request_token()
+        except Exception:
+            payload = None
+        if not payload:
+            return view(*args, **kwargs)
+        user_id = payload['user_id']
+
+        fingerprint = request_fingerprint()
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+        row = claim(user_id, key, fingerprint)
+        while row is not None:
+            if row.Fingerprint != fingerprint:
+                return jsonify({'error': f'{HEADER} ya se usó con otra petición'}), 422
+            if row.StatusCode is not None:
+                return replay(row)
+            if time.monotonic() >= deadline:
+                return jsonify({'error': f'Hay una petición con esta {HEADER} en proceso'}), 409
+
+            with finished:
+                finished.wait(POLL_INTERVAL)
+            row = lookup(user_id, key)
+            if row is None or (row.StatusCode is None and row.LockedUntil < datetime.utcnow()):
+                row = claim(user_id, key, fingerprint)
+
+        response = None
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        finally:
+            finish(user_id, key, response)
+        return response
+    return wrapper
+
+# ===============================
+# LIMPIEZA
+# ===============================
+
+def purge_expired(batch_size=1000):
+    """
+    Borrar claves vencidas en lotes (una transacción por lote).
+
+    Returns:
+        int: claves borradas
+    """
+    now = datetime.utcnow()
+    purged = 0
+    while True:
+        expired = db.session.execute(
+            select(keys.c.iD_User, keys.c.Key).where(keys.c.ExpiresAt < now).limit(batch_size)
+        ).all()
+        if not expired:
+            break
+        purged += db.session.execute(
+            keys.delete().where(
+                tuple_(keys.c.iD_User, keys.c.Key).in_([tuple(row) for row in expired]),
+                keys.c.ExpiresAt < now
+            )
+        ).rowcount
+        db.session.commit()
+        if len(expired) < batch_size:
+            break
+    return purged
+
+def report_purge(purged):
+    if purged:
+        return f'Claves de idempotencia vencidas borradas: {purged}'
+
+def init_idempotency(app):
+    """Comando de limpieza y limpieza periódica de claves vencidas"""
+    @app.cli.command('purge-idempotency-keys')
+    def purge_idempotency_keys_command():
+        """Borrar las claves de idempotencia vencidas"""
+        print(f'Claves borradas: {purge_expired()}')
+
+    if app.config['IDEMPOTENCY_PURGE_INTERVAL']:
+        start_periodic_job(app, 'idempotency-purge', app.config['IDEMPOTENCY_PURGE_INTERVAL'],
+                           purge_expired, report_purge)
@@ -0,0 +1,151 @@
+from flask import current_app
+from app import db
+from app.models import TemporalSales, TemporalSalesArchive
+from app.archive import archive_sales
+from app.background import start_thread
+from sqlalchemy import select, func, literal
+from datetime import datetime, timedelta
+import click
+import time
+
+# ===============================
+# TAREAS DE MANTENIMIENTO
+# ===============================
+#
+# Trabajos periódicos sobre tablas que crecen sin límite (carritos
+# abandonados aquí, ventas antiguas en app/archive.py). Cada uno procesa
+# lotes pequeños, con una transacción corta por lote y una pausa entre
+# lotes, para no retener el lock de escritura de SQLite mientras atienden
+# peticiones los workers.
+
+carts = TemporalSales.__table__
+cart_archive = TemporalSalesArchive.__table__
+
+def cart_cutoff(max_age_days, now=None):
+    """
+    Fecha de corte para considerar abandonado un item del carrito.
+
+    Nunca es más reciente que la duración de las reservas, así los items
+    barridos ya no tienen stock reservado (las reservas vencidas las libera
+    release_expired).
+    """
+    now = now or datetime.utcnow()
+    ttl = timedelta(seconds=current_app.config.get('RESERVATION_TTL_SECONDS', 900))
+    return now - max(timedelta(days=max_age_days), ttl)
+
+def sweep_abandoned_carts(max_age_days=None, batch_size=None, archive=None, pause=None, dry_run=False):
+    """
+    Borrar (o archivar) los items de carrito sin venta más antiguos que
+    `max_age_days`.
+
+    Returns:
+        dict: filas retiradas, lotes, segundos empleados y fecha de corte
+    """
+    config = current_app.config
+    max_age_days = config['CART_MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+    batch_size = batch_size or config['CART_SWEEP_BATCH_SIZE']
+    archive = config['CART_SWEEP_MODE'] == 'archive' if archive is None else archive
+    pause = config['CART_SWEEP_PAUSE'] if pause is None else pause
+
+    start = time.perf_counter()
+    cutoff = cart_cutoff(max_age_days)
+    stale = [carts.c.id_Sale.is_(None), carts.c.DateAdded < cutoff]
+
+    if dry_run:
+        count = db.session.execute(
+            select(func.count()).select_from(carts).where(*stale)
+        ).scalar()
+        return {'rows': count, 'batches': 0, 'seconds': time.perf_counter() - start,
+                'cutoff': cutoff.isoformat(), 'dry_run': True}
+
+    removed = 0
+    batches = 0
+    while True:
+        ids = db.session.execute(
+            select(carts.c.id_TemporalSales).where(*stale).order_by(carts.c.id_TemporalSales).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        batch = [carts.c.id_TemporalSales.in_(ids), *stale]
+        if archive:
+            db.session.execute(cart_archive.insert().from_select(
+                ['id_TemporalSales', 'iD_User', 'id_Product', 'quantity', 'DateAdded', 'ArchivedAt'],
+                select(
+                    carts.c.id_TemporalSales, carts.c.iD_User, carts.c.id_Product,
+                    carts.c.quantity, carts.c.DateAdded, literal(datetime.utcnow())
+                ).where(*batch)
+            ))
+        # Repetir el filtro: un item pudo pasar a una venta desde la lectura
+        result = db.session.execute(carts.delete().where(*batch))
+        db.session.commit()
+
+        removed += result.rowcount
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return {'rows': removed, 'batches': batches, 'seconds': time.perf_counter() - start,
+            'cutoff': cutoff.isoformat(), 'archived': archive}
+
+def start_periodic_job(app, name, interval, job, report):
+    """Ejecutar `job` cada `interval` segundos en un hilo de fondo"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    result = job()
+                message = report(result)
+                if message:
+                    print(message)
+            except Exception as e:
+                print(f'Error en la tarea {name}: {e}')
+
+    return start_thread(loop, name)
+
+def report_cart_sweep(result):
+    if result['rows']:
+        return (f'Carritos abandonados: {result["rows"]} filas retiradas en '
+                f'{result["batches"]} lotes ({result["seconds"]:.2f} s)')
+
+def report_sales_archive(result):
+    if result['sales']:
+        return (f'Ventas archivadas: {result["sales"]} ventas y {result["details"]} detalles '
+                f'en {result["batches"]} lotes ({result["seconds"]:.2f} s)')
+
+def init_maintenance(app):
+    """Comandos de mantenimiento y tareas programadas"""
+    @app.cli.command('sweep-carts')
+    @click.option('--max-age-days', type=float, default=None, help='Antigüedad mínima de los items (default: CART_MAX_AGE_DAYS)')
+    @click.option('--batch-size', type=int, default=None, help='Filas por transacción (default: CART_SWEEP_BATCH_SIZE)')
+    @click.option('--archive/--delete', default=None, help='Archivar en temporal_sales_archive o solo borrar (default: CART_SWEEP_MODE)')
+    @click.option('--dry-run', is_flag=True, help='Solo contar las filas que se retirarían')
+    def sweep_carts_command(max_age_days, batch_size, archive, dry_run):
+        """Retirar items de carritos abandonados"""
+        result = sweep_abandoned_carts(max_age_days, batch_size, archive, dry_run=dry_run)
+        action = 'a retirar' if dry_run else 'retiradas'
+        print(f'Filas {action}: {result["rows"]} (corte {result["cutoff"]}, '
+              f'{result["batches"]} lotes, {result["seconds"]:.2f} s)')
+
+    @app.cli.command('archive-sales')
+    @click.option('--months', type=int, default=None, help='Meses que se conservan en las tablas activas (default: SALES_ARCHIVE_MONTHS)')
+    @click.option('--batch-size', type=int, default=None, help='Ventas por transacción (default: SALES_ARCHIVE_BATCH_SIZE)')
+    @click.option('--dry-run', is_flag=True, help='Solo contar las ventas que se archivarían')
+    def archive_sales_command(months, batch_size, dry_run):
+        """Mover las ventas antiguas a las particiones de archivo por año"""
+        result = archive_sales(months, batch_size, dry_run=dry_run)
+        action = 'a archivar' if dry_run else 'archivadas'
+        print(f'Ventas {action}: {result["sales"]}, detalles: {result["details"]} '
+              f'(corte {result["cutoff"]}, {result["batches"]} lotes, {result["seconds"]:.2f} s)')
+        if result['partitions']:
+            print(f'Particiones creadas: {", ".join(map(str, result["partitions"]))}')
+
+    if app.config['CART_SWEEP_INTERVAL']:
+        start_periodic_job(app, 'cart-sweeper', app.config['CART_SWEEP_INTERVAL'],
+                           sweep_abandoned_carts, report_cart_sweep)
+    if app.config['SALES_ARCHIVE_INTERVAL']:
+        start_periodic_job(app, 'sales-archiver', app.config['SALES_ARCHIVE_INTERVAL'],
+                           archive_sales, report_sales_archive)
@@ -0,0 +1,355 @@
+from flask import request
+from sqlalchemy import event
+from app.background import start_thread
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+# ===============================
+# MÉTRICAS EN FORMATO PROMETHEUS
+# ===============================
+#
+# Cada proceso acumula sus métricas en memoria. Si METRICS_DIR está
+# configurado, cada worker guarda periódicamente una copia en
+# METRICS_DIR/metrics_<pid>.json y /metrics suma los archivos de todos los
+# workers (los gauges solo de los procesos que siguen vivos).
+#
+# Cuando un worker termina, mark_process_dead() (hook child_exit de gunicorn)
+# suma sus counters e histogramas a METRICS_DIR/metrics_dead.json y borra su
+# archivo: los totales no retroceden y la cantidad de archivos no crece con
+# cada worker reciclado.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEAD_FILE = 'metrics_dead.json'
+
+class Metric:
+    """Counter, gauge o histograma con etiquetas"""
+
+    def __init__(self, registry, name, documentation, kind, labelnames=(), buckets=None):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets or DEFAULT_BUCKETS) if kind == 'histogram' else None
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[self.key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            # [conteo por bucket..., suma, total]
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self.registry.lock:
+            values = [
+                [list(key), list(value) if isinstance(value, list) else value]
+                for key, value in self.values.items()
+            ]
+        return {
+            'documentation': self.documentation,
+            'kind': self.kind,
+            'labelnames': list(self.labelnames),
+            'buckets': list(self.buckets) if self.buckets else None,
+            'values': values
+        }
+
+class Registry:
+    """Registro de métricas del proceso"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.directory = None
+
+    def metric(self, name, documentation, kind, labelnames=(), buckets=None):
+        if name not in self.metrics:
+            self.metrics[name] = Metric(self, name, documentation, kind, labelnames, buckets)
+        return self.metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.metric(name, documentation, 'counter', labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.metric(name, documentation, 'gauge', labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=None):
+        return self.metric(name, documentation, 'histogram', labelnames, buckets)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        """Descartar los valores de este proceso (los heredados del maestro tras un fork)"""
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+    def flush(self):
+        """Guardar la copia de este proceso en METRICS_DIR"""
+        if not self.directory:
+            return
+
+        write_snapshot(os.path.join(self.directory, f'metrics_{os.getpid()}.json'), os.getpid(), self.snapshot())
+
+    def collect(self):
+        """Métricas de todos los procesos (o solo de este si no hay METRICS_DIR)"""
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            metrics = data['metrics']
+            if data['pid'] and not process_alive(data['pid']):
+                # Los gauges de un proceso terminado ya no aplican
+                metrics = {name: m for name, m in metrics.items() if m['kind'] != 'gauge'}
+            snapshots.append(metrics)
+
+        return snapshots
+
+    def render(self):
+        """Texto en formato de exposición de Prometheus"""
+        merged = merge_snapshots(self.collect())
+
+        lines = []
+        for name in sorted(merged):
+            data = merged[name]
+            lines.append(f'# HELP {name} {data["documentation"]}')
+            lines.append(f'# TYPE {name} {data["kind"]}')
+
+            for key, value in sorted(data['values'].items()):
+                labels = list(zip(data['labelnames'], key))
+                if data['kind'] != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(data['buckets'], value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + [("le", format_value(bound))])} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(value[-2])}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+
+        return '\n'.join(lines) + '\n'
+
+def merge_snapshots(snapshots):
+    """Sumar snapshots de varios procesos: {nombre: datos con values {clave: valor}}"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, {**data, 'values': {}})
+            for key, value in data['values']:
+                key = tuple(key)
+                if isinstance(value, list):
+                    current = target['values'].get(key) or [0] * len(value)
+                    target['values'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value
+    return merged
+
+def write_snapshot(path, pid, metrics):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'pid': pid, 'metrics': metrics}, f)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)['metrics']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def mark_process_dead(directory, pid):
+    """
+    Sumar los counters e histogramas de un worker terminado a metrics_dead.json
+    y borrar su archivo (los gauges de un proceso muerto se descartan).
+    Lo llama un único proceso (el maestro de gunicorn).
+    """
+    path = os.path.join(directory, f'metrics_{pid}.json')
+    metrics = read_snapshot(path)
+    if metrics is None:
+        return
+
+    dead_path = os.path.join(directory, DEAD_FILE)
+    snapshots = [
+        {name: data for name, data in snapshot.items() if data['kind'] != 'gauge'}
+        for snapshot in (read_snapshot(dead_path) or {}, metrics)
+    ]
+    merged = {
+        name: {**data, 'values': [[list(key), value] for key, value in data['values'].items()]}
+        for name, data in merge_snapshots(snapshots).items()
+    }
+    write_snapshot(dead_path, 0, merged)
+    os.remove(path)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP',
+    ('blueprint', 'endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'Peticiones HTTP en curso')
+DB_POOL_IN_USE = registry.gauge(
+    'db_pool_connections_in_use', 'Conexiones del pool prestadas en este momento', ('bind',))
+DB_POOL_HOLD = registry.histogram(
+    'db_pool_connection_hold_seconds', 'Tiempo entre el checkout y el checkin de una conexión',
+    ('bind',), buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+DB_POOL_CONNECTS = registry.counter(
+    'db_pool_connections_created_total', 'Conexiones nuevas abiertas por el pool', ('bind',))
+DB_QUERIES = registry.counter(
+    'db_queries_total', 'Sentencias SQL ejecutadas', ('bind',))
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Consultas a cachés en memoria por resultado', ('cache', 'result'))
+
+def cache_hit(cache, count=1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result='hit')
+
+def cache_miss(cache, count=1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result='miss')
+
+def instrument_engine(engine, bind):
+    """
+    Contar sentencias SQL y medir el uso del pool de un engine.
+
+    Los eventos de pool registrados sobre el engine pasan al pool nuevo que
+    crea engine.dispose(), así que sobreviven al fork de los workers.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc(bind=bind)
+
+    @event.listens_for(engine, 'connect')
+    def count_connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTS.inc(bind=bind)
+
+    @event.listens_for(engine, 'checkout')
+    def start_hold(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['metrics.checkout'] = time.perf_counter()
+        DB_POOL_IN_USE.inc(bind=bind)
+
+    @event.listens_for(engine, 'checkin')
+    def end_hold(dbapi_connection, connection_record):
+        start = connection_record.info.pop('metrics.checkout', None)
+        if start is not None:
+            DB_POOL_IN_USE.dec(bind=bind)
+            DB_POOL_HOLD.observe(time.perf_counter() - start, bind=bind)
+
+def init_metrics(app, db):
+    """Registrar los hooks de métricas en la app"""
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        registry.directory = directory
+        start_flush_thread(app.config.get('METRICS_FLUSH_INTERVAL', 5))
+
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            instrument_engine(engine, bind or 'default')
+
+    @app.before_request
+    def start_timer():
+        request.environ['metrics.start'] = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_latency(response):
+        start = request.environ.pop('metrics.start', None)
+        if start is not None:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                blueprint=request.blueprint or '',
+                endpoint=request.endpoint or 'unmatched',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+
+    @app.teardown_request
+    def record_failure(exc):
+        # Peticiones que terminaron con una excepción no manejada
+        start = request.environ.pop('metrics.start', None)
+        if start is not None:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                blueprint=request.blueprint or '',
+                endpoint=request.endpoint or 'unmatched',
+                method=request.method,
+                status=500
+            )
+
+def start_flush_thread(interval):
+    """Guardar periódicamente las métricas del proceso en METRICS_DIR"""
+    def loop():
+        # Último guardado al salir, después de que terminen los hilos de las peticiones.
+        # Se registra desde el hilo: el maestro de gunicorn (preload) nunca lo inicia
+        atexit.register(registry.flush)
+        while True:
+            time.sleep(interval)
+            try:
+                registry.flush()
+            except Exception as e:
+                print(f'Error guardando métricas: {e}')
+
+    return start_thread(loop, 'metrics-flush')
@@ -0,0 +1,124 @@
+from app import db
+from sqlalchemy import text
+from datetime import datetime
+import click
+
+# ===============================
+# MIGRACIONES VERSIONADAS
+# ===============================
+#
+# Cada migración es (id, descripción, [pasos]). Un paso es una sentencia SQL o
+# una función que recibe la conexión (para DDL que depende del esquema actual).
+# Se aplican en orden, una transacción por migración, y se registran en
+# schema_migrations para no repetirlas. Las nuevas migraciones se agregan al
+# final de la lista.
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+def add_column(table, column, definition):
+    """Paso que agrega una columna si la tabla existe y aún no la tiene"""
+    def step(connection):
+        columns = {row[1].lower() for row in connection.execute(text(f'PRAGMA table_info("{table}")'))}
+        if columns and column.lower() not in columns:
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'))
+    return step
+
+def archive_views(connection):
+    # Import diferido: app.archive depende de los modelos
+    from app.archive import ensure_views
+    ensure_views(connection)
+
+def backfill_product_listing(connection):
+    from app.product_listing import sync_listing
+    sync_listing(connection)
+
+MIGRATIONS = [
+    ('0001_hot_path_indexes', 'Índices para carrito, categorías, filtros de listado e imágenes', [
+        # Cada llamada al carrito filtra por usuario, venta (NULL) y producto
+        'CREATE INDEX IF NOT EXISTS ix_temporal_sales_user_sale_product '
+        'ON temporal_sales ("iD_User", "id_Sale", "id_Product")',
+        # La PK de PRODUC_Category empieza por id_Category: falta el join inverso
+        'CREATE INDEX IF NOT EXISTS ix_produc_category_product '
+        'ON "PRODUC_Category" ("id_Product")',
+        # Filtros min_price/max_price e in_stock del listado
+        'CREATE INDEX IF NOT EXISTS ix_product_price ON product ("Price")',
+        'CREATE INDEX IF NOT EXISTS ix_product_stock ON product ("Stock")',
+        # Imágenes de cada producto en los listados
+        'CREATE INDEX IF NOT EXISTS ix_produc_image_product ON produc_image ("id_Product")',
+    ]),
+    ('0002_cart_sweep_index', 'Índice para encontrar carritos abandonados por fecha', [
+        # Barrido de items sin venta (id_Sale NULL) más antiguos que un corte
+        'CREATE INDEX IF NOT EXISTS ix_temporal_sales_sale_date '
+        'ON temporal_sales ("id_Sale", "DateAdded")',
+    ]),
+    ('0003_product_version', 'Columna Version de product para el control de concurrencia optimista', [
+        # Bases creadas antes de la columna; create_all() solo crea tablas nuevas
+        add_column('product', 'Version', 'INTEGER NOT NULL DEFAULT 1'),
+    ]),
+    ('0004_sales_archive_views', 'Vistas sales_all y sales_detail_all, índices de las particiones y resumen por año', [
+        # Las particiones nuevas recrean las vistas y suman al resumen al archivar
+        archive_views,
+    ]),
+    ('0005_product_listing_backfill', 'Filas de product_listing para los productos existentes', [
+        # Después la mantienen los endpoints; lo escrito por fuera de la API
+        # se recoge con `flask sync-product-listing`
+        backfill_product_listing,
+    ]),
+]
+
+def ensure_migrations_table(connection):
+    connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ('
+        'id VARCHAR(100) PRIMARY KEY, description VARCHAR(255), applied_at VARCHAR(32) NOT NULL)'
+    ))
+
+def applied_migrations(engine):
+    """IDs de las migraciones ya aplicadas"""
+    with engine.begin() as connection:
+        ensure_migrations_table(connection)
+        return {row[0] for row in connection.execute(text(f'SELECT id FROM {MIGRATIONS_TABLE}'))}
+
+def pending_migrations(engine):
+    applied = applied_migrations(engine)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def run_migrations(engine=None):
+    """
+    Aplicar las migraciones pendientes.
+
+    Returns:
+        list: IDs de las migraciones aplicadas
+    """
+    engine = engine or db.engine
+    applied = []
+
+    for migration_id, description, statements in pending_migrations(engine):
+        with engine.begin() as connection:
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+            connection.execute(
+                text(f'INSERT INTO {MIGRATIONS_TABLE} (id, description, applied_at) VALUES (:id, :description, :applied_at)'),
+                {'id': migration_id, 'description': description, 'applied_at': datetime.utcnow().isoformat()}
+            )
+        applied.append(migration_id)
+
+    return applied
+
+def register_migration_commands(app):
+    """Comando `flask migrate` para aplicar o listar migraciones"""
+    @app.cli.command('migrate')
+    @click.option('--status', is_flag=True, help='Solo mostrar las migraciones pendientes')
+    def migrate_command(status):
+        """Aplicar las migraciones pendientes"""
+        if status:
+            applied = applied_migrations(db.engine)
+            for migration_id, description, _ in MIGRATIONS:
+                state = 'aplicada' if migration_id in applied else 'pendiente'
+                print(f'{migration_id}  {state}  {description}')
+            return
+
+        applied = run_migrations()
+        print(f'Migraciones aplicadas: {", ".join(applied) if applied else "ninguna"}')
@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime
+import json
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Tabla de asociación para User-Role (Many-to-Many)
@@ -11,7 +12,8 @@ user_roles = db.Table('UserRole',
 # Tabla de asociación para Product-Category (Many-to-Many)
 product_categories = db.Table('PRODUC_Category',
     db.Column('id_Category', db.Integer, db.ForeignKey('category.id_Category'), primary_key=True),
-    db.Column('id_Product', db.Integer, db.ForeignKey('product.id_Product'), primary_key=True)
+    db.Column('id_Product', db.Integer, db.ForeignKey('product.id_Product'), primary_key=True),
+    db.Index('ix_produc_category_product', 'id_Product')
 )
 
 class Country(db.Model):
@@ -134,11 +136,19 @@ class Category(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'product'
+    __table_args__ = (
+        db.Index('ix_product_price', 'Price'),
+        db.Index('ix_product_stock', 'Stock'),
+    )
     
     id_Product = db.Column(db.Integer, primary_key=True, autoincrement=True)
     Price = db.Column(db.Float, nullable=False)
     ProductName = db.Column(db.String(200), nullable=False, index=True)
     Stock = db.Column(db.Integer, nullable=False, default=0)
+    Version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    # Control de concurrencia optimista: cada UPDATE exige la versión leída
+    __mapper_args__ = {'version_id_col': Version}
     
     # Relaciones Many-to-Many con Categories
     categories = db.relationship('Category', secondary=product_categories, lazy='subquery',
@@ -154,7 +164,8 @@ class Product(db.Model):
             'id_Product': self.id_Product,
             'ProductName': self.ProductName,
             'Price': self.Price,
-            'Stock': self.Stock
+            'Stock': self.Stock,
+            'Version': self.Version
         }
         
         if include_categories:
@@ -167,6 +178,9 @@ class Product(db.Model):
 
 class PRODUC_Image(db.Model):
     __tablename__ = 'produc_image'
+    __table_args__ = (
+        db.Index('ix_produc_image_product', 'id_Product'),
+    )
     
     id_image = db.Column(db.Integer, primary_key=True, autoincrement=True)
     id_Category = db.Column(db.Integer, db.ForeignKey('category.id_Category'), nullable=True)
@@ -214,6 +228,10 @@ class Sales(db.Model):
 
 class TemporalSales(db.Model):
     __tablename__ = 'temporal_sales'
+    __table_args__ = (
+        db.Index('ix_temporal_sales_user_sale_product', 'iD_User', 'id_Sale', 'id_Product'),
+        db.Index('ix_temporal_sales_sale_date', 'id_Sale', 'DateAdded'),
+    )
     
     id_TemporalSales = db.Column(db.Integer, primary_key=True, autoincrement=True)
     iD_User = db.Column(db.Integer, db.ForeignKey('users.iD_User'), nullable=False)
@@ -234,6 +252,27 @@ class TemporalSales(db.Model):
             'subtotal': self.product.Price * self.quantity if self.product else 0
         }
 
+class TemporalSalesArchive(db.Model):
+    """Items de carritos abandonados retirados de temporal_sales"""
+    __tablename__ = 'temporal_sales_archive'
+    
+    id_TemporalSales = db.Column(db.Integer, primary_key=True)
+    iD_User = db.Column(db.Integer, nullable=False, index=True)
+    id_Product = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    DateAdded = db.Column(db.DateTime)
+    ArchivedAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id_TemporalSales': self.id_TemporalSales,
+            'iD_User': self.iD_User,
+            'id_Product': self.id_Product,
+            'quantity': self.quantity,
+            'DateAdded': self.DateAdded.isoformat() if self.DateAdded else None,
+            'ArchivedAt': self.ArchivedAt.isoformat() if self.ArchivedAt else None
+        }
+
 class SalesDetail(db.Model):
     __tablename__ = 'sales_detail'
     
@@ -255,4 +294,162 @@ class SalesDetail(db.Model):
             'amount': self.amount,
             'ValueSale': self.ValueSale,
             'product': self.product.to_dict() if self.product else None
-        }
\ No newline at end of file
+        }
+
+class SalesArchiveSummary(db.Model):
+    """Ventas e ingresos de cada partición de archivo, para no recorrerlas al sumar totales"""
+    __tablename__ = 'sales_archive_summary'
+
+    Year = db.Column(db.Integer, primary_key=True)
+    SalesCount = db.Column(db.Integer, nullable=False, default=0)
+    Revenue = db.Column(db.Float, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'Year': self.Year,
+            'SalesCount': self.SalesCount,
+            'Revenue': self.Revenue
+        }
+
+class StockCounter(db.Model):
+    __tablename__ = 'stock_counter'
+    
+    id_Product = db.Column(db.Integer, db.ForeignKey('product.id_Product'), primary_key=True)
+    Reserved = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'id_Product': self.id_Product,
+            'Reserved': self.Reserved
+        }
+
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservation'
+    __table_args__ = (
+        db.UniqueConstraint('iD_User', 'id_Product', name='uq_stock_reservation_user_product'),
+    )
+    
+    id_Reservation = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    iD_User = db.Column(db.Integer, db.ForeignKey('users.iD_User'), nullable=False)
+    id_Product = db.Column(db.Integer, db.ForeignKey('product.id_Product'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    ExpiresAt = db.Column(db.DateTime, nullable=False, index=True)
+    DateCreated = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id_Reservation': self.id_Reservation,
+            'iD_User': self.iD_User,
+            'id_Product': self.id_Product,
+            'quantity': self.quantity,
+            'ExpiresAt': self.ExpiresAt.isoformat() if self.ExpiresAt else None,
+            'DateCreated': self.DateCreated.isoformat() if self.DateCreated else None
+        }
+
+class ProductCooccurrence(db.Model):
+    __tablename__ = 'product_cooccurrence'
+    
+    id_Product = db.Column(db.Integer, db.ForeignKey('product.id_Product'), primary_key=True)
+    id_Related = db.Column(db.Integer, db.ForeignKey('product.id_Product'), primary_key=True)
+    Times = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'id_Product': self.id_Product,
+            'id_Related': self.id_Related,
+            'Times': self.Times
+        }
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_event'
+    __table_args__ = (
+        db.Index('ix_outbox_event_pending', 'ProcessedAt', 'NextAttemptAt'),
+    )
+    
+    id_Event = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    EventType = db.Column(db.String(100), nullable=False)
+    Payload = db.Column(db.Text, nullable=False)
+    DateCreated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    Attempts = db.Column(db.Integer, nullable=False, default=0)
+    NextAttemptAt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    LockedBy = db.Column(db.String(64))
+    LockedUntil = db.Column(db.DateTime)
+    ProcessedAt = db.Column(db.DateTime)
+    LastError = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'id_Event': self.id_Event,
+            'EventType': self.EventType,
+            'Payload': self.Payload,
+            'DateCreated': self.DateCreated.isoformat() if self.DateCreated else None,
+            'Attempts': self.Attempts,
+            'NextAttemptAt': self.NextAttemptAt.isoformat() if self.NextAttemptAt else None,
+            'ProcessedAt': self.ProcessedAt.isoformat() if self.ProcessedAt else None,
+            'LastError': self.LastError
+        }
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_key'
+    
+    iD_User = db.Column(db.Integer, db.ForeignKey('users.iD_User'), primary_key=True)
+    Key = db.Column(db.String(255), primary_key=True)
+    Fingerprint = db.Column(db.String(64), nullable=False)
+    StatusCode = db.Column(db.Integer)  # None mientras la primera ejecución está en curso
+    ResponseBody = db.Column(db.Text)
+    LockedUntil = db.Column(db.DateTime, nullable=False)
+    ExpiresAt = db.Column(db.DateTime, nullable=False, index=True)
+    DateCreated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'iD_User': self.iD_User,
+            'Key': self.Key,
+            'StatusCode': self.StatusCode,
+            'ExpiresAt': self.ExpiresAt.isoformat() if self.ExpiresAt else None,
+            'DateCreated': self.DateCreated.isoformat() if self.DateCreated else None
+        }
+
+class ProductListing(db.Model):
+    __tablename__ = 'product_listing'
+    __table_args__ = (
+        db.Index('ix_product_listing_name_key', 'NameKey'),
+        db.Index('ix_product_listing_price', 'Price'),
+        # LIKE '%,N,%' no puede buscar en el índice y el listado (todas las
+        # columnas) recorre la tabla; el índice solo cubre el conteo de la
+        # paginación, que lee únicamente CategoryIds
+        db.Index('ix_product_listing_category_ids', 'CategoryIds'),
+    )
+    
+    id_Product = db.Column(db.Integer, db.ForeignKey('product.id_Product'), primary_key=True)
+    ProductName = db.Column(db.String(200), nullable=False)
+    Price = db.Column(db.Float, nullable=False)
+    Stock = db.Column(db.Integer, nullable=False, default=0)
+    Version = db.Column(db.Integer, nullable=False, default=1)
+    Categories = db.Column(db.Text, nullable=False, default='[]')  # JSON: [{id_Category, CategoryName}]
+    CategoryIds = db.Column(db.String(500), nullable=False, default=',')  # ',1,4,' para filtrar con LIKE
+    Images = db.Column(db.Text, nullable=False, default='[]')  # JSON: imágenes como PRODUC_Image.to_dict()
+    MainImagePath = db.Column(db.String(500))
+    MainImageAlt = db.Column(db.String(200))
+    NameKey = db.Column(db.String(200), nullable=False)  # nombre sin acentos ni mayúsculas, para ordenar
+    
+    def to_dict(self, include_categories=False, include_images=False):
+        data = {
+            'id_Product': self.id_Product,
+            'ProductName': self.ProductName,
+            'Price': self.Price,
+            'Stock': self.Stock,
+            'Version': self.Version,
+            'main_image': {
+                'pathimage': self.MainImagePath,
+                'alt_text': self.MainImageAlt
+            } if self.MainImagePath else None
+        }
+        
+        if include_categories:
+            data['categories'] = json.loads(self.Categories)
+        
+        if include_images:
+            data['images'] = json.loads(self.Images)
+        
+        return data
@@ -0,0 +1,265 @@
+from flask import current_app
+from app import db
+from app.models import OutboxEvent
+from app.background import start_thread
+from sqlalchemy import select, func, or_
+from datetime import datetime, timedelta
+import json
+import threading
+import time
+import urllib.request
+import uuid
+
+# ===============================
+# OUTBOX TRANSACCIONAL
+# ===============================
+#
+# Los efectos secundarios de una operación (facturación, analítica, correos)
+# se guardan como filas de outbox_event en la misma transacción que la
+# operación, así no se pierden ni se publican eventos de transacciones que
+# fallaron. Un hilo de fondo (o `flask outbox-drain`) los reparte por lotes a
+# los destinos configurados en OUTBOX_SINKS, con reintentos y backoff.
+#
+# La entrega es "al menos una vez": un evento puede llegar repetido a un
+# destino (por ejemplo, si otro destino del mismo lote falló), así que los
+# consumidores deben usar `id` para descartar duplicados.
+
+LEASE_SECONDS = 60
+MAX_BACKOFF_SECONDS = 300
+
+wakeup = threading.Event()
+
+def enqueue(event_type, payload):
+    """
+    Agregar un evento a la sesión actual. No hace commit: el evento se
+    guarda junto con el resto de la transacción.
+    """
+    event = OutboxEvent(
+        EventType=event_type,
+        Payload=json.dumps(payload, ensure_ascii=False, default=str),
+        DateCreated=datetime.utcnow(),
+        NextAttemptAt=datetime.utcnow()
+    )
+    db.session.add(event)
+    return event
+
+def notify():
+    """Despertar al worker de este proceso tras confirmar eventos nuevos"""
+    wakeup.set()
+
+def serialize(event):
+    return {
+        'id': event.id_Event,
+        'type': event.EventType,
+        'payload': json.loads(event.Payload),
+        'created_at': event.DateCreated.isoformat() if event.DateCreated else None,
+        'attempt': event.Attempts + 1
+    }
+
+# ===============================
+# DESTINOS
+# ===============================
+
+class FileSink:
+    """Agrega cada evento como una línea JSON a un archivo (pruebas y auditoría)"""
+
+    def __init__(self, app):
+        self.path = app.config['OUTBOX_FILE']
+        self.lock = threading.Lock()
+
+    def send(self, events):
+        lines = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+class LogSink:
+    """Imprime cada evento en consola"""
+
+    def __init__(self, app):
+        pass
+
+    def send(self, events):
+        for event in events:
+            print(f'[outbox] {event["type"]} #{event["id"]}: {json.dumps(event["payload"], ensure_ascii=False)}')
+
+class WebhookSink:
+    """Envía cada lote como un POST JSON a OUTBOX_WEBHOOK_URL"""
+
+    def __init__(self, app):
+        self.url = app.config['OUTBOX_WEBHOOK_URL']
+        self.timeout = app.config.get('OUTBOX_WEBHOOK_TIMEOUT', 5)
+        if not self.url:
+            raise ValueError('OUTBOX_WEBHOOK_URL es requerido para el destino webhook')
+
+    def send(self, events):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'events': events}, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f'El webhook respondió {response.status}')
+
+SINKS = {
+    'file': FileSink,
+    'log': LogSink,
+    'webhook': WebhookSink
+}
+
+def register_sink(name, factory):
+    """Registrar un destino: `factory(app)` devuelve un objeto con `send(events)`"""
+    SINKS[name] = factory
+
+def configured_sinks(app):
+    names = [name.strip() for name in app.config.get('OUTBOX_SINKS', '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in SINKS]
+    if unknown:
+        raise ValueError(f'Destinos de outbox desconocidos: {", ".join(unknown)}')
+    return [(name, SINKS[name](app)) for name in names]
+
+# ===============================
+# ENTREGA
+# ===============================
+
+def claim_batch(batch_size, max_attempts, now):
+    """
+    Reservar hasta `batch_size` eventos pendientes para este worker.
+
+    Un UPDATE condicional marca los eventos con un token y un plazo; si el
+    worker muere, otro los toma cuando vence el plazo.
+    """
+    token = uuid.uuid4().hex
+    available = or_(OutboxEvent.LockedUntil.is_(None), OutboxEvent.LockedUntil < now)
+    pending = [
+        OutboxEvent.ProcessedAt.is_(None),
+        OutboxEvent.NextAttemptAt <= now,
+        OutboxEvent.Attempts < max_attempts,
+        available
+    ]
+
+    ids = db.session.execute(
+        select(OutboxEvent.id_Event).where(*pending).order_by(OutboxEvent.id_Event).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return []
+
+    db.session.execute(
+        OutboxEvent.__table__.update().where(
+            OutboxEvent.id_Event.in_(ids), *pending
+        ).values(LockedBy=token, LockedUntil=now + timedelta(seconds=LEASE_SECONDS))
+    )
+    db.session.commit()
+
+    return OutboxEvent.query.filter_by(LockedBy=token).order_by(OutboxEvent.id_Event).all()
+
+def deliver(sinks, events):
+    """
+    Enviar los eventos a todos los destinos.
+
+    Returns:
+        dict: {id_Event: error} de los eventos que fallaron
+    """
+    failures = {}
+    payloads = {event.id_Event: serialize(event) for event in events}
+
+    for name, sink in sinks:
+        batch = [payloads[event_id] for event_id in payloads if event_id not in failures]
+        if not batch:
+            break
+        try:
+            sink.send(batch)
+        except Exception:
+            # Reenviar uno por uno para no reintentar todo el lote por un evento
+            for payload in batch:
+                try:
+                    sink.send([payload])
+                except Exception as e:
+                    failures[payload['id']] = f'{name}: {e}'
+
+    return failures
+
+def drain(batch_size=None, max_batches=None):
+    """
+    Entregar los eventos pendientes por lotes.
+
+    Returns:
+        tuple: (eventos entregados, eventos que fallaron en este intento)
+    """
+    app = current_app._get_current_object()
+    sinks = configured_sinks(app)
+    if not sinks:
+        return 0, 0
+
+    batch_size = batch_size or app.config['OUTBOX_BATCH_SIZE']
+    max_attempts = app.config['OUTBOX_MAX_ATTEMPTS']
+    delivered = failed = batches = 0
+
+    while max_batches is None or batches < max_batches:
+        events = claim_batch(batch_size, max_attempts, datetime.utcnow())
+        if not events:
+            break
+        batches += 1
+
+        failures = deliver(sinks, events)
+        now = datetime.utcnow()
+        for event in events:
+            event.LockedBy = None
+            event.LockedUntil = None
+            if event.id_Event in failures:
+                event.Attempts += 1
+                event.LastError = failures[event.id_Event][:1000]
+                event.NextAttemptAt = now + timedelta(seconds=min(2 ** event.Attempts, MAX_BACKOFF_SECONDS))
+            else:
+                event.ProcessedAt = now
+        db.session.commit()
+
+        delivered += len(events) - len(failures)
+        failed += len(failures)
+
+    return delivered, failed
+
+def outbox_status():
+    """Conteo de eventos por estado"""
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    row = db.session.execute(select(
+        func.count().filter(OutboxEvent.ProcessedAt.isnot(None)),
+        func.count().filter(OutboxEvent.ProcessedAt.is_(None), OutboxEvent.Attempts < max_attempts),
+        func.count().filter(OutboxEvent.ProcessedAt.is_(None), OutboxEvent.Attempts >= max_attempts),
+        func.min(OutboxEvent.DateCreated).filter(OutboxEvent.ProcessedAt.is_(None))
+    )).one()
+    return {
+        'processed': row[0],
+        'pending': row[1],
+        'failed': row[2],
+        'oldest_pending': row[3].isoformat() if row[3] else None
+    }
+
+def start_outbox_worker(app, interval):
+    """Entregar eventos en un hilo de fondo cada `interval` segundos o al recibir notify()"""
+    def loop():
+        while True:
+            wakeup.wait(interval)
+            wakeup.clear()
+            try:
+                with app.app_context():
+                    drain()
+            except Exception as e:
+                print(f'Error entregando eventos del outbox: {e}')
+
+    return start_thread(loop, 'outbox-worker')
+
+def init_outbox(app):
+    """Comandos del outbox y worker de fondo si hay destinos configurados"""
+    @app.cli.command('outbox-drain')
+    def outbox_drain_command():
+        """Entregar los eventos pendientes del outbox"""
+        delivered, failed = drain()
+        print(f'Eventos entregados: {delivered}, fallidos: {failed}')
+        print(outbox_status())
+
+    # Validar los destinos al arrancar
+    if configured_sinks(app) and app.config['OUTBOX_POLL_INTERVAL']:
+        start_outbox_worker(app, app.config['OUTBOX_POLL_INTERVAL'])
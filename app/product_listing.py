@@ -0,0 +1,240 @@
+from app import db
+from app.models import Product, Category, PRODUC_Image, ProductListing, product_categories
+from sqlalchemy import select
+import click
+import json
+import time
+import unicodedata
+
+# ===============================
+# LISTADO DESNORMALIZADO DE PRODUCTOS
+# ===============================
+#
+# product_listing tiene una fila por producto con todo lo que muestran el
+# listado y las páginas de categoría: nombres de categorías, imágenes, la
+# imagen principal y claves de orden precalculadas. Esas lecturas consultan
+# una sola tabla en lugar de product + PRODUC_Category + category +
+# produc_image.
+#
+# Los endpoints que modifican productos, sus categorías o sus imágenes
+# llaman a estas funciones antes del commit, así la fila cambia en la misma
+# transacción que los datos de origen. Ninguna función hace commit.
+#
+# La migración 0005_product_listing_backfill llena la tabla una vez. Lo que
+# se escriba después por fuera de la API (scripts, SQL directo) se recoge con
+# `flask --app app sync-product-listing`, que agrega las filas que faltan y
+# borra las de productos eliminados, o con `rebuild-product-listing`.
+
+listing = ProductListing.__table__
+products = Product.__table__
+images = PRODUC_Image.__table__
+
+# Productos por consulta (límite de parámetros de SQLite)
+CHUNK_SIZE = 500
+
+SORTS = {
+    'id': (listing.c.id_Product,),
+    'name': (listing.c.NameKey, listing.c.id_Product),
+    'price': (listing.c.Price, listing.c.id_Product),
+    'price_desc': (listing.c.Price.desc(), listing.c.id_Product),
+    'newest': (listing.c.id_Product.desc(),),
+}
+
+def name_key(name):
+    """Nombre en minúsculas y sin acentos: 'Álbum' se ordena junto a 'album'"""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def chunks(ids):
+    ids = sorted(set(ids))
+    for position in range(0, len(ids), CHUNK_SIZE):
+        yield ids[position:position + CHUNK_SIZE]
+
+def build_rows(product_ids, executor=None):
+    """Filas de product_listing calculadas desde las tablas de origen"""
+    executor = executor if executor is not None else db.session
+    rows = {}
+    for product_id, name, price, stock, version in executor.execute(
+        select(products.c.id_Product, products.c.ProductName, products.c.Price, products.c.Stock, products.c.Version)
+        .where(products.c.id_Product.in_(product_ids))
+    ):
+        rows[product_id] = {
+            'id_Product': product_id,
+            'ProductName': name,
+            'Price': price,
+            'Stock': stock,
+            'Version': version,
+            'NameKey': name_key(name),
+            'categories': [],
+            'images': []
+        }
+    if not rows:
+        return []
+
+    for product_id, category_id, category_name in executor.execute(
+        select(product_categories.c.id_Product, Category.id_Category, Category.CategoryName)
+        .join(Category, Category.id_Category == product_categories.c.id_Category)
+        .where(product_categories.c.id_Product.in_(list(rows)))
+        .order_by(product_categories.c.id_Product, Category.id_Category)
+    ):
+        rows[product_id]['categories'].append({'id_Category': category_id, 'CategoryName': category_name})
+
+    for image in executor.execute(
+        select(images).where(images.c.id_Product.in_(list(rows))).order_by(images.c.id_Product, images.c.id_image)
+    ):
+        rows[image.id_Product]['images'].append({
+            'id_image': image.id_image,
+            'id_Category': image.id_Category,
+            'id_Product': image.id_Product,
+            'pathimage': image.pathimage,
+            'alt_text': image.alt_text,
+            'is_main_image': bool(image.is_main_image)
+        })
+
+    result = []
+    for row in rows.values():
+        categories = row.pop('categories')
+        product_images = row.pop('images')
+        # La imagen marcada como principal, o la primera si ninguna lo está
+        main = next((image for image in product_images if image['is_main_image']),
+                    product_images[0] if product_images else None)
+        result.append({
+            **row,
+            'Categories': json.dumps(categories, ensure_ascii=False),
+            'CategoryIds': ',' + ''.join(f'{category["id_Category"]},' for category in categories),
+            'Images': json.dumps(product_images, ensure_ascii=False),
+            'MainImagePath': main['pathimage'] if main else None,
+            'MainImageAlt': main['alt_text'] if main else None
+        })
+    return result
+
+def replace_rows(executor, product_ids):
+    rows = build_rows(product_ids, executor)
+    executor.execute(listing.delete().where(listing.c.id_Product.in_(product_ids)))
+    if rows:
+        executor.execute(listing.insert(), rows)
+    return len(rows)
+
+def refresh(product_ids):
+    """Recalcular las filas de estos productos (y borrar las de los que ya no existen)"""
+    # Que las consultas vean los cambios pendientes de la sesión
+    db.session.flush()
+    return sum(replace_rows(db.session, chunk) for chunk in chunks(product_ids))
+
+def refresh_stock(product_ids):
+    """Copiar Stock y Version (checkout y actualización de stock, sin recalcular la fila)"""
+    db.session.flush()
+    for chunk in chunks(product_ids):
+        db.session.execute(
+            listing.update().where(listing.c.id_Product.in_(chunk)).values(
+                Stock=select(products.c.Stock).where(products.c.id_Product == listing.c.id_Product).scalar_subquery(),
+                Version=select(products.c.Version).where(products.c.id_Product == listing.c.id_Product).scalar_subquery()
+            )
+        )
+
+def refresh_category(category_id):
+    """Recalcular los productos de una categoría (por ejemplo, tras renombrarla)"""
+    product_ids = db.session.execute(
+        select(product_categories.c.id_Product).where(product_categories.c.id_Category == category_id)
+    ).scalars().all()
+    return refresh(product_ids)
+
+def remove(product_ids):
+    for chunk in chunks(product_ids):
+        db.session.execute(listing.delete().where(listing.c.id_Product.in_(chunk)))
+
+# ===============================
+# RECONSTRUCCIÓN
+# ===============================
+
+def rebuild_listing(batch_size=CHUNK_SIZE):
+    """
+    Recalcular todo product_listing por bloques de productos (una
+    transacción por bloque).
+
+    Returns:
+        dict: filas escritas, filas huérfanas borradas y segundos
+    """
+    start = time.perf_counter()
+    written = 0
+    last_id = 0
+    while True:
+        product_ids = db.session.execute(
+            select(products.c.id_Product).where(products.c.id_Product > last_id)
+            .order_by(products.c.id_Product).limit(batch_size)
+        ).scalars().all()
+        if not product_ids:
+            break
+        written += refresh(product_ids)
+        db.session.commit()
+        last_id = product_ids[-1]
+
+    removed = remove_orphans()
+    db.session.commit()
+    return {'rows': written, 'removed': removed, 'seconds': time.perf_counter() - start}
+
+def remove_orphans(executor=None):
+    executor = executor if executor is not None else db.session
+    return executor.execute(
+        listing.delete().where(listing.c.id_Product.notin_(select(products.c.id_Product)))
+    ).rowcount
+
+def sync_listing(connection=None):
+    """
+    Agregar las filas de productos que no están en product_listing y borrar
+    las de productos eliminados. No detecta cambios hechos por fuera de la
+    API a productos que ya tienen fila: para eso está rebuild_listing().
+
+    Con `connection` (migración) escribe en su transacción sin hacer commit;
+    sin ella hace un commit por bloque con la sesión.
+
+    Returns:
+        int: filas agregadas o borradas
+    """
+    executor = connection if connection is not None else db.session
+    missing = executor.execute(
+        select(products.c.id_Product).where(products.c.id_Product.notin_(select(listing.c.id_Product)))
+    ).scalars().all()
+    changed = 0
+    for chunk in chunks(missing):
+        changed += replace_rows(executor, chunk)
+        if connection is None:
+            db.session.commit()
+    changed += remove_orphans(executor)
+    if connection is None:
+        db.session.commit()
+    return changed
+
+# ===============================
+# LECTURA
+# ===============================
+
+def listing_query(search='', category_id=None, min_price=None, max_price=None, in_stock=False, sort='id'):
+    """Query de ProductListing con los filtros del listado"""
+    query = ProductListing.query
+    if search:
+        query = query.filter(ProductListing.ProductName.contains(search))
+    if category_id:
+        query = query.filter(ProductListing.CategoryIds.contains(f',{int(category_id)},'))
+    if min_price is not None:
+        query = query.filter(ProductListing.Price >= min_price)
+    if max_price is not None:
+        query = query.filter(ProductListing.Price <= max_price)
+    if in_stock:
+        query = query.filter(ProductListing.Stock > 0)
+    return query.order_by(*SORTS[sort])
+
+def init_product_listing(app):
+    """Comandos de reconstrucción y sincronización"""
+    @app.cli.command('rebuild-product-listing')
+    @click.option('--batch-size', type=int, default=CHUNK_SIZE, help='Productos por transacción')
+    def rebuild_product_listing_command(batch_size):
+        """Recalcular product_listing desde product, categorías e imágenes"""
+        result = rebuild_listing(batch_size)
+        print(f'Filas escritas: {result["rows"]}, huérfanas borradas: {result["removed"]} '
+              f'({result["seconds"]:.2f} s)')
+
+    @app.cli.command('sync-product-listing')
+    def sync_product_listing_command():
+        """Agregar las filas que faltan en product_listing y borrar las de productos eliminados"""
+        print(f'Filas agregadas o borradas: {sync_listing()}')
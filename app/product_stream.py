@@ -0,0 +1,182 @@
+from flask import current_app
+from app import db
+from app.models import Product
+from app.metrics import registry
+from sqlalchemy import select
+import threading
+import time
+
+# ===============================
+# CAMBIOS DE STOCK Y PRECIO EN VIVO (SSE)
+# ===============================
+#
+# GET /api/products/stream?ids= mantiene una conexión abierta por cliente y le
+# envía un evento cada vez que cambian el Stock o el Price de sus productos.
+#
+# Los endpoints que modifican productos llaman a publish() después del
+# commit; publish() solo marca los ids y despierta un único hilo por proceso.
+# Ese hilo espera PRODUCT_STREAM_COALESCE_SECONDS para juntar ráfagas (un
+# checkout tras otro sobre el mismo producto), lee el estado de todos los
+# productos marcados con una consulta y lo reparte a los suscriptores. Cada
+# suscriptor guarda solo el último estado de cada producto, así que un
+# cliente lento recibe el valor actual, no la cola de cambios intermedios.
+#
+# Los cambios hechos por otros workers no pasan por publish(): cada
+# PRODUCT_STREAM_POLL_INTERVAL segundos el hilo relee los productos con
+# suscriptores y publica los que cambiaron.
+
+# Productos leídos por consulta (límite de parámetros de SQLite)
+LOAD_CHUNK_SIZE = 500
+
+STREAM_SUBSCRIBERS = registry.gauge(
+    'product_stream_subscribers', 'Conexiones abiertas a /api/products/stream')
+STREAM_FANOUTS = registry.counter(
+    'product_stream_fanouts_total', 'Cambios de producto repartidos a los suscriptores')
+
+def load_states(product_ids):
+    """{id_Product: estado} de los productos que existen"""
+    product_ids = list(product_ids)
+    states = {}
+    for position in range(0, len(product_ids), LOAD_CHUNK_SIZE):
+        for product_id, stock, price, version in db.session.execute(
+            select(Product.id_Product, Product.Stock, Product.Price, Product.Version)
+            .where(Product.id_Product.in_(product_ids[position:position + LOAD_CHUNK_SIZE]))
+        ):
+            states[product_id] = {
+                'id_Product': product_id,
+                'Stock': stock,
+                'Price': float(price) if price is not None else None,
+                'Version': version
+            }
+    return states
+
+def deleted_state(product_id):
+    return {'id_Product': product_id, 'deleted': True}
+
+class Subscription:
+    """Cambios pendientes de un cliente: el último estado de cada producto"""
+
+    def __init__(self, product_ids):
+        self.product_ids = frozenset(product_ids)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.closed = False
+
+    def push(self, product_id, state):
+        with self.lock:
+            self.pending[product_id] = state
+        self.ready.set()
+
+    def wait(self, timeout):
+        """Estados cambiados desde la última llamada, o [] si pasó `timeout` sin cambios"""
+        if not self.ready.wait(timeout):
+            return []
+        with self.lock:
+            self.ready.clear()
+            changes, self.pending = self.pending, {}
+        return list(changes.values())
+
+class ProductHub:
+    """Suscripciones por producto y el hilo que reparte los cambios"""
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.states = {}
+        self.dirty = set()
+        self.count = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.app = None
+
+    def subscribe(self, product_ids, states):
+        """Registrar un cliente con el estado que ya se le envió"""
+        subscription = Subscription(product_ids)
+        with self.lock:
+            for product_id in subscription.product_ids:
+                self.subscriptions.setdefault(product_id, set()).add(subscription)
+                self.states.setdefault(product_id, states.get(product_id))
+            self.count += 1
+        STREAM_SUBSCRIBERS.inc()
+        self.start(current_app._get_current_object())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            for product_id in subscription.product_ids:
+                subscribers = self.subscriptions.get(product_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[product_id]
+                    self.states.pop(product_id, None)
+            self.count -= 1
+        STREAM_SUBSCRIBERS.dec()
+
+    def publish(self, product_ids):
+        """Marcar productos modificados (llamar después del commit)"""
+        with self.lock:
+            watched = [product_id for product_id in product_ids if product_id in self.subscriptions]
+            self.dirty.update(watched)
+        if watched:
+            self.wakeup.set()
+
+    def start(self, app):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.app = app
+            self.thread = threading.Thread(target=self.run, name='product-stream', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            poll_interval = self.app.config['PRODUCT_STREAM_POLL_INTERVAL'] or None
+            woken = self.wakeup.wait(poll_interval)
+            if woken:
+                # Juntar los cambios que lleguen durante la ventana
+                time.sleep(self.app.config['PRODUCT_STREAM_COALESCE_SECONDS'])
+            self.wakeup.clear()
+
+            with self.lock:
+                if woken:
+                    product_ids, self.dirty = self.dirty, set()
+                else:
+                    product_ids = set(self.subscriptions)
+            if not product_ids:
+                continue
+
+            try:
+                with self.app.app_context():
+                    states = load_states(product_ids)
+                self.fan_out(product_ids, states)
+            except Exception as e:
+                print(f'Error publicando cambios de productos: {e}')
+
+    def fan_out(self, product_ids, states):
+        """Enviar a cada suscriptor los productos cuyo Stock o Price cambió"""
+        with self.lock:
+            for product_id in product_ids:
+                subscribers = self.subscriptions.get(product_id)
+                if not subscribers:
+                    continue
+                state = states.get(product_id) or deleted_state(product_id)
+                previous = self.states.get(product_id)
+                if previous is not None and all(
+                    previous.get(field) == state.get(field) for field in ('Stock', 'Price', 'deleted')
+                ):
+                    continue
+                self.states[product_id] = state
+                for subscription in subscribers:
+                    subscription.push(product_id, state)
+                STREAM_FANOUTS.inc()
+
+hub = ProductHub()
+
+def publish(product_ids):
+    hub.publish(product_ids)
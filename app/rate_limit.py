@@ -0,0 +1,241 @@
+from flask import request, jsonify, g
+from app.security import decode_request_token
+from app.metrics import registry
+import itertools
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# ===============================
+# LÍMITE DE PETICIONES (TOKEN BUCKET)
+# ===============================
+#
+# Cada regla asigna a un endpoint un bucket por IP o por usuario: `capacity`
+# peticiones seguidas como máximo, que se recargan a capacity/seconds por
+# segundo. El control corre en un before_request, antes de que el endpoint
+# consulte la base de datos o verifique la contraseña, y responde 429 con
+# Retry-After cuando el bucket está vacío.
+#
+# Por defecto los buckets viven en memoria, repartidos en shards con su
+# propio lock, así que cada worker cuenta por separado. Con
+# RATE_LIMIT_STORAGE=sqlite se comparten entre procesos en un archivo SQLite
+# aparte (RATE_LIMIT_SQLITE_PATH), para no competir por el lock de escritura
+# de la base de datos principal.
+
+# endpoint=ámbito:capacidad/segundos, separadas por coma; un endpoint puede
+# tener una regla por IP y otra por usuario
+DEFAULT_RULES = (
+    'auth.login=ip:10/60,'
+    'auth.register=ip:5/60,'
+    'auth.change_password=user:5/60,'
+    'sales.add_to_cart=user:60/60,'
+    'sales.add_to_cart=ip:120/60,'
+    'sales.bulk_update_cart=user:30/60,'
+    'sales.update_cart_item=user:60/60,'
+    'sales.remove_from_cart=user:60/60,'
+    'sales.clear_cart=user:20/60,'
+    'sales.checkout=user:10/60'
+)
+SCOPES = ('ip', 'user')
+
+RATE_LIMITED = registry.counter(
+    'http_rate_limited_total', 'Peticiones rechazadas por el límite de peticiones', ('endpoint', 'scope'))
+
+class Rule:
+    def __init__(self, endpoint, scope, capacity, seconds):
+        self.endpoint = endpoint
+        self.scope = scope
+        self.capacity = capacity
+        self.seconds = seconds
+        self.rate = capacity / seconds
+
+def parse_rules(text):
+    """{endpoint: [Rule]} a partir de 'endpoint=ámbito:capacidad/segundos,...'"""
+    rules = {}
+    for item in (part.strip() for part in text.split(',')):
+        if not item:
+            continue
+        try:
+            endpoint, spec = item.split('=')
+            scope, limit = spec.split(':')
+            capacity, seconds = limit.split('/')
+            rule = Rule(endpoint.strip(), scope.strip(), int(capacity), float(seconds))
+        except ValueError:
+            raise ValueError(f'Regla de límite inválida: {item!r} (formato endpoint=ip|user:capacidad/segundos)')
+        if rule.scope not in SCOPES or rule.capacity < 1 or rule.seconds <= 0:
+            raise ValueError(f'Regla de límite inválida: {item!r}')
+        rules.setdefault(rule.endpoint, []).append(rule)
+    return rules
+
+# ===============================
+# ALMACENES
+# ===============================
+
+class Shard:
+    def __init__(self, max_keys):
+        # {key: (tokens, actualizado, lleno_en)}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.prune_at = max_keys
+
+class MemoryStore:
+    """Buckets en memoria del proceso, repartidos en shards con un lock cada uno"""
+
+    def __init__(self, shards=16, max_keys_per_shard=10000):
+        self.shards = [Shard(max_keys_per_shard) for _ in range(shards)]
+        self.max_keys_per_shard = max_keys_per_shard
+
+    def take(self, key, rule):
+        """
+        Consumir un token del bucket `key`.
+
+        Returns:
+            tuple: (permitido, tokens restantes, segundos hasta el próximo token)
+        """
+        shard = self.shards[zlib.crc32(key.encode('utf-8')) % len(self.shards)]
+        now = time.monotonic()
+        with shard.lock:
+            tokens, updated, _ = shard.buckets.get(key, (rule.capacity, now, now))
+            tokens = min(rule.capacity, tokens + (now - updated) * rule.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Cada bucket guarda cuándo se habrá llenado con su propia regla
+            shard.buckets[key] = (tokens, now, now + (rule.capacity - tokens) / rule.rate)
+            if len(shard.buckets) > shard.prune_at:
+                self.prune(shard, now)
+        return allowed, tokens, (1 - tokens) / rule.rate if not allowed else 0
+
+    def prune(self, shard, now):
+        # Un bucket que ya se habría llenado equivale a uno nuevo
+        for key in [key for key, (_, _, full_at) in shard.buckets.items() if full_at <= now]:
+            del shard.buckets[key]
+        # Si quedan muchos buckets activos, el próximo recorrido espera a que
+        # el shard vuelva a duplicarse: el costo queda amortizado por petición
+        shard.prune_at = max(self.max_keys_per_shard, 2 * len(shard.buckets))
+
+class SQLiteStore:
+    """
+    Buckets compartidos entre procesos en un archivo SQLite propio.
+
+    Cada consumo es un único UPSERT ... RETURNING, atómico sin transacción
+    explícita; las expresiones del SET leen los valores anteriores de la fila.
+    """
+
+    TAKE_SQL = (
+        'INSERT INTO rate_limit_bucket (key, tokens, updated, allowed) VALUES (:key, :capacity - 1, :now, 1) '
+        'ON CONFLICT(key) DO UPDATE SET '
+        '  tokens = min(:capacity, tokens + (:now - updated) * :rate) '
+        '           - (min(:capacity, tokens + (:now - updated) * :rate) >= 1), '
+        '  allowed = min(:capacity, tokens + (:now - updated) * :rate) >= 1, '
+        '  updated = :now '
+        'RETURNING allowed, tokens'
+    )
+
+    def __init__(self, path, prune_every=1000, max_age=3600):
+        self.path = path
+        self.local = threading.local()
+        self.prune_every = prune_every
+        self.max_age = max_age
+        self.calls = itertools.count(1)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_bucket ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL)'
+        )
+        # Cada hilo (y cada worker tras un fork) abre su propia conexión
+        connection.close()
+        self.local.connection = None
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, rule):
+        now = time.time()
+        connection = self.connection()
+        allowed, tokens = connection.execute(self.TAKE_SQL, {
+            'key': key, 'capacity': rule.capacity, 'rate': rule.rate, 'now': now
+        }).fetchone()
+
+        if next(self.calls) % self.prune_every == 0:
+            # Buckets sin uso por más de max_age (al menos la ventana más
+            # larga de las reglas) ya estarían llenos
+            connection.execute('DELETE FROM rate_limit_bucket WHERE updated < ?', (now - self.max_age,))
+        return bool(allowed), tokens, (1 - tokens) / rule.rate if not allowed else 0
+
+def create_store(app, rules):
+    storage = app.config['RATE_LIMIT_STORAGE']
+    if storage == 'memory':
+        return MemoryStore()
+    if storage == 'sqlite':
+        longest = max((rule.seconds for items in rules.values() for rule in items), default=0)
+        return SQLiteStore(app.config['RATE_LIMIT_SQLITE_PATH'], max_age=max(3600, longest))
+    raise ValueError(f'RATE_LIMIT_STORAGE desconocido: {storage} (memory o sqlite)')
+
+# ===============================
+# HOOK
+# ===============================
+
+def client_ip(trusted_proxies):
+    """IP del cliente; con proxies de confianza, la que agregó el más externo a X-Forwarded-For"""
+    if trusted_proxies:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr or 'unknown'
+
+def request_user_id():
+    """Usuario del token sin consultar la base de datos (None si no hay token válido)"""
+    try:
+        payload = decode_request_token()
+    except Exception:
+        return None
+    return payload.get('user_id') if payload else None
+
+def init_rate_limit(app):
+    """Registrar el control de límites antes de cada petición"""
+    rules = parse_rules(app.config['RATE_LIMIT_RULES'] or DEFAULT_RULES)
+    store = create_store(app, rules)
+    trusted_proxies = app.config['RATE_LIMIT_TRUSTED_PROXIES']
+    app.extensions['rate_limit'] = store
+
+    @app.before_request
+    def check_rate_limit():
+        endpoint_rules = rules.get(request.endpoint)
+        if not endpoint_rules:
+            return None
+
+        for rule in endpoint_rules:
+            user_id = request_user_id() if rule.scope == 'user' else None
+            # Sin token válido el límite por usuario se aplica a la IP
+            identity = f'user:{user_id}' if user_id is not None else f'ip:{client_ip(trusted_proxies)}'
+            allowed, remaining, retry_after = store.take(f'{rule.endpoint}|{rule.scope}|{identity}', rule)
+            if not allowed:
+                RATE_LIMITED.inc(endpoint=rule.endpoint, scope=rule.scope)
+                response = jsonify({'error': 'Demasiadas solicitudes, intenta de nuevo más tarde'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                response.headers['X-RateLimit-Limit'] = str(rule.capacity)
+                response.headers['X-RateLimit-Remaining'] = '0'
+                return response
+            g.rate_limit = (rule.capacity, int(remaining))
+        return None
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        limit = g.pop('rate_limit', None)
+        if limit:
+            response.headers['X-RateLimit-Limit'] = str(limit[0])
+            response.headers['X-RateLimit-Remaining'] = str(limit[1])
+        return response
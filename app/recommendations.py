@@ -0,0 +1,299 @@
+from flask import current_app
+from app import db
+from app.models import Product, ProductCooccurrence
+from app.archive import sales_all, sales_detail_all
+from app.maintenance import start_periodic_job
+from app.background import start_thread
+from sqlalchemy import MetaData, select, func, and_, text
+from collections import Counter
+from itertools import permutations
+import click
+import threading
+import time
+
+# ===============================
+# PRODUCTOS COMPRADOS JUNTOS
+# ===============================
+#
+# product_cooccurrence guarda, para cada par ordenado de productos, en
+# cuántas ventas aparecieron juntos. Un trabajo por lotes la reconstruye
+# desde sales_detail_all y cada checkout suma sus pares en la misma
+# transacción que la venta.
+#
+# La reconstrucción llena una tabla de staging en transacciones cortas y la
+# cambia por la activa con un rename, así los checkouts solo esperan el
+# cambio de nombre y no la inserción de todos los pares.
+#
+# Las consultas no tocan la tabla: cada proceso mantiene en memoria solo los
+# RELATED_TOP_K vecinos de cada producto, se actualiza con los checkouts de
+# este proceso y se recarga cada RELATED_INDEX_MAX_AGE segundos para recoger
+# los de los demás workers. La recarga corre en un hilo y mientras tanto se
+# siguen sirviendo los vecinos anteriores.
+
+cooccurrence = ProductCooccurrence.__table__
+
+# Copia de la tabla (con sus claves) fuera de db.metadata, para que create_all
+# no la cree ni cambie la huella del esquema
+staging_metadata = MetaData()
+Product.__table__.to_metadata(staging_metadata)
+staging = cooccurrence.to_metadata(staging_metadata, name=f'{cooccurrence.name}_staging')
+
+def sale_pairs(product_ids):
+    """Pares ordenados (producto, relacionado) de los productos distintos de una venta"""
+    return list(permutations(sorted(set(product_ids)), 2))
+
+def record_sale(product_ids, executor=None):
+    """
+    Sumar una venta a los pares de sus productos. No hace commit: se
+    confirma junto con el checkout (o con la transacción de `executor`).
+    """
+    executor = executor if executor is not None else db.session
+    product_ids = sorted(set(product_ids))
+    if len(product_ids) < 2:
+        return
+
+    same_sale = and_(
+        cooccurrence.c.id_Product.in_(product_ids),
+        cooccurrence.c.id_Related.in_(product_ids),
+        cooccurrence.c.id_Product != cooccurrence.c.id_Related
+    )
+    existing = set(executor.execute(
+        select(cooccurrence.c.id_Product, cooccurrence.c.id_Related).where(same_sale)
+    ).tuples())
+
+    if existing:
+        executor.execute(cooccurrence.update().where(same_sale).values(Times=cooccurrence.c.Times + 1))
+    missing = [pair for pair in sale_pairs(product_ids) if pair not in existing]
+    if missing:
+        executor.execute(cooccurrence.insert(), [
+            {'id_Product': product_id, 'id_Related': related_id, 'Times': 1}
+            for product_id, related_id in missing
+        ])
+
+def count_pairs(sales_filter, chunk_size):
+    """Contar los pares de las ventas que cumplen `sales_filter`, leyendo por bloques de ventas"""
+    counts = Counter()
+    last_id = 0
+    while True:
+        sale_ids = db.session.execute(
+            select(sales_all.c.id_Sale).where(sales_filter, sales_all.c.id_Sale > last_id)
+            .order_by(sales_all.c.id_Sale).limit(chunk_size)
+        ).scalars().all()
+        if not sale_ids:
+            break
+
+        products = {}
+        for sale_id, product_id in db.session.execute(
+            select(sales_detail_all.c.id_Sale, sales_detail_all.c.id_Product).where(
+                sales_detail_all.c.id_Sale >= sale_ids[0],
+                sales_detail_all.c.id_Sale <= sale_ids[-1]
+            )
+        ):
+            products.setdefault(sale_id, set()).add(product_id)
+        for product_ids in products.values():
+            counts.update(sale_pairs(product_ids))
+
+        # Soltar el lock de lectura entre bloques
+        db.session.rollback()
+        last_id = sale_ids[-1]
+        if len(sale_ids) < chunk_size:
+            break
+    return counts
+
+def rebuild_cooccurrence(chunk_size=None, batch_size=5000):
+    """
+    Recalcular product_cooccurrence con todas las ventas (activas y archivadas).
+
+    Cuenta los pares leyendo por bloques, sin bloquear escrituras, y los
+    guarda en la tabla de staging con una transacción por lote. Luego, en una
+    transacción corta, la renombra como product_cooccurrence y suma las
+    ventas creadas mientras tanto (id mayor que el último contado), así no se
+    pierden los checkouts concurrentes.
+
+    Returns:
+        dict: ventas contadas, pares guardados y segundos
+    """
+    chunk_size = chunk_size or current_app.config['RELATED_REBUILD_CHUNK_SIZE']
+    start = time.perf_counter()
+
+    high_water_mark = db.session.execute(select(func.max(sales_all.c.id_Sale))).scalar() or 0
+    counts = count_pairs(sales_all.c.id_Sale <= high_water_mark, chunk_size)
+
+    # Una reconstrucción interrumpida puede haber dejado la tabla de staging
+    staging.drop(db.session.connection(), checkfirst=True)
+    staging.create(db.session.connection())
+    db.session.commit()
+    rows = [
+        {'id_Product': product_id, 'id_Related': related_id, 'Times': times}
+        for (product_id, related_id), times in counts.items()
+    ]
+    for position in range(0, len(rows), batch_size):
+        db.session.execute(staging.insert(), rows[position:position + batch_size])
+        db.session.commit()
+
+    # pysqlite no emite BEGIN antes de DDL: sin una transacción explícita cada
+    # rename se confirmaría solo. BEGIN IMMEDIATE toma el lock de escritura
+    # antes del cambio, así ningún checkout ve la tabla a medio renombrar ni
+    # se confirma entre el cambio y la suma de las ventas nuevas (que así se
+    # cuentan una sola vez).
+    retired = f'{cooccurrence.name}_old'
+    products = {}
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            connection.execute(text(f'DROP TABLE IF EXISTS {retired}'))
+            connection.execute(text(f'ALTER TABLE {cooccurrence.name} RENAME TO {retired}'))
+            connection.execute(text(f'ALTER TABLE {staging.name} RENAME TO {cooccurrence.name}'))
+            for sale_id, product_id in connection.execute(
+                select(sales_detail_all.c.id_Sale, sales_detail_all.c.id_Product)
+                .where(sales_detail_all.c.id_Sale > high_water_mark)
+            ):
+                products.setdefault(sale_id, set()).add(product_id)
+            for product_ids in products.values():
+                record_sale(product_ids, connection)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    # Borrar la tabla anterior fuera de la transacción del cambio
+    db.session.execute(text(f'DROP TABLE {retired}'))
+    db.session.commit()
+
+    related_index.build()
+    return {'pairs': len(rows), 'high_water_mark': high_water_mark, 'late_sales': len(products),
+            'seconds': time.perf_counter() - start}
+
+# ===============================
+# ÍNDICE EN MEMORIA
+# ===============================
+
+class RelatedIndex:
+    """Los K vecinos más frecuentes de cada producto: {id_Product: ((id_Related, veces), ...)}"""
+
+    def __init__(self):
+        self.neighbors = {}
+        self.built_at = None
+        self.lock = threading.Lock()
+        # Tomado mientras se carga el índice: una sola recarga a la vez
+        self.rebuild_lock = threading.Lock()
+
+    def top_k_query(self, product_ids=None):
+        ranked = select(
+            cooccurrence.c.id_Product,
+            cooccurrence.c.id_Related,
+            cooccurrence.c.Times,
+            func.row_number().over(
+                partition_by=cooccurrence.c.id_Product,
+                order_by=(cooccurrence.c.Times.desc(), cooccurrence.c.id_Related)
+            ).label('position')
+        )
+        if product_ids is not None:
+            ranked = ranked.where(cooccurrence.c.id_Product.in_(product_ids))
+        ranked = ranked.subquery()
+        return select(ranked.c.id_Product, ranked.c.id_Related, ranked.c.Times).where(
+            ranked.c.position <= current_app.config['RELATED_TOP_K']
+        ).order_by(ranked.c.id_Product, ranked.c.position)
+
+    def load(self, product_ids=None):
+        neighbors = {}
+        for product_id, related_id, times in db.session.execute(self.top_k_query(product_ids)):
+            neighbors.setdefault(product_id, []).append((related_id, times))
+        return {product_id: tuple(items) for product_id, items in neighbors.items()}
+
+    def build(self):
+        """Recargar los vecinos de todos los productos"""
+        neighbors = self.load()
+        with self.lock:
+            self.neighbors = neighbors
+            self.built_at = time.monotonic()
+
+    def stale(self):
+        max_age = current_app.config.get('RELATED_INDEX_MAX_AGE', 300)
+        return bool(max_age) and time.monotonic() - self.built_at > max_age
+
+    def rebuild(self, app):
+        """Recargar en segundo plano; libera rebuild_lock al terminar"""
+        try:
+            with app.app_context():
+                self.build()
+        finally:
+            self.rebuild_lock.release()
+
+    def ensure_built(self):
+        if self.built_at is None:
+            # Primera carga: no hay vecinos que servir, los demás esperan
+            with self.rebuild_lock:
+                if self.built_at is None:
+                    self.build()
+            return
+
+        if not self.stale() or not self.rebuild_lock.acquire(blocking=False):
+            return
+        if not self.stale():
+            # Otra recarga terminó entre la comprobación y el lock
+            self.rebuild_lock.release()
+            return
+        app = current_app._get_current_object()
+        try:
+            start_thread(lambda: self.rebuild(app), 'related-index')
+        except Exception:
+            self.rebuild_lock.release()
+            raise
+
+    def refresh(self, product_ids):
+        """Recargar los vecinos de algunos productos (tras un checkout de este proceso)"""
+        if self.built_at is None:
+            return
+        neighbors = self.load(product_ids)
+        with self.lock:
+            for product_id in product_ids:
+                if product_id in neighbors:
+                    self.neighbors[product_id] = neighbors[product_id]
+                else:
+                    self.neighbors.pop(product_id, None)
+
+    def related(self, product_id, limit=None):
+        """[(id_Related, veces)] del producto, de más a menos frecuente"""
+        self.ensure_built()
+        return list(self.neighbors.get(product_id, ())[:limit])
+
+    def related_to_many(self, product_ids, limit=None):
+        """
+        Vecinos de un conjunto de productos (el carrito): suma las veces de
+        cada vecino y excluye los productos del conjunto.
+        """
+        self.ensure_built()
+        product_ids = set(product_ids)
+        scores = Counter()
+        for product_id in product_ids:
+            for related_id, times in self.neighbors.get(product_id, ()):
+                if related_id not in product_ids:
+                    scores[related_id] += times
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+related_index = RelatedIndex()
+
+def sale_recorded(product_ids):
+    """Llamar después del commit de un checkout"""
+    product_ids = set(product_ids)
+    if len(product_ids) > 1:
+        related_index.refresh(product_ids)
+
+def report_rebuild(result):
+    return (f'Productos relacionados: {result["pairs"]} pares (ventas hasta #{result["high_water_mark"]}, '
+            f'{result["seconds"]:.2f} s)')
+
+def init_recommendations(app):
+    """Comando de reconstrucción y reconstrucción periódica"""
+    @app.cli.command('rebuild-related')
+    @click.option('--chunk-size', type=int, default=None, help='Ventas leídas por bloque (default: RELATED_REBUILD_CHUNK_SIZE)')
+    def rebuild_related_command(chunk_size):
+        """Recalcular los productos comprados juntos desde todas las ventas"""
+        result = rebuild_cooccurrence(chunk_size)
+        print(f'Pares guardados: {result["pairs"]} (ventas hasta #{result["high_water_mark"]}, '
+              f'{result["late_sales"]} ventas nuevas durante el cálculo, {result["seconds"]:.2f} s)')
+
+    if app.config['RELATED_REBUILD_INTERVAL']:
+        start_periodic_job(app, 'related-rebuild', app.config['RELATED_REBUILD_INTERVAL'],
+                           rebuild_cooccurrence, report_rebuild)
@@ -0,0 +1,280 @@
+from flask import current_app
+from app import db
+from app.models import Product, StockCounter, StockReservation
+from app.metrics import cache_hit, cache_miss
+from app.background import start_thread
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+import threading
+import time
+
+# ===============================
+# RESERVAS DE STOCK DEL CARRITO
+# ===============================
+#
+# Cada item del carrito tiene una reserva (stock_reservation) con vencimiento.
+# stock_counter guarda por producto el total reservado, de modo que el stock
+# disponible es Product.Stock - StockCounter.Reserved y se puede reservar con
+# un único UPDATE condicional, sin leer ni bloquear la fila del producto.
+#
+# Ninguna función hace commit: los cambios se confirman junto con el carrito.
+
+counters = StockCounter.__table__
+products = Product.__table__
+reservations = StockReservation.__table__
+
+def reservation_ttl():
+    """Duración de una reserva"""
+    return timedelta(seconds=current_app.config.get('RESERVATION_TTL_SECONDS', 900))
+
+def ensure_counters(product_ids):
+    """
+    Crear las filas de stock_counter que falten.
+
+    INSERT OR IGNORE: dos primeras reservas simultáneas del mismo producto no
+    chocan en la clave primaria.
+    """
+    db.session.execute(sqlite_insert(counters).on_conflict_do_nothing(), [
+        {'id_Product': product_id, 'Reserved': 0} for product_id in set(product_ids)
+    ])
+
+def hold_stock(product_id, quantity):
+    """Sumar `quantity` al total reservado si hay stock disponible (UPDATE condicional)"""
+    stock = select(products.c.Stock).where(
+        products.c.id_Product == product_id
+    ).scalar_subquery()
+
+    result = db.session.execute(
+        counters.update().where(
+            counters.c.id_Product == product_id,
+            stock - counters.c.Reserved >= quantity
+        ).values(Reserved=counters.c.Reserved + quantity)
+    )
+    return result.rowcount == 1
+
+def unhold_stock(product_id, quantity):
+    """Restar `quantity` del total reservado"""
+    db.session.execute(
+        counters.update().where(
+            counters.c.id_Product == product_id
+        ).values(Reserved=counters.c.Reserved - quantity)
+    )
+
+def reserve(user_id, quantities):
+    """
+    Ajustar las reservas de un usuario a las cantidades indicadas.
+
+    Args:
+        user_id (int): usuario dueño del carrito
+        quantities (dict): {id_Product: cantidad total en el carrito}; 0 libera
+
+    Returns:
+        list: ids de productos sin stock suficiente (vacía si todo se reservó)
+    """
+    if not quantities:
+        return []
+
+    ensure_counters(quantities)
+    holds = {
+        hold.id_Product: hold
+        for hold in StockReservation.query.filter(
+            StockReservation.iD_User == user_id,
+            StockReservation.id_Product.in_(list(quantities))
+        ).all()
+    }
+
+    expires_at = datetime.utcnow() + reservation_ttl()
+    shortages = []
+
+    for product_id, quantity in quantities.items():
+        hold = holds.get(product_id)
+        delta = quantity - (hold.quantity if hold else 0)
+
+        if delta > 0 and not hold_stock(product_id, delta):
+            shortages.append(product_id)
+            continue
+        if delta < 0:
+            unhold_stock(product_id, -delta)
+
+        if quantity == 0:
+            if hold:
+                db.session.delete(hold)
+        elif hold:
+            hold.quantity = quantity
+            hold.ExpiresAt = expires_at
+        else:
+            db.session.add(StockReservation(
+                iD_User=user_id,
+                id_Product=product_id,
+                quantity=quantity,
+                ExpiresAt=expires_at
+            ))
+
+    db.session.flush()
+    availability.invalidate(quantities)
+    return shortages
+
+def release(user_id, product_ids=None):
+    """Liberar las reservas de un usuario (todas o las de ciertos productos)"""
+    query = StockReservation.query.filter(StockReservation.iD_User == user_id)
+    if product_ids is not None:
+        query = query.filter(StockReservation.id_Product.in_(product_ids))
+
+    holds = query.all()
+    for hold in holds:
+        unhold_stock(hold.id_Product, hold.quantity)
+        db.session.delete(hold)
+
+    db.session.flush()
+    availability.invalidate(hold.id_Product for hold in holds)
+
+def consume(user_id, quantities):
+    """
+    Descontar del stock las cantidades compradas usando las reservas.
+
+    Las reservas que falten (por ejemplo, carritos anteriores a esta función)
+    se toman en el momento. El stock se descuenta con UPDATE condicionales que
+    devuelven el precio (RETURNING), sin volver a leer las filas de producto.
+
+    Returns:
+        tuple: (ids de productos sin stock suficiente, {id_Product: Price});
+        los precios solo vienen completos si no hubo faltantes
+    """
+    prices = {}
+    shortages = reserve(user_id, quantities)
+    if shortages:
+        return shortages, prices
+
+    for product_id, quantity in quantities.items():
+        price = db.session.execute(
+            products.update().where(
+                products.c.id_Product == product_id,
+                products.c.Stock >= quantity
+            ).values(Stock=products.c.Stock - quantity, Version=products.c.Version + 1)
+            .returning(products.c.Price)
+        ).scalar()
+        if price is None:
+            shortages.append(product_id)
+            continue
+        prices[product_id] = price
+        unhold_stock(product_id, quantity)
+
+    if shortages:
+        return shortages, prices
+
+    db.session.execute(
+        reservations.delete().where(
+            reservations.c.iD_User == user_id,
+            reservations.c.id_Product.in_(list(quantities))
+        )
+    )
+    availability.invalidate(quantities)
+    return [], prices
+
+def release_expired(batch_size=500, now=None):
+    """
+    Liberar reservas vencidas en lotes pequeños (una transacción por lote).
+
+    Returns:
+        int: número de reservas liberadas
+    """
+    now = now or datetime.utcnow()
+    released = 0
+
+    while True:
+        expired = db.session.execute(
+            select(reservations.c.id_Reservation, reservations.c.id_Product, reservations.c.quantity)
+            .where(reservations.c.ExpiresAt < now)
+            .limit(batch_size)
+        ).all()
+        if not expired:
+            break
+
+        ids = [row.id_Reservation for row in expired]
+        result = db.session.execute(
+            reservations.delete().where(
+                reservations.c.id_Reservation.in_(ids),
+                reservations.c.ExpiresAt < now
+            )
+        )
+        if result.rowcount != len(ids):
+            # Otro proceso renovó o liberó alguna reserva: reintentar el lote
+            db.session.rollback()
+            continue
+
+        totals = {}
+        for row in expired:
+            totals[row.id_Product] = totals.get(row.id_Product, 0) + row.quantity
+        for product_id, quantity in totals.items():
+            unhold_stock(product_id, quantity)
+
+        db.session.commit()
+        availability.invalidate(totals)
+        released += len(ids)
+
+    return released
+
+def start_reservation_sweeper(app, interval, batch_size=500):
+    """Liberar reservas vencidas periódicamente en un hilo de fondo"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    release_expired(batch_size)
+            except Exception as e:
+                print(f'Error liberando reservas: {e}')
+
+    return start_thread(loop, 'reservation-sweeper')
+
+class AvailabilityCache:
+    """
+    Caché en memoria del stock disponible por producto.
+
+    Se invalida con cada cambio local (reservas, checkout, actualización de
+    stock) y cada entrada vence tras unos segundos para recoger los cambios
+    hechos por otros procesos.
+    """
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, product_ids):
+        """Devolver {id_Product: disponible}, consultando solo los que falten"""
+        now = time.monotonic()
+        result = {}
+        missing = []
+
+        for product_id in product_ids:
+            entry = self.entries.get(product_id)
+            if entry and entry[1] > now:
+                result[product_id] = entry[0]
+            else:
+                missing.append(product_id)
+
+        cache_hit('availability', len(result))
+        cache_miss('availability', len(missing))
+
+        if missing:
+            rows = db.session.execute(
+                select(products.c.id_Product, products.c.Stock, counters.c.Reserved)
+                .select_from(products.outerjoin(counters, counters.c.id_Product == products.c.id_Product))
+                .where(products.c.id_Product.in_(missing))
+            ).all()
+            with self.lock:
+                for row in rows:
+                    available = max(row.Stock - (row.Reserved or 0), 0)
+                    self.entries[row.id_Product] = (available, now + self.ttl)
+                    result[row.id_Product] = available
+
+        return result
+
+    def invalidate(self, product_ids):
+        with self.lock:
+            for product_id in product_ids:
+                self.entries.pop(product_id, None)
+
+availability = AvailabilityCache()
@@ -0,0 +1,206 @@
+from flask import Blueprint, request, jsonify, current_app
+from app.security import get_user_from_token
+from app.outbox import outbox_status
+from app import analytics, snapshot
+
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.route('/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Consultas lentas con más tiempo acumulado (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        slow_log = current_app.extensions.get('slow_query_log')
+        if not slow_log:
+            return jsonify({'error': 'El registro de consultas lentas está desactivado'}), 404
+        
+        limit = request.args.get('limit', 10, type=int)
+        queries = slow_log.top(limit)
+        
+        return jsonify({
+            'threshold_ms': slow_log.threshold * 1000,
+            'slow_queries': queries,
+            'count': len(queries)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/outbox', methods=['GET'])
+def get_outbox_status():
+    """Eventos del outbox procesados, pendientes y fallidos (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        return jsonify({
+            'sinks': [name.strip() for name in current_app.config['OUTBOX_SINKS'].split(',') if name.strip()],
+            'status': outbox_status()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ===============================
+# ANALÍTICA DE VENTAS
+# ===============================
+
+def sales_columns():
+    """
+    Columnas de ventas filtradas por ?since=AAAA-MM-DD&until=AAAA-MM-DD
+    (until exclusivo), del snapshot si existe o leídas de la base de datos.
+    Lanza ValueError si las fechas no son válidas.
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    columns, _ = snapshot.reader.get()
+    if columns is None:
+        columns = analytics.columns_cache.get()
+    return columns.between(
+        analytics.np.datetime64(since, 'D') if since else None,
+        analytics.np.datetime64(until, 'D') if until else None
+    )
+
+@admin_bp.route('/analytics/revenue', methods=['GET'])
+def get_revenue_series():
+    """Ingresos, unidades y ventas por día, semana o mes (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        if not analytics.available():
+            return jsonify({'error': 'La analítica requiere NumPy'}), 503
+        
+        interval = request.args.get('interval', 'day')
+        if interval not in analytics.INTERVALS:
+            return jsonify({'error': f'interval debe ser uno de: {", ".join(analytics.INTERVALS)}'}), 400
+        
+        try:
+            columns = sales_columns()
+        except ValueError:
+            return jsonify({'error': 'Fechas inválidas, usa AAAA-MM-DD'}), 400
+        
+        series = analytics.revenue_series(columns, interval)
+        return jsonify({
+            'interval': interval,
+            'series': series,
+            'count': len(series)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analytics/products', methods=['GET'])
+def get_top_products():
+    """Productos más vendidos por ingresos o unidades (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        if not analytics.available():
+            return jsonify({'error': 'La analítica requiere NumPy'}), 503
+        
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+        by = request.args.get('by', 'revenue')
+        if by not in ('revenue', 'units'):
+            return jsonify({'error': 'by debe ser revenue o units'}), 400
+        
+        try:
+            columns = sales_columns()
+        except ValueError:
+            return jsonify({'error': 'Fechas inválidas, usa AAAA-MM-DD'}), 400
+        
+        products = analytics.top_products(columns, limit, by)
+        return jsonify({
+            'by': by,
+            'products': products,
+            'count': len(products)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analytics/categories', methods=['GET'])
+def get_category_breakdown():
+    """Ingresos y unidades por categoría (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        if not analytics.available():
+            return jsonify({'error': 'La analítica requiere NumPy'}), 503
+        
+        try:
+            columns = sales_columns()
+        except ValueError:
+            return jsonify({'error': 'Fechas inválidas, usa AAAA-MM-DD'}), 400
+        
+        categories = analytics.category_breakdown(columns)
+        return jsonify({
+            'categories': categories,
+            'count': len(categories)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analytics/orders', methods=['GET'])
+def get_order_percentiles():
+    """Percentiles del valor y las unidades por venta (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        if not analytics.available():
+            return jsonify({'error': 'La analítica requiere NumPy'}), 503
+        
+        try:
+            percentiles = [float(p) for p in request.args.get('percentiles', '50,90,95,99').split(',')]
+            if not all(0 <= p <= 100 for p in percentiles):
+                raise ValueError
+            columns = sales_columns()
+        except ValueError:
+            return jsonify({'error': 'Parámetros inválidos: percentiles entre 0 y 100 y fechas AAAA-MM-DD'}), 400
+        
+        return jsonify(analytics.order_percentiles(columns, percentiles)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Users, RoleS
+from app.security import decode_request_token, load_user
 from werkzeug.security import generate_password_hash
 import jwt
 import datetime
@@ -95,19 +96,13 @@ def login():
 def verify_token():
     """Verificar si un token es válido"""
     try:
-        token = request.headers.get('Authorization')
-        if not token:
+        # Decodificar token (se reutiliza si ya se decodificó en este contexto)
+        payload = decode_request_token()
+        if not payload:
             return jsonify({'error': 'Token no proporcionado'}), 401
         
-        # Remover 'Bearer ' si está presente
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        # Decodificar token
-        payload = jwt.decode(token, os.getenv('SECRET_KEY', 'HolaMundo'), algorithms=['HS256'])
-        
         # Buscar usuario
-        user = Users.query.get(payload['user_id'])
+        user = load_user(payload['user_id'])
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
         
@@ -140,15 +135,11 @@ def change_password():
     """Cambiar password del usuario"""
     try:
         # Verificar token
-        token = request.headers.get('Authorization')
-        if not token:
+        payload = decode_request_token()
+        if not payload:
             return jsonify({'error': 'Token no proporcionado'}), 401
         
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        payload = jwt.decode(token, os.getenv('SECRET_KEY', 'HolaMundo'), algorithms=['HS256'])
-        user = Users.query.get(payload['user_id'])
+        user = load_user(payload['user_id'])
         
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
@@ -0,0 +1,159 @@
+from flask import Blueprint, request, jsonify, current_app, g
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.test import EnvironBuilder
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from urllib.parse import urlsplit
+from app.security import decode_request_token
+
+batch_bp = Blueprint('batch', __name__)
+
+MAX_BATCH_SIZE = 25
+MAX_PARALLEL_WORKERS = 4
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+def build_environ(sub_request, headers, remote_addr=None):
+    """Construir el entorno WSGI de una sub-petición"""
+    builder = EnvironBuilder(
+        path=sub_request['path'],
+        method=sub_request.get('method', 'GET').upper(),
+        headers=headers,
+        query_string=sub_request.get('query'),
+        json=sub_request.get('body'),
+        # La IP del cliente del lote, para que el límite de peticiones la cuente
+        environ_base={'REMOTE_ADDR': remote_addr} if remote_addr else None
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+def target_endpoint(app, environ):
+    """Endpoint al que se despacharía la sub-petición (None si no hay ruta)"""
+    adapter = app.url_map.bind_to_environ(environ)
+    method = environ['REQUEST_METHOD']
+    try:
+        return adapter.match(method=method)[0]
+    except RequestRedirect as e:
+        # /api//batch: Flask redirige a la ruta normalizada
+        try:
+            return adapter.match(urlsplit(e.new_url).path, method=method)[0]
+        except HTTPException:
+            return None
+    except HTTPException:
+        return None
+
+def dispatch(app, environ):
+    """Ejecutar una sub-petición contra los blueprints registrados"""
+    try:
+        with app.request_context(environ):
+            response = app.full_dispatch_request()
+        if response.mimetype == 'text/event-stream':
+            # Un stream no termina: no se puede incluir en la respuesta del lote
+            response.close()
+            return 400, {'error': 'Los streams no se pueden pedir dentro de un lote'}
+        return response.status_code, response.get_json(silent=True)
+    except Exception as e:
+        return 500, {'error': str(e)}
+
+def dispatch_in_thread(app, environ, token_payloads):
+    """
+    Ejecutar una sub-petición de solo lectura en otro hilo.
+
+    Cada hilo usa su propio contexto de aplicación (y por tanto su propia
+    sesión de base de datos), pero reutiliza el token ya decodificado.
+    """
+    with app.app_context():
+        g.token_payloads = dict(token_payloads)
+        return dispatch(app, environ)
+
+@batch_bp.route('', methods=['POST'])
+def run_batch():
+    """Ejecutar varias peticiones de la API en una sola llamada"""
+    try:
+        data = request.get_json() or {}
+        sub_requests = data.get('requests')
+        parallel = bool(data.get('parallel', False))
+
+        if not isinstance(sub_requests, list) or not sub_requests:
+            return jsonify({'error': 'requests es requerido'}), 400
+
+        if len(sub_requests) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Máximo {MAX_BATCH_SIZE} peticiones por lote'}), 400
+
+        for sub_request in sub_requests:
+            path = sub_request.get('path') if isinstance(sub_request, dict) else None
+            if not path or not path.startswith('/'):
+                return jsonify({'error': 'Cada petición requiere un path absoluto'}), 400
+
+        # Decodificar el token una sola vez para todas las sub-peticiones
+        try:
+            decode_request_token()
+        except Exception:
+            pass
+
+        app = current_app._get_current_object()
+        authorization = request.headers.get('Authorization')
+        forwarded_for = request.headers.get('X-Forwarded-For')
+
+        environs = []
+        for sub_request in sub_requests:
+            headers = dict(sub_request.get('headers') or {})
+            headers.pop('Authorization', None)
+            if authorization:
+                headers['Authorization'] = authorization
+            # X-Forwarded-For solo puede venir del proxy, no del cuerpo del lote
+            headers.pop('X-Forwarded-For', None)
+            if forwarded_for:
+                headers['X-Forwarded-For'] = forwarded_for
+            environs.append(build_environ(sub_request, headers, request.remote_addr))
+
+        # Comparar el endpoint resuelto, no el texto del path (//api/batch, /api/batch/)
+        for environ in environs:
+            if target_endpoint(app, environ) == request.endpoint:
+                return jsonify({'error': 'No se permiten lotes anidados'}), 400
+
+        results = [None] * len(sub_requests)
+
+        # Agrupar peticiones de solo lectura consecutivas para ejecutarlas en paralelo
+        index = 0
+        while index < len(sub_requests):
+            method = environs[index]['REQUEST_METHOD']
+
+            if parallel and method in READ_ONLY_METHODS:
+                group = [index]
+                while (group[-1] + 1 < len(sub_requests) and
+                       environs[group[-1] + 1]['REQUEST_METHOD'] in READ_ONLY_METHODS):
+                    group.append(group[-1] + 1)
+
+                if len(group) > 1:
+                    token_payloads = g.get('token_payloads', {})
+                    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_WORKERS, len(group))) as executor:
+                        futures = {
+                            i: executor.submit(dispatch_in_thread, app, environs[i], token_payloads)
+                            for i in group
+                        }
+                    for i, future in futures.items():
+                        results[i] = future.result()
+                    index = group[-1] + 1
+                    continue
+
+            # Las escrituras se ejecutan en orden y comparten la sesión de la petición
+            results[index] = dispatch(app, environs[index])
+            index += 1
+
+        responses = []
+        for sub_request, (status, body) in zip(sub_requests, results):
+            responses.append({
+                'id': sub_request.get('id'),
+                'status': status,
+                'body': body
+            })
+
+        return jsonify({
+            'responses': responses,
+            'count': len(responses)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
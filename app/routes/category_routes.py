@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Category, Product, product_categories
+from app import product_listing
 
 category_bp = Blueprint('categories', __name__)
 
@@ -47,9 +48,9 @@ def get_category(category_id):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         
-        products = Product.query.join(product_categories).filter(
-            product_categories.c.id_Category == category_id
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        products = product_listing.listing_query(category_id=category_id).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
         
         return jsonify({
             'category': category.to_dict(),
@@ -118,6 +119,8 @@ def update_category(category_id):
                 return jsonify({'error': 'El nombre de categoría ya existe'}), 409
             
             category.CategoryName = data['CategoryName']
+            # El nombre está copiado en el listado de cada producto de la categoría
+            product_listing.refresh_category(category_id)
         
         db.session.commit()
         
@@ -168,19 +171,19 @@ def get_category_products(category_id):
         max_price = request.args.get('max_price', type=float)
         in_stock = request.args.get('in_stock', type=bool)
         
-        # Construir query
-        query = Product.query.join(product_categories).filter(
-            product_categories.c.id_Category == category_id
+        sort = request.args.get('sort', 'id')
+        if sort not in product_listing.SORTS:
+            return jsonify({'error': f'sort debe ser uno de: {", ".join(product_listing.SORTS)}'}), 400
+        
+        # Construir query sobre el listado desnormalizado (una sola tabla)
+        query = product_listing.listing_query(
+            category_id=category_id,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock=in_stock,
+            sort=sort
         )
         
-        # Aplicar filtros
-        if min_price is not None:
-            query = query.filter(Product.Price >= min_price)
-        if max_price is not None:
-            query = query.filter(Product.Price <= max_price)
-        if in_stock:
-            query = query.filter(Product.Stock > 0)
-        
         # Paginación
         products = query.paginate(
             page=page, 
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Country, States, City
+from app.search_index import locations
 
 location_bp = Blueprint('locations', __name__)
 
@@ -41,6 +42,7 @@ def create_country():
         new_country = Country(CountryName=data['CountryName'])
         db.session.add(new_country)
         db.session.commit()
+        locations.invalidate()
         
         return jsonify({
             'message': 'País creado exitosamente',
@@ -79,14 +81,11 @@ def get_states():
     try:
         country_id = request.args.get('country_id', type=int)
         
-        query = States.query
-        if country_id:
-            query = query.filter_by(iD_Country=country_id)
-        
-        states = query.all()
+        # Servido desde el índice de ubicaciones en memoria
+        states = locations.states(country_id)
         
         return jsonify({
-            'states': [state.to_dict() for state in states],
+            'states': states,
             'count': len(states)
         }), 200
         
@@ -125,6 +124,7 @@ def create_state():
         
         db.session.add(new_state)
         db.session.commit()
+        locations.invalidate()
         
         return jsonify({
             'message': 'Estado creado exitosamente',
@@ -180,18 +180,11 @@ def get_cities():
         state_id = request.args.get('state_id', type=int)
         country_id = request.args.get('country_id', type=int)
         
-        query = City.query
-        
-        if state_id:
-            query = query.filter_by(iD_States=state_id)
-        elif country_id:
-            # Filtrar por país a través de la relación con states
-            query = query.join(States).filter(States.iD_Country == country_id)
-        
-        cities = query.all()
+        # Servido desde el índice de ubicaciones en memoria
+        cities = locations.cities(state_id=state_id, country_id=country_id)
         
         return jsonify({
-            'cities': [city.to_dict() for city in cities],
+            'cities': cities,
             'count': len(cities)
         }), 200
         
@@ -230,6 +223,7 @@ def create_city():
         
         db.session.add(new_city)
         db.session.commit()
+        locations.invalidate()
         
         return jsonify({
             'message': 'Ciudad creada exitosamente',
@@ -318,7 +312,7 @@ def get_location_hierarchy():
 
 @location_bp.route('/search', methods=['GET'])
 def search_locations():
-    """Buscar ubicaciones por nombre"""
+    """Buscar ubicaciones por nombre (índice de prefijos en memoria)"""
     try:
         query_text = request.args.get('q', '')
         location_type = request.args.get('type', 'all')  # all, country, state, city
@@ -326,40 +320,7 @@ def search_locations():
         if not query_text:
             return jsonify({'results': []}), 200
         
-        results = []
-        
-        if location_type in ['all', 'country']:
-            countries = Country.query.filter(
-                Country.CountryName.contains(query_text)
-            ).limit(10).all()
-            
-            for country in countries:
-                results.append({
-                    'type': 'country',
-                    'data': country.to_dict()
-                })
-        
-        if location_type in ['all', 'state']:
-            states = States.query.filter(
-                States.StatesName.contains(query_text)
-            ).limit(10).all()
-            
-            for state in states:
-                results.append({
-                    'type': 'state',
-                    'data': state.to_dict()
-                })
-        
-        if location_type in ['all', 'city']:
-            cities = City.query.filter(
-                City.CityName.contains(query_text)
-            ).limit(10).all()
-            
-            for city in cities:
-                results.append({
-                    'type': 'city',
-                    'data': city.to_dict()
-                })
+        results = locations.search(query_text, location_type, limit=10)
         
         return jsonify({
             'results': results,
@@ -367,4 +328,4 @@ def search_locations():
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
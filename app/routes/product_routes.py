@@ -1,10 +1,84 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, current_app
 from app import db
-from app.models import Product, Category, PRODUC_Image, product_categories
-from sqlalchemy import or_, and_
+from app.models import Product, Category, PRODUC_Image, ProductListing, StockReservation, StockCounter
+from app.reservations import availability
+from app import archive
+from app.search_index import suggestions, fuzzy_names, product_saved, product_deleted
+from app.recommendations import related_index
+from app import product_stream, product_listing
+from sqlalchemy import and_, case, cast, func, literal, select, union_all, Integer
+from sqlalchemy.orm.exc import StaleDataError
+import json
 
 product_bp = Blueprint('products', __name__)
 
+def get_if_match():
+    """
+    Versiones aceptadas en el header If-Match.
+    
+    Returns:
+        set | None: None si no se envió (o es *); vacío si ninguna ETag es una versión
+    """
+    value = request.headers.get('If-Match')
+    if not value or value.strip() == '*':
+        return None
+    
+    versions = set()
+    for tag in value.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag.isascii() and tag.isdigit():
+            versions.add(int(tag))
+    return versions
+
+def etag(product):
+    """Header ETag con la versión del producto"""
+    return {'ETag': f'"{product.Version}"'}
+
+def invalid_if_match():
+    """Respuesta 412 cuando If-Match no trae ninguna versión que se pueda comparar"""
+    return jsonify({'error': 'If-Match debe contener la ETag del producto (por ejemplo "3")'}), 412
+
+def version_conflict(current_version):
+    """Respuesta 409 cuando otra petición modificó el producto"""
+    return jsonify({
+        'error': 'El producto fue modificado por otra petición',
+        'Version': current_version
+    }), 409
+
+def get_product_filters():
+    """Leer los filtros del listado desde los parámetros de consulta"""
+    return {
+        'search': request.args.get('search', ''),
+        'category_id': request.args.get('category_id', type=int),
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+        'in_stock': request.args.get('in_stock', type=bool)
+    }
+
+def paginate_products(query, page, per_page):
+    """Página de product_listing serializada junto con los datos de paginación"""
+    products = query.paginate(
+        page=page, 
+        per_page=per_page, 
+        error_out=False
+    )
+    
+    return {
+        'products': [product.to_dict(include_categories=True, include_images=True) 
+                    for product in products.items],
+        'pagination': {
+            'page': page,
+            'pages': products.pages,
+            'per_page': per_page,
+            'total': products.total,
+            'has_next': products.has_next,
+            'has_prev': products.has_prev
+        }
+    }
+
 @product_bp.route('/', methods=['GET'])
 def get_products():
     """Obtener todos los productos con filtros opcionales"""
@@ -12,54 +86,174 @@ def get_products():
         # Parámetros de consulta
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
-        search = request.args.get('search', '')
-        category_id = request.args.get('category_id', type=int)
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        in_stock = request.args.get('in_stock', type=bool)
-        
-        # Construir query base
-        query = Product.query
-        
-        # Filtro por búsqueda en nombre
-        if search:
-            query = query.filter(Product.ProductName.contains(search))
-        
-        # Filtro por categoría
-        if category_id:
-            query = query.join(product_categories).filter(
-                product_categories.c.id_Category == category_id
-            )
+        sort = request.args.get('sort', 'id')
+        if sort not in product_listing.SORTS:
+            return jsonify({'error': f'sort debe ser uno de: {", ".join(product_listing.SORTS)}'}), 400
         
-        # Filtro por rango de precios
-        if min_price is not None:
-            query = query.filter(Product.Price >= min_price)
-        if max_price is not None:
-            query = query.filter(Product.Price <= max_price)
-        
-        # Filtro por stock
-        if in_stock:
-            query = query.filter(Product.Stock > 0)
-        
-        # Paginación
-        products = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        # Una sola tabla: categorías e imágenes ya vienen en la fila
+        query = product_listing.listing_query(**get_product_filters(), sort=sort)
         
-        return jsonify({
-            'products': [product.to_dict(include_categories=True, include_images=True) 
-                        for product in products.items],
-            'pagination': {
-                'page': page,
-                'pages': products.pages,
-                'per_page': per_page,
-                'total': products.total,
-                'has_next': products.has_next,
-                'has_prev': products.has_prev
-            }
-        }), 200
+        return jsonify(paginate_products(query, page, per_page)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def facet_counts(filters, bucket_size):
+    """
+    Conteos por categoría, rango de precio y stock en una sola consulta.
+    
+    Cada faceta cuenta los productos que cumplen la búsqueda y todos los
+    filtros excepto el suyo, para que el cliente pueda mostrar cuántos
+    resultados tendría al cambiar ese filtro.
+    """
+    # Una fila de product_listing (la misma tabla que la página) por producto
+    # que coincide con la búsqueda, con un flag por filtro
+    price_conditions = []
+    if filters['min_price'] is not None:
+        price_conditions.append(ProductListing.Price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        price_conditions.append(ProductListing.Price <= filters['max_price'])
+    
+    conditions = {
+        'in_category': ProductListing.CategoryIds.contains(f',{int(filters["category_id"])},')
+            if filters['category_id'] else None,
+        'in_price': and_(*price_conditions) if price_conditions else None,
+        'in_stock': ProductListing.Stock > 0 if filters['in_stock'] else None
+    }
+    
+    base = select(
+        ProductListing.id_Product,
+        ProductListing.Categories,
+        # Los precios no son negativos: truncar equivale a floor
+        cast(ProductListing.Price / bucket_size, Integer).label('bucket'),
+        case((ProductListing.Stock > 0, 1), else_=0).label('available'),
+        *[
+            (case((condition, 1), else_=0) if condition is not None else literal(1)).label(name)
+            for name, condition in conditions.items()
+        ]
+    )
+    if filters['search']:
+        base = base.where(ProductListing.ProductName.contains(filters['search']))
+    base = base.cte('facet_base')
+    
+    # Las categorías de cada fila salen de su JSON, no de PRODUC_Category
+    category = func.json_each(base.c.Categories).table_valued('value').alias('listing_category')
+    category_id = func.json_extract(category.c.value, '$.id_Category')
+    category_name = func.json_extract(category.c.value, '$.CategoryName')
+    by_category = select(
+        literal('category').label('facet'),
+        category_id.label('value'),
+        category_name.label('name'),
+        func.count().label('count')
+    ).select_from(base).join(category, literal(True)).where(
+        base.c.in_price == 1, base.c.in_stock == 1
+    ).group_by(category_id, category_name)
+    
+    by_price = select(
+        literal('price').label('facet'),
+        base.c.bucket.label('value'),
+        literal(None).label('name'),
+        func.count().label('count')
+    ).where(base.c.in_category == 1, base.c.in_stock == 1).group_by(base.c.bucket)
+    
+    by_stock = select(
+        literal('stock').label('facet'),
+        base.c.available.label('value'),
+        literal(None).label('name'),
+        func.count().label('count')
+    ).where(base.c.in_category == 1, base.c.in_price == 1).group_by(base.c.available)
+    
+    rows = db.session.execute(union_all(by_category, by_price, by_stock)).all()
+    
+    facets = {'categories': [], 'price': [], 'stock': {'in_stock': 0, 'out_of_stock': 0}}
+    for facet, value, name, count in rows:
+        if facet == 'category':
+            facets['categories'].append({
+                'id_Category': value,
+                'CategoryName': name,
+                'count': count
+            })
+        elif facet == 'price':
+            facets['price'].append({
+                'min': value * bucket_size,
+                'max': (value + 1) * bucket_size,
+                'count': count
+            })
+        else:
+            facets['stock']['in_stock' if value else 'out_of_stock'] = count
+    
+    facets['categories'].sort(key=lambda item: item['count'], reverse=True)
+    facets['price'].sort(key=lambda item: item['min'])
+    return facets
+
+@product_bp.route('/facets', methods=['GET'])
+def get_product_facets():
+    """Obtener una página de productos junto con los conteos de cada filtro"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        bucket_size = request.args.get('bucket_size', 100, type=float)
+        
+        if bucket_size <= 0:
+            return jsonify({'error': 'bucket_size debe ser mayor que cero'}), 400
+        
+        filters = get_product_filters()
+        result = paginate_products(product_listing.listing_query(**filters), page, per_page)
+        result['facets'] = facet_counts(filters, bucket_size)
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(state):
+    """Evento SSE con el estado de un producto"""
+    return f'event: product\ndata: {json.dumps(state)}\n\n'
+
+@product_bp.route('/stream', methods=['GET'])
+def stream_products():
+    """Cambios de stock y precio de varios productos como Server-Sent Events"""
+    try:
+        config = current_app.config
+        try:
+            product_ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+        except ValueError:
+            return jsonify({'error': 'ids debe ser una lista de enteros separados por coma'}), 400
+        if not product_ids:
+            return jsonify({'error': 'ids es requerido'}), 400
+        if len(product_ids) > config['PRODUCT_STREAM_MAX_IDS']:
+            return jsonify({'error': f'Máximo {config["PRODUCT_STREAM_MAX_IDS"]} productos por conexión'}), 400
+        if product_stream.hub.count >= config['PRODUCT_STREAM_MAX_SUBSCRIBERS']:
+            return jsonify({'error': 'Demasiadas conexiones abiertas, intenta más tarde'}), 503
+        
+        # Estado inicial; desde aquí solo se envían cambios
+        states = product_stream.load_states(product_ids)
+        states = {
+            product_id: states.get(product_id) or product_stream.deleted_state(product_id)
+            for product_id in product_ids
+        }
+        subscription = product_stream.hub.subscribe(product_ids, states)
+        keepalive = config['PRODUCT_STREAM_KEEPALIVE_SECONDS']
+        
+        # Sin stream_with_context: la conexión no retiene la sesión de base de datos
+        def generate():
+            yield 'retry: 3000\n\n'
+            for state in states.values():
+                yield sse_event(state)
+            while True:
+                changes = subscription.wait(keepalive)
+                if not changes:
+                    yield ': keepalive\n\n'
+                for state in changes:
+                    yield sse_event(state)
+        
+        response = Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        # El servidor cierra la respuesta cuando el cliente se desconecta
+        response.call_on_close(lambda: product_stream.hub.unsubscribe(subscription))
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -71,7 +265,7 @@ def get_product(product_id):
         product = Product.query.get_or_404(product_id)
         return jsonify({
             'product': product.to_dict(include_categories=True, include_images=True)
-        }), 200
+        }), 200, etag(product)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -103,7 +297,10 @@ def create_product():
                     new_product.categories.append(category)
         
         db.session.add(new_product)
+        db.session.flush()  # Para obtener el ID
+        product_listing.refresh([new_product.id_Product])
         db.session.commit()
+        product_saved(new_product.id_Product, new_product.ProductName)
         
         return jsonify({
             'message': 'Producto creado exitosamente',
@@ -121,6 +318,14 @@ def update_product(product_id):
         product = Product.query.get_or_404(product_id)
         data = request.get_json()
         
+        # Verificar la versión enviada por el cliente
+        expected_versions = get_if_match()
+        if expected_versions is not None:
+            if not expected_versions:
+                return invalid_if_match()
+            if product.Version not in expected_versions:
+                return version_conflict(product.Version)
+        
         # Actualizar campos
         if 'ProductName' in data:
             product.ProductName = data['ProductName']
@@ -137,13 +342,21 @@ def update_product(product_id):
                 if category:
                     product.categories.append(category)
         
+        product_listing.refresh([product_id])
         db.session.commit()
+        availability.invalidate([product_id])
+        product_saved(product_id, product.ProductName)
+        product_stream.publish([product_id])
         
         return jsonify({
             'message': 'Producto actualizado exitosamente',
             'product': product.to_dict(include_categories=True)
-        }), 200
+        }), 200, etag(product)
         
+    except StaleDataError:
+        # Otra petición actualizó el producto entre la lectura y el UPDATE
+        db.session.rollback()
+        return version_conflict(db.session.query(Product.Version).filter_by(id_Product=product_id).scalar())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -154,14 +367,22 @@ def delete_product(product_id):
     try:
         product = Product.query.get_or_404(product_id)
         
-        # Verificar si tiene ventas asociadas
-        if product.sales_details:
+        # Verificar si tiene ventas asociadas (también archivadas)
+        if archive.product_has_sales(product_id):
             return jsonify({
                 'error': 'No se puede eliminar un producto con ventas asociadas'
             }), 400
         
+        # Eliminar reservas y contador de stock del producto
+        StockReservation.query.filter_by(id_Product=product_id).delete()
+        StockCounter.query.filter_by(id_Product=product_id).delete()
+        product_listing.remove([product_id])
+        
         db.session.delete(product)
         db.session.commit()
+        availability.invalidate([product_id])
+        product_deleted(product_id)
+        product_stream.publish([product_id])
         
         return jsonify({'message': 'Producto eliminado exitosamente'}), 200
         
@@ -196,6 +417,7 @@ def add_product_image(product_id):
         )
         
         db.session.add(new_image)
+        product_listing.refresh([product_id])
         db.session.commit()
         
         return jsonify({
@@ -217,6 +439,7 @@ def delete_product_image(product_id, image_id):
         ).first_or_404()
         
         db.session.delete(image)
+        product_listing.refresh([product_id])
         db.session.commit()
         
         return jsonify({'message': 'Imagen eliminada exitosamente'}), 200
@@ -229,7 +452,6 @@ def delete_product_image(product_id, image_id):
 def update_stock(product_id):
     """Actualizar stock de un producto"""
     try:
-        product = Product.query.get_or_404(product_id)
         data = request.get_json()
         
         if 'Stock' not in data:
@@ -238,39 +460,128 @@ def update_stock(product_id):
         if data['Stock'] < 0:
             return jsonify({'error': 'Stock no puede ser negativo'}), 400
         
-        product.Stock = data['Stock']
+        # Un único UPDATE (compare-and-swap si se envía If-Match)
+        expected_versions = get_if_match()
+        if expected_versions is not None and not expected_versions:
+            return invalid_if_match()
+        statement = Product.__table__.update().where(
+            Product.id_Product == product_id
+        ).values(Stock=data['Stock'], Version=Product.Version + 1)
+        if expected_versions is not None:
+            statement = statement.where(Product.Version.in_(expected_versions))
+        
+        result = db.session.execute(statement)
+        product_listing.refresh_stock([product_id])
         db.session.commit()
         
+        if result.rowcount == 0:
+            current_version = db.session.query(Product.Version).filter_by(id_Product=product_id).scalar()
+            if current_version is None:
+                return jsonify({'error': 'Producto no encontrado'}), 404
+            return version_conflict(current_version)
+        
+        availability.invalidate([product_id])
+        product_stream.publish([product_id])
+        product = Product.query.get(product_id)
+        
         return jsonify({
             'message': 'Stock actualizado exitosamente',
             'product': product.to_dict()
-        }), 200
+        }), 200, etag(product)
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@product_bp.route('/<int:product_id>/availability', methods=['GET'])
+def get_product_availability(product_id):
+    """Obtener stock disponible (stock menos reservas de carritos)"""
+    try:
+        available = availability.get([product_id])
+        if product_id not in available:
+            return jsonify({'error': 'Producto no encontrado'}), 404
+        
+        return jsonify({
+            'id_Product': product_id,
+            'available': available[product_id]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@product_bp.route('/<int:product_id>/related', methods=['GET'])
+def get_related_products(product_id):
+    """Productos comprados junto con este (índice de co-ocurrencias en memoria)"""
+    try:
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        neighbors = related_index.related(product_id, limit)
+        
+        # Una sola consulta por PK para el producto y sus vecinos
+        ids = [product_id] + [related_id for related_id, _ in neighbors]
+        products = {
+            product.id_Product: product
+            for product in Product.query.filter(Product.id_Product.in_(ids)).all()
+        }
+        if product_id not in products:
+            return jsonify({'error': 'Producto no encontrado'}), 404
+        
+        related = [
+            {**products[related_id].to_dict(), 'times_bought_together': times}
+            for related_id, times in neighbors if related_id in products
+        ]
+        return jsonify({
+            'id_Product': product_id,
+            'related': related,
+            'count': len(related)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @product_bp.route('/search', methods=['GET'])
 def search_products():
-    """Búsqueda avanzada de productos"""
+    """Búsqueda de productos tolerante a errores de tipeo (índice de trigramas)"""
     try:
         query_text = request.args.get('q', '')
+        limit = min(request.args.get('limit', 20, type=int), 50)
+        threshold = request.args.get('threshold', 0.3, type=float)
         
         if not query_text:
             return jsonify({'products': []}), 200
         
-        # Búsqueda en nombre y descripción
-        products = Product.query.filter(
-            or_(
-                Product.ProductName.contains(query_text),
-                # Aquí podrías agregar más campos si tienes descripción
-            )
-        ).limit(20).all()
+        # Ids ordenados por similitud sin recorrer la tabla de productos
+        matches = fuzzy_names.search(query_text, limit=limit, threshold=threshold)
+        products = {
+            product.id_Product: product
+            for product in Product.query.filter(Product.id_Product.in_([m[0] for m in matches])).all()
+        } if matches else {}
+        
+        results = []
+        for product_id, similarity in matches:
+            product = products.get(product_id)
+            if product:
+                results.append({**product.to_dict(include_categories=True), 'similarity': round(similarity, 3)})
+        
+        return jsonify({
+            'products': results,
+            'count': len(results)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@product_bp.route('/suggest', methods=['GET'])
+def suggest_products():
+    """Autocompletar nombres de producto (índice de prefijos en memoria)"""
+    try:
+        query_text = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
         
         return jsonify({
-            'products': [product.to_dict(include_categories=True) 
-                        for product in products],
-            'count': len(products)
+            'suggestions': [
+                {'id_Product': product_id, 'ProductName': name}
+                for product_id, name in suggestions.suggest(query_text, limit)
+            ]
         }), 200
         
     except Exception as e:
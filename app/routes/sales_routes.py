@@ -1,26 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app import db
 from app.models import Sales, SalesDetail, TemporalSales, Product, Users
+from app.security import get_user_from_token
+from app.idempotency import idempotent
+from app.routing import use_replica
+from app import reservations, outbox, archive, analytics, snapshot, recommendations, product_stream, product_listing
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
-import jwt
-import os
+import json
 
 sales_bp = Blueprint('sales', __name__)
 
-def get_user_from_token():
-    """Obtener usuario del token JWT"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return None
-    
-    if token.startswith('Bearer '):
-        token = token[7:]
-    
-    try:
-        payload = jwt.decode(token, os.getenv('SECRET_KEY', 'HolaMundo'), algorithms=['HS256'])
-        return Users.query.get(payload['user_id'])
-    except:
-        return None
+def is_integer(value):
+    """Entero de JSON (true/false llegan como bool, que es subclase de int)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def reservation_conflict():
+    """Respuesta 409 cuando la reserva cambió mientras se actualizaba el carrito"""
+    return jsonify({'error': 'La reserva de stock cambió mientras se actualizaba el carrito, intenta de nuevo'}), 409
 
 # ===============================
 # RUTAS DEL CARRITO (TemporalSales)
@@ -51,7 +48,42 @@ def get_cart():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@sales_bp.route('/cart/related', methods=['GET'])
+def get_cart_related():
+    """Productos que suelen comprarse junto con los del carrito"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        cart_products = db.session.query(TemporalSales.id_Product).filter_by(
+            iD_User=user.iD_User,
+            id_Sale=None
+        ).distinct().all()
+        neighbors = recommendations.related_index.related_to_many(
+            [row.id_Product for row in cart_products], limit
+        )
+        
+        products = {
+            product.id_Product: product
+            for product in Product.query.filter(Product.id_Product.in_([related_id for related_id, _ in neighbors])).all()
+        } if neighbors else {}
+        related = [
+            {**products[related_id].to_dict(), 'times_bought_together': times}
+            for related_id, times in neighbors if related_id in products
+        ]
+        
+        return jsonify({
+            'related': related,
+            'count': len(related)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @sales_bp.route('/cart/add', methods=['POST'])
+@idempotent
 def add_to_cart():
     """Agregar producto al carrito"""
     try:
@@ -69,14 +101,11 @@ def add_to_cart():
         if quantity <= 0:
             return jsonify({'error': 'Cantidad debe ser mayor a 0'}), 400
         
-        # Verificar que el producto existe y tiene stock
+        # Verificar que el producto existe
         product = Product.query.get(data['id_Product'])
         if not product:
             return jsonify({'error': 'Producto no encontrado'}), 404
         
-        if product.Stock < quantity:
-            return jsonify({'error': 'Stock insuficiente'}), 400
-        
         # Verificar si ya existe en el carrito
         existing_item = TemporalSales.query.filter_by(
             iD_User=user.iD_User,
@@ -84,12 +113,16 @@ def add_to_cart():
             id_Sale=None
         ).first()
         
+        # Reservar stock para la cantidad total del carrito
+        new_quantity = quantity + (existing_item.quantity if existing_item else 0)
+        if reservations.reserve(user.iD_User, {product.id_Product: new_quantity}):
+            db.session.rollback()
+            if existing_item:
+                return jsonify({'error': 'Stock insuficiente para la cantidad total'}), 400
+            return jsonify({'error': 'Stock insuficiente'}), 400
+        
         if existing_item:
             # Actualizar cantidad
-            new_quantity = existing_item.quantity + quantity
-            if product.Stock < new_quantity:
-                return jsonify({'error': 'Stock insuficiente para la cantidad total'}), 400
-            
             existing_item.quantity = new_quantity
             existing_item.DateAdded = datetime.utcnow()
         else:
@@ -105,11 +138,137 @@ def add_to_cart():
         
         return jsonify({'message': 'Producto agregado al carrito'}), 200
         
+    except StaleDataError:
+        # release_expired liberó la reserva entre la lectura y el flush
+        db.session.rollback()
+        return reservation_conflict()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@sales_bp.route('/cart/bulk', methods=['POST'])
+@idempotent
+def bulk_update_cart():
+    """Agregar, actualizar o eliminar varios productos del carrito en una sola transacción"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+
+        data = request.get_json() or {}
+        items = data.get('items')
+
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items es requerido'}), 400
+
+        # Validar formato de cada operación
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not is_integer(item.get('id_Product')) or item['id_Product'] <= 0:
+                return jsonify({'error': f'items[{index}]: id_Product debe ser un entero positivo'}), 400
+
+            action = item.get('action', 'add')
+            if action not in ('add', 'set', 'remove'):
+                return jsonify({'error': f'items[{index}]: acción inválida ({action})'}), 400
+
+            quantity = item.get('quantity', 1)
+            if action == 'add' and (not is_integer(quantity) or quantity <= 0):
+                return jsonify({'error': f'items[{index}]: cantidad debe ser mayor a 0'}), 400
+            if action == 'set' and (not is_integer(quantity) or quantity < 0):
+                return jsonify({'error': f'items[{index}]: cantidad no puede ser negativa'}), 400
+
+        product_ids = {item['id_Product'] for item in items}
+
+        # Una sola consulta IN para productos y otra para el carrito actual
+        products = {
+            product.id_Product: product
+            for product in Product.query.filter(Product.id_Product.in_(product_ids)).all()
+        }
+        # Un producto puede tener varias filas en el carrito (agregadas por
+        # endpoints anteriores): se suman y se dejan en una sola
+        existing_items = {}
+        for cart_item in TemporalSales.query.filter(
+            TemporalSales.iD_User == user.iD_User,
+            TemporalSales.id_Sale.is_(None),
+            TemporalSales.id_Product.in_(product_ids)
+        ).order_by(TemporalSales.id_TemporalSales).all():
+            existing_items.setdefault(cart_item.id_Product, []).append(cart_item)
+
+        # Calcular cantidades finales por producto
+        quantities = {
+            product_id: sum(cart_item.quantity for cart_item in cart_items)
+            for product_id, cart_items in existing_items.items()
+        }
+        for item in items:
+            product_id = item['id_Product']
+            action = item.get('action', 'add')
+
+            if action == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + item.get('quantity', 1)
+            elif action == 'set':
+                quantities[product_id] = item.get('quantity', 1)
+            elif product_id in quantities:
+                quantities[product_id] = 0
+            # Quitar un producto que no está en el carrito no cambia nada
+
+        # Validar existencia de los productos que quedan en el carrito antes de escribir
+        errors = [
+            {'id_Product': product_id, 'error': 'Producto no encontrado'}
+            for product_id, quantity in quantities.items() if quantity > 0 and product_id not in products
+        ]
+
+        # Reservar el stock de todos los productos (UPDATE condicional por producto)
+        if not errors:
+            errors = [
+                {'id_Product': product_id, 'error': 'Stock insuficiente'}
+                for product_id in reservations.reserve(user.iD_User, quantities)
+            ]
+
+        if errors:
+            db.session.rollback()
+            return jsonify({'error': 'No se pudo actualizar el carrito', 'items': errors}), 400
+
+        # Aplicar todos los cambios en un único flush/commit
+        now = datetime.utcnow()
+        for product_id, quantity in quantities.items():
+            cart_item, *duplicates = existing_items.get(product_id) or [None]
+            for duplicate in duplicates:
+                db.session.delete(duplicate)
+
+            if quantity == 0:
+                if cart_item:
+                    db.session.delete(cart_item)
+            elif cart_item:
+                if cart_item.quantity != quantity:
+                    cart_item.quantity = quantity
+                    cart_item.DateAdded = now
+            else:
+                db.session.add(TemporalSales(
+                    iD_User=user.iD_User,
+                    id_Product=product_id,
+                    quantity=quantity,
+                    DateAdded=now
+                ))
+
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Carrito actualizado',
+            'items': [
+                {'id_Product': product_id, 'quantity': quantities.get(product_id, 0)}
+                for product_id in dict.fromkeys(item['id_Product'] for item in items)
+            ]
+        }), 200
+
+    except StaleDataError:
+        # release_expired liberó la reserva entre la lectura y el flush
+        db.session.rollback()
+        return reservation_conflict()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @sales_bp.route('/cart/update/<int:item_id>', methods=['PUT'])
+@idempotent
 def update_cart_item(item_id):
     """Actualizar cantidad de un item del carrito"""
     try:
@@ -130,8 +289,9 @@ def update_cart_item(item_id):
             id_Sale=None
         ).first_or_404()
         
-        # Verificar stock
-        if cart_item.product.Stock < quantity:
+        # Ajustar la reserva de stock a la nueva cantidad
+        if reservations.reserve(user.iD_User, {cart_item.id_Product: quantity}):
+            db.session.rollback()
             return jsonify({'error': 'Stock insuficiente'}), 400
         
         cart_item.quantity = quantity
@@ -144,11 +304,16 @@ def update_cart_item(item_id):
             'item': cart_item.to_dict()
         }), 200
         
+    except StaleDataError:
+        # release_expired liberó la reserva entre la lectura y el flush
+        db.session.rollback()
+        return reservation_conflict()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @sales_bp.route('/cart/remove/<int:item_id>', methods=['DELETE'])
+@idempotent
 def remove_from_cart(item_id):
     """Eliminar item del carrito"""
     try:
@@ -162,6 +327,7 @@ def remove_from_cart(item_id):
             id_Sale=None
         ).first_or_404()
         
+        reservations.release(user.iD_User, [cart_item.id_Product])
         db.session.delete(cart_item)
         db.session.commit()
         
@@ -172,6 +338,7 @@ def remove_from_cart(item_id):
         return jsonify({'error': str(e)}), 500
 
 @sales_bp.route('/cart/clear', methods=['DELETE'])
+@idempotent
 def clear_cart():
     """Vaciar carrito completo"""
     try:
@@ -183,6 +350,7 @@ def clear_cart():
             iD_User=user.iD_User,
             id_Sale=None
         ).delete()
+        reservations.release(user.iD_User)
         
         db.session.commit()
         
@@ -197,6 +365,7 @@ def clear_cart():
 # ===============================
 
 @sales_bp.route('/checkout', methods=['POST'])
+@idempotent
 def checkout():
     """Procesar compra del carrito"""
     try:
@@ -213,12 +382,18 @@ def checkout():
         if not cart_items:
             return jsonify({'error': 'Carrito vacío'}), 400
         
-        # Verificar stock de todos los productos
+        # Consumir las reservas: el UPDATE que descuenta el stock devuelve el precio
+        quantities = {}
         for item in cart_items:
-            if item.product.Stock < item.quantity:
-                return jsonify({
-                    'error': f'Stock insuficiente para {item.product.ProductName}'
-                }), 400
+            quantities[item.id_Product] = quantities.get(item.id_Product, 0) + item.quantity
+        
+        shortages, prices = reservations.consume(user.iD_User, quantities)
+        if shortages:
+            db.session.rollback()
+            product = Product.query.get(shortages[0])
+            return jsonify({
+                'error': f'Stock insuficiente para {product.ProductName if product else shortages[0]}'
+            }), 400
         
         # Crear venta
         data = request.get_json() or {}
@@ -233,7 +408,7 @@ def checkout():
         
         total_sale = 0
         
-        # Crear detalles de venta y actualizar stock
+        # Crear detalles de venta (el stock ya se descontó)
         for item in cart_items:
             # Crear detalle de venta
             detail = SalesDetail(
@@ -242,19 +417,43 @@ def checkout():
                 id_TemporalSales=item.id_TemporalSales,
                 DateSales=datetime.utcnow(),
                 amount=item.quantity,
-                ValueSale=item.product.Price * item.quantity
+                ValueSale=prices[item.id_Product] * item.quantity
             )
             
-            # Actualizar stock
-            item.product.Stock -= item.quantity
-            
             # Vincular item temporal con la venta
             item.id_Sale = new_sale.id_Sale
             
             total_sale += detail.ValueSale
             db.session.add(detail)
         
+        # Evento para facturación, analítica y correos, en la misma transacción
+        outbox.enqueue('sale.completed', {
+            'id_Sale': new_sale.id_Sale,
+            'iD_User': user.iD_User,
+            'Email': user.Email,
+            'DescripcionSale': new_sale.DescripcionSale,
+            'DateCreated': new_sale.DateCreated.isoformat(),
+            'total': total_sale,
+            'items': [
+                {
+                    'id_Product': item.id_Product,
+                    'amount': item.quantity,
+                    'ValueSale': prices[item.id_Product] * item.quantity
+                }
+                for item in cart_items
+            ]
+        })
+        
+        # Pares de productos comprados juntos
+        recommendations.record_sale(quantities)
+        
+        # Stock del listado desnormalizado
+        product_listing.refresh_stock(quantities)
+        
         db.session.commit()
+        outbox.notify()
+        recommendations.sale_recorded(quantities)
+        product_stream.publish(quantities)
         
         return jsonify({
             'message': 'Compra procesada exitosamente',
@@ -304,6 +503,35 @@ def get_sales():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@sales_bp.route('/export', methods=['GET'])
+def export_sales():
+    """Exportar todas las ventas, incluidas las archivadas, como JSON por línea (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        chunk_size = min(max(request.args.get('chunk_size', 500, type=int), 1), 5000)
+        
+        def generate():
+            with use_replica(db.session):
+                for sale in archive.iter_sales(chunk_size):
+                    yield json.dumps(sale, ensure_ascii=False) + '\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=sales.ndjson'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @sales_bp.route('/<int:sale_id>', methods=['GET'])
 def get_sale(sale_id):
     """Obtener detalle de una venta específica"""
@@ -312,15 +540,20 @@ def get_sale(sale_id):
         if not user:
             return jsonify({'error': 'Token inválido'}), 401
         
-        sale = Sales.query.get_or_404(sale_id)
+        sale = Sales.query.get(sale_id)
+        
+        # Las ventas antiguas se buscan en las particiones de archivo
+        sale_data = sale.to_dict(include_details=True) if sale else archive.find_sale(sale_id)
+        if sale_data is None:
+            return jsonify({'error': 'Venta no encontrada'}), 404
         
         # Verificar permisos
         is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
-        if not is_admin and sale.iD_User != user.iD_User:
+        if not is_admin and sale_data['iD_User'] != user.iD_User:
             return jsonify({'error': 'No tienes permiso para ver esta venta'}), 403
         
         return jsonify({
-            'sale': sale.to_dict(include_details=True)
+            'sale': sale_data
         }), 200
         
     except Exception as e:
@@ -339,21 +572,38 @@ def get_sales_stats():
         if not is_admin:
             return jsonify({'error': 'No tienes permisos de administrador'}), 403
         
-        # Estadísticas básicas
-        total_sales = Sales.query.count()
-        total_revenue = db.session.query(db.func.sum(SalesDetail.ValueSale)).scalar() or 0
-        
-        # Ventas del último mes
         from datetime import datetime, timedelta
         last_month = datetime.utcnow() - timedelta(days=30)
-        recent_sales = Sales.query.filter(Sales.DateCreated >= last_month).count()
         
-        return jsonify({
+        # ?source=snapshot: calcular sobre el snapshot de analítica sin consultar
+        # la base de datos. Es aproximado: llega hasta la última exportación
+        # (as_of), compara por día y cuenta las ventas que tienen detalles.
+        columns, manifest = None, None
+        if request.args.get('source') == 'snapshot':
+            columns, manifest = snapshot.reader.get()
+            if columns is None:
+                return jsonify({'error': 'No hay snapshot de analítica disponible'}), 503
+            total_sales, total_revenue, recent_sales = analytics.sales_totals(
+                columns, analytics.np.datetime64(last_month, 'D')
+            )
+        else:
+            with use_replica(db.session):
+                # Estadísticas básicas (incluyen las ventas archivadas)
+                total_sales, total_revenue = archive.totals()
+                
+                # Ventas del último mes
+                recent_sales = Sales.query.filter(Sales.DateCreated >= last_month).count()
+        
+        stats = {
             'total_sales': total_sales,
             'total_revenue': float(total_revenue),
             'recent_sales': recent_sales,
             'average_sale': float(total_revenue / total_sales) if total_sales > 0 else 0
-        }), 200
+        }
+        if manifest:
+            stats['as_of'] = manifest['updated_at']
+        
+        return jsonify(stats), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
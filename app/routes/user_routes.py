@@ -1,26 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app import db
 from app.models import Users, RoleS, Sales
-import jwt
-import os
+from app.security import get_user_from_token
+from app.routing import use_replica
+from app.user_listing import paginate_users, list_users, iter_users
+from app import archive
+import json
 
 user_bp = Blueprint('users', __name__)
 
-def get_user_from_token():
-    """Obtener usuario del token JWT"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return None
-    
-    if token.startswith('Bearer '):
-        token = token[7:]
-    
-    try:
-        payload = jwt.decode(token, os.getenv('SECRET_KEY', 'HolaMundo'), algorithms=['HS256'])
-        return Users.query.get(payload['user_id'])
-    except:
-        return None
-
 @user_bp.route('/profile', methods=['GET'])
 def get_profile():
     """Obtener perfil del usuario actual"""
@@ -89,35 +77,47 @@ def get_users():
         per_page = request.args.get('per_page', 10, type=int)
         search = request.args.get('search', '')
         
-        # Construir query
-        query = Users.query
-        
-        if search:
-            query = query.filter(
-                (Users.UserName.contains(search)) |
-                (Users.Email.contains(search))
-            )
-        
-        # Paginación
-        users = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Usuarios con ciudad y roles en un número fijo de consultas
+        users, pagination = paginate_users(page, per_page, search)
         
         return jsonify({
-            'users': [u.to_dict(include_roles=True) for u in users.items],
-            'pagination': {
-                'page': page,
-                'pages': users.pages,
-                'per_page': per_page,
-                'total': users.total
-            }
+            'users': users,
+            'pagination': pagination
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@user_bp.route('/export', methods=['GET'])
+def export_users():
+    """Exportar todos los usuarios como JSON por línea (solo admin)"""
+    try:
+        user = get_user_from_token()
+        if not user:
+            return jsonify({'error': 'Token inválido'}), 401
+        
+        # Verificar si es admin
+        is_admin = any(role.TypeRole == 'Administrador' for role in user.roles)
+        if not is_admin:
+            return jsonify({'error': 'No tienes permisos de administrador'}), 403
+        
+        chunk_size = min(max(request.args.get('chunk_size', 500, type=int), 1), 5000)
+        
+        # Se envía a medida que se leen los bloques, sin armar la lista completa
+        def generate():
+            with use_replica(db.session):
+                for item in iter_users(chunk_size):
+                    yield json.dumps(item, ensure_ascii=False) + '\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=users.ndjson'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @user_bp.route('/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     """Obtener un usuario específico (solo admin o el mismo usuario)"""
@@ -198,8 +198,8 @@ def delete_user(user_id):
         
         target_user = Users.query.get_or_404(user_id)
         
-        # Verificar si tiene ventas asociadas
-        if target_user.sales:
+        # Verificar si tiene ventas asociadas (también archivadas)
+        if archive.user_has_sales(user_id):
             return jsonify({
                 'error': 'No se puede eliminar un usuario con ventas asociadas'
             }), 400
@@ -317,13 +317,10 @@ def search_users():
         if not query_text:
             return jsonify({'users': []}), 200
         
-        users = Users.query.filter(
-            (Users.UserName.contains(query_text)) |
-            (Users.Email.contains(query_text))
-        ).limit(20).all()
+        users = list_users(query_text, limit=20)
         
         return jsonify({
-            'users': [user.to_dict(include_roles=True) for user in users],
+            'users': users,
             'count': len(users)
         }), 200
         
@@ -0,0 +1,137 @@
+from flask import request
+from flask_sqlalchemy.session import Session
+from contextlib import contextmanager
+from sqlalchemy import event
+from app.background import start_thread
+import math
+import sqlite3
+import time
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD')
+
+class RoutingSession(Session):
+    """
+    Sesión que envía las lecturas a la réplica y todo lo demás al primario.
+
+    Una consulta va a la réplica solo si:
+      - existe el bind 'replica' (REPLICA_DATABASE_URL)
+      - la petición es GET/HEAD y el cliente no escribió hace poco, o el
+        bloque está marcado con `use_replica()` (lecturas pesadas que
+        toleran el retraso de la réplica)
+      - la sesión no ha escrito nada todavía (flush) en este contexto
+      - la sentencia no es INSERT/UPDATE/DELETE
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.routes_to_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def routes_to_replica(self, clause):
+        """Decidir si la sentencia actual puede leerse de la réplica"""
+        read_only = self.info.get('read_only') or self.info.get('use_replica')
+        if not read_only or self.info.get('wrote') or self._flushing:
+            return False
+
+        if clause is not None and getattr(clause, 'is_dml', False):
+            return False
+
+        return REPLICA_BIND in self._db.engines
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_session_wrote(session, flush_context):
+    """Después de escribir, el resto del contexto lee del primario"""
+    session.info['wrote'] = True
+
+@contextmanager
+def use_replica(session):
+    """
+    Enviar a la réplica las consultas de un bloque marcado como solo lectura,
+    aunque el cliente haya escrito hace poco (exportaciones, estadísticas).
+    Lo que la sesión ya escribió en este contexto se sigue leyendo del primario.
+    """
+    previous = session.info.get('use_replica', False)
+    session.info['use_replica'] = True
+    try:
+        yield session
+    finally:
+        session.info['use_replica'] = previous
+
+# Marca de lectura del primario tras escribir. Viaja con el cliente (cookie o
+# header) porque con varios workers su siguiente petición puede caer en otro
+# proceso; el valor es el instante (epoch) hasta el que debe leer del primario.
+STICKY_COOKIE = 'read_primary_until'
+STICKY_HEADER = 'X-Read-Primary-Until'
+
+def sticky_until():
+    """Instante hasta el que el cliente debe leer del primario (0 si no hay marca)"""
+    value = request.headers.get(STICKY_HEADER) or request.cookies.get(STICKY_COOKIE)
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+def init_routing(app, db):
+    """Registrar los hooks que marcan cada request como lectura o escritura"""
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.before_request
+    def route_session():
+        db.session.info['read_only'] = (
+            request.method in READ_METHODS and sticky_until() < time.time()
+        )
+
+    @app.after_request
+    def remember_writes(response):
+        # Después de escribir, el cliente lee del primario hasta que la réplica se ponga al día
+        if db.session.info.get('wrote') and sticky_seconds > 0:
+            until = f'{time.time() + sticky_seconds:.3f}'
+            response.set_cookie(STICKY_COOKIE, until, max_age=math.ceil(sticky_seconds),
+                                httponly=True, samesite='Lax')
+            response.headers[STICKY_HEADER] = until
+        return response
+
+    @app.cli.command('sync-replica')
+    def sync_replica_command():
+        """Copiar la base de datos primaria sobre la réplica SQLite"""
+        sync_sqlite_replica(*sqlite_paths(app, db))
+        print('Réplica sincronizada')
+
+    interval = app.config.get('REPLICA_SYNC_INTERVAL')
+    if interval:
+        start_replica_sync(*sqlite_paths(app, db), interval)
+
+def sqlite_paths(app, db):
+    """Rutas de archivo del primario y la réplica (solo SQLite)"""
+    with app.app_context():
+        urls = [db.engines[None].url, db.engines[REPLICA_BIND].url]
+
+    for url in urls:
+        if url.get_backend_name() != 'sqlite' or not url.database:
+            raise ValueError(f'Solo se puede sincronizar SQLite en archivo: {url}')
+
+    return urls[0].database, urls[1].database
+
+def sync_sqlite_replica(primary_path, replica_path):
+    """Copiar el primario sobre la réplica usando la API de backup de SQLite"""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def start_replica_sync(primary_path, replica_path, interval):
+    """Sincronizar periódicamente una réplica SQLite local en un hilo de fondo"""
+    def loop():
+        while True:
+            try:
+                sync_sqlite_replica(primary_path, replica_path)
+            except Exception as e:
+                print(f'Error sincronizando réplica: {e}')
+            time.sleep(interval)
+
+    return start_thread(loop, 'replica-sync')
@@ -0,0 +1,91 @@
+from app import db
+from sqlalchemy import text
+from app.migrations import MIGRATIONS, run_migrations
+from datetime import datetime
+import hashlib
+
+# Modos de verificación del esquema al arrancar (variable SCHEMA_MODE)
+#   create: db.create_all() y migraciones pendientes en cada arranque
+#   verify: comparar la huella guardada en la base de datos y solo ejecutar
+#           create_all() cuando no coincide
+#   skip:   no tocar el esquema
+SCHEMA_MODES = ('create', 'verify', 'skip')
+
+FINGERPRINT_TABLE = 'schema_fingerprint'
+
+def compute_fingerprint(metadata=None):
+    """Calcular una huella (sha256) de las tablas, columnas e índices de los modelos"""
+    metadata = metadata if metadata is not None else db.metadata
+    parts = []
+
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        parts.append(f'table:{table.name}')
+        for column in table.columns:
+            parts.append(
+                f'column:{column.name}:{column.type}:{column.nullable}:{column.primary_key}'
+            )
+        for index in sorted(table.indexes, key=lambda i: i.name or ''):
+            columns = ','.join(column.name for column in index.columns)
+            parts.append(f'index:{index.name}:{columns}:{index.unique}')
+
+    for migration_id, _, _ in MIGRATIONS:
+        parts.append(f'migration:{migration_id}')
+
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def read_stored_fingerprint(connection):
+    """Leer la huella guardada (None si la tabla no existe o está vacía)"""
+    try:
+        return connection.execute(
+            text(f'SELECT fingerprint FROM {FINGERPRINT_TABLE} WHERE id = 1')
+        ).scalar()
+    except Exception:
+        connection.rollback()
+        return None
+
+def store_fingerprint(connection, fingerprint):
+    """Guardar la huella actual del esquema"""
+    connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} ('
+        'id INTEGER PRIMARY KEY, fingerprint VARCHAR(64) NOT NULL, updated_at VARCHAR(32))'
+    ))
+    connection.execute(text(f'DELETE FROM {FINGERPRINT_TABLE}'))
+    connection.execute(
+        text(f'INSERT INTO {FINGERPRINT_TABLE} (id, fingerprint, updated_at) VALUES (1, :fp, :ts)'),
+        {'fp': fingerprint, 'ts': datetime.utcnow().isoformat()}
+    )
+
+def ensure_schema(app):
+    """
+    Preparar el esquema según SCHEMA_MODE.
+
+    Returns:
+        str: acción realizada ('created', 'verified', 'skipped')
+    """
+    mode = app.config.get('SCHEMA_MODE', 'create')
+    if mode not in SCHEMA_MODES:
+        raise ValueError(f'SCHEMA_MODE inválido: {mode}')
+
+    if mode == 'skip':
+        return 'skipped'
+
+    # Los modelos deben estar importados para que db.metadata tenga las tablas
+    from app import models  # noqa: F401
+
+    with app.app_context():
+        if mode == 'create':
+            db.create_all()
+            run_migrations()
+            return 'created'
+
+        fingerprint = compute_fingerprint()
+        with db.engine.connect() as connection:
+            if read_stored_fingerprint(connection) == fingerprint:
+                return 'verified'
+
+        # La huella no coincide: crear lo que falte y guardar la nueva huella
+        db.create_all()
+        run_migrations()
+        with db.engine.begin() as connection:
+            store_fingerprint(connection, fingerprint)
+        return 'created'
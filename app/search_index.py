@@ -0,0 +1,419 @@
+from flask import current_app
+from app import db
+from app.models import Product, Country, States, City
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, insort
+import heapq
+import threading
+import time
+import unicodedata
+
+# ===============================
+# ÍNDICES DE BÚSQUEDA EN MEMORIA
+# ===============================
+#
+# Cada proceso mantiene una copia de los nombres de producto y de las
+# ubicaciones. Se construye en la primera consulta, se actualiza con los
+# cambios hechos por este proceso y se reconstruye cada SEARCH_INDEX_MAX_AGE
+# segundos para recoger los de los demás workers.
+
+def normalize(text):
+    """Minúsculas y sin acentos"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+def prefix_entries(entity_id, name):
+    """Claves de prefijo de un nombre: el nombre desde cada una de sus palabras"""
+    words = normalize(name).split()
+    return [(' '.join(words[position:]), entity_id) for position in range(len(words))]
+
+def prefix_matches(keys, names, prefix, limit):
+    """
+    Ids cuyas claves empiezan por `prefix` en un arreglo ordenado de
+    (clave, id), primero los nombres que empiezan por `prefix` y luego los
+    más cortos.
+    """
+    matches = {}
+    position = bisect_left(keys, (prefix,))
+    # Se revisan algunos candidatos de más para poder ordenarlos
+    while position < len(keys) and len(matches) < limit * 5:
+        key, entity_id = keys[position]
+        if not key.startswith(prefix):
+            break
+        name = names[entity_id]
+        rank = (0 if normalize(name).startswith(prefix) else 1, len(name), name)
+        matches[entity_id] = min(matches.get(entity_id, rank), rank)
+        position += 1
+
+    return sorted(matches, key=matches.get)[:limit]
+
+class NameIndex(ABC):
+    """
+    Base de los índices sobre ProductName.
+
+    Se construye en la primera consulta con todos los productos; las
+    subclases definen las claves de cada nombre en `index` / `unindex`.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.built_at = None
+        self.lock = threading.Lock()
+        # Una sola reconstrucción a la vez; los demás esperan y usan su resultado
+        self.rebuild_lock = threading.Lock()
+        # Cambios de este proceso hechos durante una reconstrucción: (id, nombre o None)
+        self.pending = None
+
+    def build(self):
+        """Reconstruir el índice con todos los productos"""
+        with self.lock:
+            self.pending = []
+        try:
+            rows = db.session.query(Product.id_Product, Product.ProductName).all()
+            with self.lock:
+                self.reset(rows)
+                self.names = {row.id_Product: row.ProductName for row in rows}
+                # La consulta pudo leer antes del commit de esos cambios: aplicarlos otra vez
+                for product_id, name in self.pending:
+                    self.replace(product_id, name)
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.pending = None
+
+    def stale(self):
+        max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', 300)
+        return self.built_at is None or bool(max_age and time.monotonic() - self.built_at > max_age)
+
+    def ensure_built(self):
+        if not self.stale():
+            return
+        with self.rebuild_lock:
+            if self.stale():
+                self.build()
+
+    def add(self, product_id, name):
+        """Agregar o reemplazar un producto"""
+        self.change(product_id, name)
+
+    def remove(self, product_id):
+        self.change(product_id, None)
+
+    def change(self, product_id, name):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((product_id, name))
+            if self.built_at is not None:
+                self.replace(product_id, name)
+
+    def replace(self, product_id, name):
+        """Quitar el producto y, si `name` no es None, volver a agregarlo (con el lock tomado)"""
+        self.discard(product_id)
+        if name is not None:
+            self.names[product_id] = name
+            self.index(product_id, name)
+
+    def discard(self, product_id):
+        name = self.names.pop(product_id, None)
+        if name is not None:
+            self.unindex(product_id, name)
+
+    @abstractmethod
+    def reset(self, rows):
+        """Reemplazar las claves con las de todas las filas (id_Product, ProductName)"""
+
+    @abstractmethod
+    def index(self, product_id, name):
+        """Agregar las claves de un nombre"""
+
+    @abstractmethod
+    def unindex(self, product_id, name):
+        """Quitar las claves de un nombre"""
+
+class PrefixIndex(NameIndex):
+    """
+    Índice de prefijos para autocompletar nombres de producto.
+
+    Guarda un arreglo ordenado de (clave, id_Product) con una clave por cada
+    palabra del nombre (el resto del nombre desde esa palabra), así "pro"
+    encuentra "iPhone 14 Pro". Una búsqueda es un bisect más un recorrido
+    de las claves que empiezan por el prefijo.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.keys = []
+
+    def reset(self, rows):
+        self.keys = sorted(entry for row in rows for entry in prefix_entries(row.id_Product, row.ProductName))
+
+    def index(self, product_id, name):
+        for entry in prefix_entries(product_id, name):
+            insort(self.keys, entry)
+
+    def unindex(self, product_id, name):
+        for entry in prefix_entries(product_id, name):
+            position = bisect_left(self.keys, entry)
+            if position < len(self.keys) and self.keys[position] == entry:
+                del self.keys[position]
+
+    def suggest(self, query, limit=10):
+        """
+        Productos cuyo nombre tiene una palabra que empieza por `query`.
+
+        Returns:
+            list: [(id_Product, ProductName)] primero los que empiezan por
+            `query` y luego los más cortos
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_built()
+
+        with self.lock:
+            ranked = prefix_matches(self.keys, self.names, prefix, limit)
+            return [(product_id, self.names[product_id]) for product_id in ranked]
+
+def trigrams(text):
+    """Trigramas de cada palabra, con dos espacios al inicio y uno al final"""
+    result = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        result.update(padded[position:position + 3] for position in range(len(padded) - 2))
+    return result
+
+class TrigramIndex(NameIndex):
+    """
+    Índice de trigramas para búsqueda tolerante a errores de tipeo.
+
+    Cada trigrama apunta a un array('I') ordenado con los ids de los
+    productos que lo contienen. Una búsqueda solo recorre las listas de los
+    trigramas de la consulta, sin leer la tabla product.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.postings = {}
+        self.sizes = {}
+
+    def reset(self, rows):
+        postings = {}
+        self.sizes = {}
+        for row in sorted(rows, key=lambda row: row.id_Product):
+            grams = trigrams(row.ProductName)
+            self.sizes[row.id_Product] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, array('I')).append(row.id_Product)
+        self.postings = postings
+
+    def index(self, product_id, name):
+        grams = trigrams(name)
+        self.sizes[product_id] = len(grams)
+        for gram in grams:
+            ids = self.postings.setdefault(gram, array('I'))
+            ids.insert(bisect_left(ids, product_id), product_id)
+
+    def unindex(self, product_id, name):
+        self.sizes.pop(product_id, None)
+        for gram in trigrams(name):
+            ids = self.postings.get(gram)
+            if ids is None:
+                continue
+            position = bisect_left(ids, product_id)
+            if position < len(ids) and ids[position] == product_id:
+                del ids[position]
+            if not ids:
+                del self.postings[gram]
+
+    def search(self, query, limit=20, threshold=0.3):
+        """
+        Productos más parecidos a `query`.
+
+        Returns:
+            list: [(id_Product, similitud)] ordenada de mayor a menor, solo
+            los que alcanzan `threshold`
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        self.ensure_built()
+
+        shared = {}
+        with self.lock:
+            for gram in grams:
+                for product_id in self.postings.get(gram, ()):
+                    shared[product_id] = shared.get(product_id, 0) + 1
+            sizes = {product_id: self.sizes[product_id] for product_id in shared}
+
+        # Similitud: fracción de los trigramas de la consulta presentes en el
+        # nombre; a igual similitud gana el nombre más parecido en total
+        scored = (
+            (product_id, count / len(grams), count / (len(grams) + sizes[product_id] - count))
+            for product_id, count in shared.items()
+        )
+        best = heapq.nlargest(
+            limit,
+            (item for item in scored if item[1] >= threshold),
+            key=lambda item: (item[1], item[2], -item[0])
+        )
+        return [(product_id, similarity) for product_id, similarity, _ in best]
+
+class LocationIndex:
+    """
+    Países, estados y ciudades completos en memoria.
+
+    Cada construcción arma una instantánea inmutable (diccionarios ya
+    serializados con los nombres de los padres, listas de hijos y claves de
+    prefijo por tipo) que se reemplaza de una vez, así las lecturas no
+    necesitan lock. Los endpoints de creación la invalidan.
+    """
+
+    TYPES = ('country', 'state', 'city')
+
+    def __init__(self):
+        self.snapshot = None
+        self.lock = threading.Lock()
+        # invalidate() la incrementa; una construcción que empezó antes no publica
+        self.generation = 0
+        self.publish_lock = threading.Lock()
+
+    def build(self):
+        """Cargar todas las ubicaciones (una consulta por tabla) y devolver la instantánea"""
+        generation = self.generation
+        countries = {
+            row.iD_Country: {'iD_Country': row.iD_Country, 'CountryName': row.CountryName}
+            for row in db.session.query(Country.iD_Country, Country.CountryName).order_by(Country.iD_Country)
+        }
+        states = {}
+        for row in db.session.query(States.iD_States, States.StatesName, States.iD_Country).order_by(States.iD_States):
+            country = countries.get(row.iD_Country)
+            states[row.iD_States] = {
+                'iD_States': row.iD_States,
+                'StatesName': row.StatesName,
+                'iD_Country': row.iD_Country,
+                'country': country['CountryName'] if country else None
+            }
+        cities = {}
+        for row in db.session.query(City.iD_City, City.CityName, City.iD_States).order_by(City.iD_City):
+            state = states.get(row.iD_States)
+            cities[row.iD_City] = {
+                'iD_City': row.iD_City,
+                'CityName': row.CityName,
+                'iD_States': row.iD_States,
+                'state': state['StatesName'] if state else None,
+                'country': state['country'] if state else None
+            }
+
+        states_by_country = {}
+        for state in states.values():
+            states_by_country.setdefault(state['iD_Country'], []).append(state)
+        cities_by_state = {}
+        cities_by_country = {}
+        for city in cities.values():
+            cities_by_state.setdefault(city['iD_States'], []).append(city)
+            state = states.get(city['iD_States'])
+            if state:
+                cities_by_country.setdefault(state['iD_Country'], []).append(city)
+
+        items = {'country': countries, 'state': states, 'city': cities}
+        name_fields = {'country': 'CountryName', 'state': 'StatesName', 'city': 'CityName'}
+        names = {
+            location_type: {entity_id: item[name_fields[location_type]] for entity_id, item in items[location_type].items()}
+            for location_type in self.TYPES
+        }
+
+        snapshot = {
+            'items': items,
+            'names': names,
+            'keys': {
+                location_type: sorted(
+                    entry for entity_id, name in names[location_type].items()
+                    for entry in prefix_entries(entity_id, name)
+                )
+                for location_type in self.TYPES
+            },
+            'states_by_country': states_by_country,
+            'cities_by_state': cities_by_state,
+            'cities_by_country': cities_by_country,
+            'built_at': time.monotonic()
+        }
+        with self.publish_lock:
+            # Si se invalidó mientras se leían las tablas, la instantánea puede
+            # no tener lo recién creado: sirve a quien la pidió, pero no se guarda
+            if self.generation == generation:
+                self.snapshot = snapshot
+        return snapshot
+
+    def current(self):
+        """
+        Instantánea vigente, construyéndola si hace falta.
+
+        Se lee self.snapshot una sola vez y se devuelve esa referencia: un
+        invalidate() concurrente no puede hacer que se devuelva None.
+        """
+        max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', 300)
+
+        def stale(snapshot):
+            return snapshot is None or (max_age and time.monotonic() - snapshot['built_at'] > max_age)
+
+        snapshot = self.snapshot
+        if stale(snapshot):
+            with self.lock:
+                snapshot = self.snapshot
+                if stale(snapshot):
+                    snapshot = self.build()
+        return snapshot
+
+    def invalidate(self):
+        with self.publish_lock:
+            self.generation += 1
+            self.snapshot = None
+
+    def search(self, query, location_type='all', limit=10):
+        """
+        Ubicaciones con una palabra que empieza por `query` (sin distinguir
+        acentos ni mayúsculas), hasta `limit` por tipo.
+
+        Returns:
+            list: [{'type': ..., 'data': ...}]
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        snapshot = self.current()
+
+        results = []
+        for current_type in self.TYPES:
+            if location_type not in ('all', current_type):
+                continue
+            for entity_id in prefix_matches(snapshot['keys'][current_type], snapshot['names'][current_type], prefix, limit):
+                results.append({'type': current_type, 'data': snapshot['items'][current_type][entity_id]})
+        return results
+
+    def states(self, country_id=None):
+        snapshot = self.current()
+        if country_id:
+            return snapshot['states_by_country'].get(country_id, [])
+        return list(snapshot['items']['state'].values())
+
+    def cities(self, state_id=None, country_id=None):
+        snapshot = self.current()
+        if state_id:
+            return snapshot['cities_by_state'].get(state_id, [])
+        if country_id:
+            return snapshot['cities_by_country'].get(country_id, [])
+        return list(snapshot['items']['city'].values())
+
+suggestions = PrefixIndex()
+fuzzy_names = TrigramIndex()
+locations = LocationIndex()
+
+def product_saved(product_id, name):
+    """Actualizar los índices de este proceso tras crear o editar un producto"""
+    for index in (suggestions, fuzzy_names):
+        index.add(product_id, name)
+
+def product_deleted(product_id):
+    for index in (suggestions, fuzzy_names):
+        index.remove(product_id)
@@ -0,0 +1,62 @@
+from flask import request, g
+from app.models import Users
+import jwt
+import os
+
+def get_raw_token():
+    """Obtener el token JWT del header Authorization (sin 'Bearer ')"""
+    token = request.headers.get('Authorization')
+    if not token:
+        return None
+
+    if token.startswith('Bearer '):
+        token = token[7:]
+
+    return token
+
+def decode_request_token():
+    """
+    Decodificar el token JWT de la petición actual.
+
+    El resultado se guarda en `g`, de modo que varias llamadas dentro del
+    mismo contexto (por ejemplo las sub-peticiones de /api/batch) decodifican
+    el token una sola vez.
+
+    Returns:
+        dict | None: payload del token, o None si no se envió token
+
+    Raises:
+        jwt.ExpiredSignatureError, jwt.InvalidTokenError
+    """
+    token = get_raw_token()
+    if not token:
+        return None
+
+    payloads = g.setdefault('token_payloads', {})
+    if token not in payloads:
+        try:
+            payloads[token] = jwt.decode(token, os.getenv('SECRET_KEY', 'HolaMundo'), algorithms=['HS256'])
+        except jwt.InvalidTokenError as e:
+            payloads[token] = e
+
+    result = payloads[token]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def load_user(user_id):
+    """Buscar usuario por ID reutilizando el que ya se cargó en este contexto"""
+    users = g.setdefault('token_users', {})
+    if user_id not in users:
+        users[user_id] = Users.query.get(user_id)
+    return users[user_id]
+
+def get_user_from_token():
+    """Obtener usuario del token JWT"""
+    try:
+        payload = decode_request_token()
+        if not payload:
+            return None
+        return load_user(payload['user_id'])
+    except:
+        return None
@@ -0,0 +1,90 @@
+from app import db
+from app.background import start_deferred_threads
+from app.metrics import registry
+import math
+import os
+
+# ===============================
+# SERVIDOR DE PRODUCCIÓN (PRE-FORK)
+# ===============================
+#
+# gunicorn.conf.py crea la app una sola vez en el proceso maestro
+# (preload_app) y luego hace fork de los workers, que comparten las páginas
+# de código e índices ya cargados. Lo que no se puede compartir entre
+# procesos se rehace en cada worker después del fork: las conexiones del
+# pool de SQLAlchemy, las métricas del proceso y los hilos de fondo.
+
+# Clases de worker de gunicorn en las que una conexión no ocupa un hilo
+ASYNC_WORKERS = ('gevent', 'eventlet')
+
+def available_cpus():
+    """CPUs que puede usar el proceso (afinidad y cuota de cgroup en contenedores)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - macOS / Windows
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def worker_settings(cpus=None):
+    """
+    Workers, hilos y tipo de worker por defecto.
+
+    Con SQLite local casi todo el tiempo de una petición es CPU en Python
+    (ORM, JSON) bajo el GIL, así que el paralelismo viene de los procesos: uno
+    por CPU más uno para cubrir las esperas del lock de escritura y de fsync.
+    Los hilos de cada worker (gthread) solo solapan esas esperas y las
+    conexiones lentas o SSE. Con un solo hilo se usa el worker sync.
+
+    stream_threads es cuántos hilos de cada worker pueden quedar ocupados por
+    conexiones SSE (WEB_STREAM_THREADS, default la mitad; 0 = sin tope). Con
+    workers asíncronos (gevent, eventlet) cada conexión es una greenlet y no
+    se aplica tope.
+    """
+    cpus = cpus or available_cpus()
+    workers = int(os.getenv('WEB_WORKERS') or cpus + 1)
+    threads = int(os.getenv('WEB_THREADS') or 4)
+    worker_class = os.getenv('WEB_WORKER_CLASS') or ('gthread' if threads > 1 else 'sync')
+    if os.getenv('WEB_STREAM_THREADS'):
+        stream_threads = int(os.getenv('WEB_STREAM_THREADS')) or None
+    elif any(name in worker_class.lower() for name in ASYNC_WORKERS):
+        stream_threads = None
+    else:
+        stream_threads = max(1, threads // 2)
+    return {'workers': workers, 'threads': threads, 'worker_class': worker_class,
+            'stream_threads': stream_threads}
+
+def limit_streams(app, stream_threads):
+    """
+    Cada conexión SSE ocupa un hilo del worker: no aceptar más de
+    `stream_threads` a la vez (None = sin tope). Devuelve el máximo efectivo.
+    """
+    if stream_threads:
+        app.config['PRODUCT_STREAM_MAX_SUBSCRIBERS'] = min(
+            app.config['PRODUCT_STREAM_MAX_SUBSCRIBERS'], stream_threads)
+    return app.config['PRODUCT_STREAM_MAX_SUBSCRIBERS']
+
+def before_fork(app):
+    """Cerrar las conexiones del maestro para que ningún worker herede un socket o archivo abierto"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+def after_fork(app, stream_threads=None):
+    """Preparar un worker recién creado"""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False: descartar el pool heredado sin tocar conexiones del
+            # maestro. Los eventos del engine (métricas del pool) pasan al pool nuevo
+            engine.dispose(close=False)
+
+    limit_streams(app, stream_threads)
+    registry.reset()
+    start_deferred_threads()
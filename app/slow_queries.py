@@ -0,0 +1,290 @@
+from sqlalchemy import event
+from datetime import datetime
+import click
+import json
+import os
+import re
+import threading
+import time
+
+# ===============================
+# REGISTRO DE CONSULTAS LENTAS
+# ===============================
+#
+# Las sentencias que superan SLOW_QUERY_THRESHOLD_MS se agrupan por huella
+# (la sentencia sin literales ni listas IN) junto con sus parámetros y el
+# EXPLAIN QUERY PLAN de SQLite. Los pasos "SCAN" (recorren toda la tabla o
+# todo el índice, sin búsqueda por clave) se marcan como recorridos
+# completos.
+#
+# Si SLOW_QUERY_LOG está configurado cada ocurrencia se agrega a ese archivo
+# (JSON por línea) para poder sumar las de todos los workers. Al pasar de
+# SLOW_QUERY_LOG_MAX_BYTES el archivo se renombra a <archivo>.1 (reemplazando
+# el anterior) y se empieza uno nuevo; los reportes leen solo los últimos
+# SLOW_QUERY_LOG_TAIL_BYTES. Los planes se guardan aparte, una vez por huella
+# y proceso, en <archivo>.plans, que no se rota: así una huella conserva su
+# plan aunque la ocurrencia que lo trajo haya salido del log.
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAM_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+FULL_SCAN = re.compile(r'^SCAN (\S+)')
+# Sentencias con EXPLAIN QUERY PLAN: consultas simples y con CTE
+EXPLAINED = ('SELECT', 'WITH')
+
+def fingerprint(statement):
+    """Normalizar una sentencia para agrupar las que solo cambian en sus valores"""
+    statement = STRING_LITERAL.sub('?', statement)
+    statement = NUMBER_LITERAL.sub('?', statement)
+    statement = PARAM_LIST.sub('(?...)', statement)
+    return WHITESPACE.sub(' ', statement).strip()
+
+def explain(dbapi_connection, statement, parameters):
+    """EXPLAIN QUERY PLAN de una consulta SELECT o WITH (solo SQLite)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def full_scans(plan):
+    """Tablas recorridas completas según el plan"""
+    return [match.group(1) for match in (FULL_SCAN.match(step) for step in plan) if match]
+
+class SlowQueryLog:
+    """Agregado en memoria de consultas lentas por huella"""
+
+    def __init__(self, threshold_ms=100, log_path=None, max_entries=500,
+                 log_max_bytes=5_000_000, log_tail_bytes=1_000_000):
+        self.threshold = threshold_ms / 1000.0
+        self.log_path = log_path
+        self.max_entries = max_entries
+        self.log_max_bytes = log_max_bytes
+        self.log_tail_bytes = log_tail_bytes
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def record(self, statement, parameters, elapsed, plan):
+        key = fingerprint(statement)
+        params = repr(parameters)[:500]
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_entries:
+                    return
+                entry = self.entries[key] = {
+                    'fingerprint': key,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'plan': plan,
+                    'full_scans': full_scans(plan or [])
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed * 1000
+            entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+            entry['last_parameters'] = params
+            entry['last_seen'] = datetime.utcnow().isoformat()
+            if entry['plan'] is None and plan is not None:
+                entry['plan'] = plan
+                entry['full_scans'] = full_scans(plan)
+
+        if self.log_path:
+            if plan is not None:
+                with open(plans_path(self.log_path), 'a') as f:
+                    f.write(json.dumps({'fingerprint': key, 'plan': plan}) + '\n')
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({
+                    'fingerprint': key,
+                    'elapsed_ms': elapsed * 1000,
+                    'parameters': params,
+                    'timestamp': datetime.utcnow().isoformat()
+                }) + '\n')
+                size = f.tell()
+            if self.log_max_bytes and size > self.log_max_bytes:
+                rotate_log(self.log_path)
+
+    def has_plan(self, statement):
+        entry = self.entries.get(fingerprint(statement))
+        return entry is not None and entry['plan'] is not None
+
+    def top(self, limit=10):
+        """Consultas con más tiempo acumulado (de este proceso o del archivo de log)"""
+        if self.log_path:
+            entries = aggregate_log(self.log_path, self.log_tail_bytes)
+        else:
+            with self.lock:
+                entries = [dict(entry) for entry in self.entries.values()]
+
+        for entry in entries:
+            entry['avg_ms'] = entry['total_ms'] / entry['count']
+        return sorted(entries, key=lambda e: e['total_ms'], reverse=True)[:limit]
+
+def plans_path(path):
+    return f'{path}.plans'
+
+def read_plans(path):
+    """{huella: plan} del archivo de planes (el último escrito de cada huella)"""
+    plans = {}
+    try:
+        with open(plans_path(path)) as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                plans[item['fingerprint']] = item['plan']
+    except FileNotFoundError:
+        pass
+    return plans
+
+def rotate_log(path):
+    """Renombrar el log a <archivo>.1; los workers abren el archivo en cada escritura y siguen en uno nuevo"""
+    try:
+        os.replace(path, f'{path}.1')
+    except FileNotFoundError:
+        pass  # Otro worker lo rotó primero
+
+def read_tail(path, tail_bytes):
+    """Líneas completas de los últimos `tail_bytes` del archivo"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if tail_bytes and size > tail_bytes:
+            f.seek(size - tail_bytes)
+            f.readline()  # Descartar la línea cortada
+        else:
+            f.seek(0)
+        return f.read().decode('utf-8', errors='replace').splitlines()
+
+def read_recent(path, tail_bytes):
+    """Últimas líneas del log, completando con el final de <archivo>.1 si el actual es más corto (recién rotado)"""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    lines = []
+    if tail_bytes and size < tail_bytes:
+        try:
+            lines = read_tail(f'{path}.1', tail_bytes - size)
+        except FileNotFoundError:
+            pass
+    if size:
+        try:
+            lines += read_tail(path, tail_bytes)
+        except FileNotFoundError:
+            pass  # Rotado mientras tanto
+    return lines
+
+def aggregate_log(path, tail_bytes=None):
+    """Agrupar por huella las ocurrencias guardadas al final del archivo de log"""
+    entries = {}
+    for line in read_recent(path, tail_bytes):
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+
+        entry = entries.setdefault(item['fingerprint'], {
+            'fingerprint': item['fingerprint'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'plan': None,
+            'full_scans': []
+        })
+        entry['count'] += 1
+        entry['total_ms'] += item['elapsed_ms']
+        entry['max_ms'] = max(entry['max_ms'], item['elapsed_ms'])
+        entry['last_parameters'] = item['parameters']
+        entry['last_seen'] = item['timestamp']
+        if item.get('plan'):
+            entry['plan'] = item['plan']
+            entry['full_scans'] = full_scans(item['plan'])
+
+    plans = read_plans(path)
+    for entry in entries.values():
+        plan = plans.get(entry['fingerprint'])
+        if plan and not entry['plan']:
+            entry['plan'] = plan
+            entry['full_scans'] = full_scans(plan)
+    return list(entries.values())
+
+def instrument_engine(engine, slow_log):
+    """Medir cada sentencia del engine y registrar las lentas"""
+    is_sqlite = engine.dialect.name == 'sqlite'
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def check_elapsed(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if elapsed < slow_log.threshold:
+            return
+
+        plan = None
+        # El plan se calcula solo la primera vez que aparece cada huella
+        if (is_sqlite and not executemany and
+                statement.lstrip().upper().startswith(EXPLAINED) and
+                not slow_log.has_plan(statement)):
+            try:
+                plan = explain(conn.connection.dbapi_connection, statement, parameters)
+            except Exception:
+                plan = None
+
+        slow_log.record(statement, parameters, elapsed, plan)
+
+    @event.listens_for(engine, 'handle_error')
+    def discard_timer(exception_context):
+        starts = exception_context.connection.info.get('slow_query_start') if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+def print_report(entries):
+    """Imprimir el reporte de consultas lentas en consola"""
+    if not entries:
+        print('No hay consultas lentas registradas')
+        return
+
+    for position, entry in enumerate(entries, 1):
+        print(f'{position}. {entry["count"]} veces, total {entry["total_ms"]:.1f} ms, '
+              f'promedio {entry["avg_ms"]:.1f} ms, máximo {entry["max_ms"]:.1f} ms')
+        print(f'   {entry["fingerprint"]}')
+        for step in entry.get('plan') or []:
+            print(f'   plan: {step}')
+        if entry.get('full_scans'):
+            print(f'   ⚠ recorrido completo de: {", ".join(entry["full_scans"])}')
+        print()
+
+def init_slow_query_log(app, db):
+    """Instalar el registro de consultas lentas en los engines de la app"""
+    slow_log = SlowQueryLog(
+        threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS'],
+        log_path=app.config.get('SLOW_QUERY_LOG'),
+        log_max_bytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+        log_tail_bytes=app.config['SLOW_QUERY_LOG_TAIL_BYTES']
+    )
+    app.extensions['slow_query_log'] = slow_log
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine, slow_log)
+
+    @app.cli.command('slow-queries')
+    @click.option('--limit', default=20, help='Número de consultas a mostrar')
+    def slow_queries_command(limit):
+        """Mostrar las consultas lentas con más tiempo acumulado (lee SLOW_QUERY_LOG)"""
+        if not slow_log.log_path:
+            print('Configura SLOW_QUERY_LOG para leer las consultas registradas por los workers')
+            return
+        print_report(slow_log.top(limit))
+
+    return slow_log
@@ -0,0 +1,267 @@
+from flask import current_app
+from app import db
+from app.analytics import np, SalesColumns, ROW_DTYPE, DETAIL_COLUMNS_SQL
+from app.maintenance import start_periodic_job
+from datetime import datetime
+import click
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# ===============================
+# SNAPSHOT COLUMNAR DE VENTAS
+# ===============================
+#
+# Copia de las columnas de sales_detail_all que usa la analítica, un archivo
+# binario por columna (sale.<generación>.bin, product.<generación>.bin, ...)
+# más un manifest.json con el número de filas y el id_SalesDetails más alto
+# exportado. Cada exportación solo agrega las filas con id mayor a esa marca,
+# y los lectores abren los archivos con np.memmap: los endpoints calculan
+# sobre las páginas del archivo sin copiarlas ni consultar SQLite.
+#
+# El manifest se escribe después de los datos y se reemplaza de forma
+# atómica, así un lector nunca ve filas a medio escribir: los bytes que
+# sobran al final de una columna (exportación interrumpida) se ignoran y se
+# recortan en la siguiente exportación.
+#
+# Los detalles de venta no se editan ni se borran (el archivo histórico los
+# mueve conservando su id), pero si el conteo de filas hasta la marca deja de
+# coincidir con el snapshot, se reconstruye desde cero en una generación
+# nueva de archivos: los procesos que todavía tienen mapeada la anterior la
+# siguen leyendo hasta ver el manifest nuevo (recortar un archivo mapeado
+# los haría fallar con SIGBUS).
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Bloques por id: cada uno es una consulta corta, así la exportación no
+# retiene el lock de lectura de SQLite mientras escriben los workers
+EXPORT_SQL = (
+    f'SELECT "id_SalesDetails", {DETAIL_COLUMNS_SQL} FROM sales_detail_all '
+    'WHERE "DateSales" IS NOT NULL AND "id_SalesDetails" > ? ORDER BY "id_SalesDetails" LIMIT ?'
+)
+COUNT_SQL = (
+    'SELECT count(*) FROM sales_detail_all '
+    'WHERE "DateSales" IS NOT NULL AND "id_SalesDetails" <= ?'
+)
+EXPORT_DTYPE = np.dtype([('id', 'i8')] + ROW_DTYPE.descr) if np else None
+
+def column_path(directory, name, generation):
+    return os.path.join(directory, f'{name}.{generation}.bin')
+
+def remove_old_generations(directory, generation):
+    for filename in os.listdir(directory):
+        parts = filename.split('.')
+        if len(parts) == 3 and parts[2] == 'bin' and parts[1] != str(generation):
+            os.remove(os.path.join(directory, filename))
+
+def read_manifest(directory):
+    """Manifest del snapshot, o None si no existe o es de otro formato"""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == FORMAT_VERSION else None
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ExportLock:
+    """Lock de archivo para que un solo proceso exporte a la vez"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        if fcntl:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.file.close()
+                return False
+        return True
+
+    def __exit__(self, *exc):
+        if not self.file.closed:
+            self.file.close()
+
+# ===============================
+# EXPORTACIÓN
+# ===============================
+
+def export_snapshot(directory=None, chunk_size=None, rebuild=False):
+    """
+    Agregar al snapshot los detalles nuevos desde la última exportación.
+
+    Returns:
+        dict: filas agregadas y totales, marca de agua, segundos y si se
+        reconstruyó; None si otro proceso está exportando
+    """
+    config = current_app.config
+    directory = directory or config['ANALYTICS_SNAPSHOT_DIR']
+    chunk_size = chunk_size or config['ANALYTICS_CHUNK_SIZE']
+    os.makedirs(directory, exist_ok=True)
+
+    with ExportLock(directory) as acquired:
+        if not acquired:
+            return None
+
+        start = time.perf_counter()
+        cursor = db.session.connection().connection.cursor()
+        try:
+            previous = read_manifest(directory)
+            rebuilt = rebuild or previous is None
+            if not rebuilt:
+                cursor.execute(COUNT_SQL, (previous['high_water_mark'],))
+                rebuilt = cursor.fetchone()[0] != previous['rows']
+
+            if rebuilt:
+                generation = previous['generation'] + 1 if previous else 1
+                rows = high_water_mark = 0
+            else:
+                generation = previous['generation']
+                rows = previous['rows']
+                high_water_mark = previous['high_water_mark']
+
+            # Descartar lo que haya quedado después de la última exportación completa
+            files = {}
+            for name in ROW_DTYPE.names:
+                path = column_path(directory, name, generation)
+                files[name] = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+                files[name].truncate(rows * ROW_DTYPE[name].itemsize)
+                files[name].seek(0, os.SEEK_END)
+
+            added = 0
+            try:
+                while True:
+                    cursor.execute(EXPORT_SQL, (high_water_mark, chunk_size))
+                    batch = cursor.fetchall()
+                    if not batch:
+                        break
+                    data = np.fromiter(batch, dtype=EXPORT_DTYPE, count=len(batch))
+                    for name, f in files.items():
+                        np.ascontiguousarray(data[name]).tofile(f)
+                    high_water_mark = int(data['id'][-1])
+                    added += len(data)
+                    if len(batch) < chunk_size:
+                        break
+                for f in files.values():
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                for f in files.values():
+                    f.close()
+        finally:
+            cursor.close()
+            db.session.rollback()
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'generation': generation,
+            'rows': rows + added,
+            'high_water_mark': high_water_mark,
+            'columns': {name: ROW_DTYPE[name].str for name in ROW_DTYPE.names},
+            'updated_at': datetime.utcnow().isoformat()
+        }
+        write_manifest(directory, manifest)
+        if rebuilt:
+            remove_old_generations(directory, generation)
+
+    return {'added': added, 'rows': manifest['rows'], 'high_water_mark': high_water_mark,
+            'rebuilt': rebuilt, 'seconds': time.perf_counter() - start}
+
+# ===============================
+# LECTURA
+# ===============================
+
+def open_columns(directory, manifest):
+    """Columnas del snapshot mapeadas en memoria (solo lectura)"""
+    rows = manifest['rows']
+    arrays = {}
+    for name, dtype in manifest['columns'].items():
+        if rows:
+            arrays[name] = np.memmap(column_path(directory, name, manifest['generation']),
+                                     dtype=np.dtype(dtype), mode='r', shape=(rows,))
+        else:
+            arrays[name] = np.empty(0, dtype=np.dtype(dtype))
+    return SalesColumns(**arrays)
+
+class SnapshotReader:
+    """Mantiene abiertas las columnas y las vuelve a mapear cuando cambia el manifest"""
+
+    def __init__(self):
+        self.columns = None
+        self.manifest = None
+        self.manifest_stat = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """(columnas, manifest), o (None, None) si no hay snapshot configurado o exportado"""
+        directory = current_app.config.get('ANALYTICS_SNAPSHOT_DIR')
+        if not directory or np is None:
+            return None, None
+
+        try:
+            stat = os.stat(os.path.join(directory, MANIFEST))
+        except OSError:
+            return None, None
+
+        # El manifest se reemplaza con os.replace: cambia el inodo en cada exportación
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if key != self.manifest_stat:
+                manifest = read_manifest(directory)
+                if manifest is None:
+                    return None, None
+                self.columns = open_columns(directory, manifest)
+                self.manifest = manifest
+                self.manifest_stat = key
+            return self.columns, self.manifest
+
+reader = SnapshotReader()
+
+def report_export(result):
+    if result and result['added']:
+        action = 'reconstruido' if result['rebuilt'] else 'actualizado'
+        return (f'Snapshot de ventas {action}: {result["added"]} filas nuevas, '
+                f'{result["rows"]} en total ({result["seconds"]:.2f} s)')
+
+def init_snapshot(app):
+    """Comando de exportación y exportación periódica si hay directorio configurado"""
+    @app.cli.command('analytics-snapshot')
+    @click.option('--directory', default=None, help='Directorio del snapshot (default: ANALYTICS_SNAPSHOT_DIR)')
+    @click.option('--rebuild', is_flag=True, help='Descartar el snapshot y exportar todo de nuevo')
+    def analytics_snapshot_command(directory, rebuild):
+        """Exportar los detalles de venta nuevos al snapshot columnar"""
+        if np is None:
+            raise click.ClickException('El snapshot requiere NumPy')
+        directory = directory or app.config['ANALYTICS_SNAPSHOT_DIR']
+        if not directory:
+            raise click.ClickException('Configura ANALYTICS_SNAPSHOT_DIR o usa --directory')
+
+        result = export_snapshot(directory, rebuild=rebuild)
+        if result is None:
+            print('Otro proceso está exportando el snapshot')
+            return
+        print(f'Filas agregadas: {result["added"]}, total: {result["rows"]}, '
+              f'marca de agua: {result["high_water_mark"]}'
+              f'{" (reconstruido)" if result["rebuilt"] else ""} ({result["seconds"]:.2f} s)')
+
+    if app.config['ANALYTICS_SNAPSHOT_DIR'] and app.config['ANALYTICS_SNAPSHOT_INTERVAL'] and np is not None:
+        start_periodic_job(app, 'analytics-snapshot', app.config['ANALYTICS_SNAPSHOT_INTERVAL'],
+                           export_snapshot, report_export)
@@ -0,0 +1,114 @@
+from app import db
+from app.models import Users, City, States, Country, RoleS, user_roles
+from sqlalchemy import select, func
+import math
+
+# ===============================
+# LISTADO DE USUARIOS
+# ===============================
+#
+# Users.to_dict carga city, state y country uno por uno y los roles en otra
+# consulta. Aquí cada página se arma con un número fijo de consultas: el
+# conteo, los usuarios con su ubicación (LEFT JOIN) y los roles de todos
+# los usuarios de la página (IN). Los diccionarios tienen la misma forma
+# que Users.to_dict(include_roles=True).
+
+def users_select():
+    """SELECT de usuarios con ciudad, estado y país en la misma fila"""
+    return select(
+        Users.iD_User, Users.UserName, Users.Email, Users.iD_City,
+        City.CityName, City.iD_States,
+        States.StatesName, Country.CountryName
+    ).select_from(Users).outerjoin(
+        City, City.iD_City == Users.iD_City
+    ).outerjoin(
+        States, States.iD_States == City.iD_States
+    ).outerjoin(
+        Country, Country.iD_Country == States.iD_Country
+    )
+
+def search_filter(search):
+    return Users.UserName.contains(search) | Users.Email.contains(search)
+
+def row_to_dict(row):
+    return {
+        'iD_User': row.iD_User,
+        'UserName': row.UserName,
+        'Email': row.Email,
+        'iD_City': row.iD_City,
+        'city': {
+            'iD_City': row.iD_City,
+            'CityName': row.CityName,
+            'iD_States': row.iD_States,
+            'state': row.StatesName,
+            'country': row.CountryName
+        } if row.CityName is not None else None
+    }
+
+def roles_by_user(user_ids):
+    """{iD_User: [roles]} con una sola consulta"""
+    roles = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return roles
+
+    rows = db.session.execute(
+        select(user_roles.c.iD_Useri, RoleS.iDRole, RoleS.TypeRole)
+        .join(RoleS, RoleS.iDRole == user_roles.c.idROLE)
+        .where(user_roles.c.iD_Useri.in_(user_ids))
+        .order_by(user_roles.c.iD_Useri, RoleS.iDRole)
+    ).all()
+    for row in rows:
+        roles[row.iD_Useri].append({'iDRole': row.iDRole, 'TypeRole': row.TypeRole})
+    return roles
+
+def serialize_rows(rows, include_roles=True):
+    users = [row_to_dict(row) for row in rows]
+    if include_roles:
+        roles = roles_by_user([user['iD_User'] for user in users])
+        for user in users:
+            user['roles'] = roles[user['iD_User']]
+    return users
+
+def list_users(search='', limit=None, offset=0, include_roles=True):
+    """Usuarios serializados (dos consultas con roles, una sin roles)"""
+    statement = users_select().order_by(Users.iD_User)
+    if search:
+        statement = statement.where(search_filter(search))
+    if limit is not None:
+        statement = statement.limit(limit).offset(offset)
+    return serialize_rows(db.session.execute(statement).all(), include_roles)
+
+def paginate_users(page, per_page, search=''):
+    """Página de usuarios y datos de paginación (tres consultas)"""
+    page = max(page, 1)
+    per_page = max(per_page, 1)
+
+    count = select(func.count()).select_from(Users)
+    if search:
+        count = count.where(search_filter(search))
+    total = db.session.execute(count).scalar()
+
+    users = list_users(search, limit=per_page, offset=(page - 1) * per_page) if total else []
+
+    return users, {
+        'page': page,
+        'pages': math.ceil(total / per_page),
+        'per_page': per_page,
+        'total': total
+    }
+
+def iter_users(chunk_size=500, include_roles=True):
+    """
+    Recorrer todos los usuarios por bloques (paginación por clave sobre
+    iD_User), sin cargar la tabla completa en memoria.
+    """
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            users_select().where(Users.iD_User > last_id).order_by(Users.iD_User).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+
+        yield from serialize_rows(rows, include_roles)
+        last_id = rows[-1].iD_User
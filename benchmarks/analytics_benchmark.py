@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la analítica de ventas vectorizada (app/analytics.py).
+
+Copia la base de datos de ejemplo, agrega ventas sintéticas hasta tener
+--details filas en sales_detail y mide:
+
+- la carga por bloques de sales_detail_all a arreglos de NumPy,
+- cada agrupación (serie diaria/semanal/mensual, top de productos,
+  categorías y percentiles por venta) con NumPy,
+- la exportación al snapshot columnar (app/snapshot.py) y las
+  agrupaciones sobre sus archivos mapeados en memoria,
+- las mismas agrupaciones con un bucle de Python sobre las filas, que es
+  lo que haría falta sin el módulo.
+
+Uso:
+    python benchmarks/analytics_benchmark.py --details 10000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed(connection, args):
+    """Insertar productos, categorías y ventas con 1 a 7 detalles cada una"""
+    random.seed(42)
+    cursor = connection.cursor()
+    category_ids = [row[0] for row in cursor.execute('SELECT "id_Category" FROM category')]
+    user_ids = [row[0] for row in cursor.execute('SELECT "iD_User" FROM users')]
+
+    max_product = cursor.execute('SELECT max("id_Product") FROM product').fetchone()[0] or 0
+    cursor.executemany(
+        'INSERT INTO product ("id_Product", "Price", "ProductName", "Stock") VALUES (?, ?, ?, ?)',
+        ((i, round(random.uniform(1, 1000), 2), f'Producto {i}', 100)
+         for i in range(max_product + 1, args.products + 1))
+    )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO "PRODUC_Category" ("id_Category", "id_Product") VALUES (?, ?)',
+        ((random.choice(category_ids), i) for i in range(1, args.products + 1) for _ in range(2))
+    )
+
+    start = datetime(2022, 1, 1)
+    days = args.days
+    sale_id = cursor.execute('SELECT coalesce(max("id_Sale"), 0) FROM sales').fetchone()[0]
+    remaining = args.details - cursor.execute('SELECT count(*) FROM sales_detail').fetchone()[0]
+
+    while remaining > 0:
+        sales = []
+        details = []
+        while remaining > 0 and len(details) < 200000:
+            sale_id += 1
+            date = (start + timedelta(days=random.randrange(days), seconds=random.randrange(86400))).isoformat(' ')
+            sales.append((sale_id, 'Venta sintética', random.choice(user_ids), date))
+            for _ in range(min(random.randint(1, 7), remaining)):
+                amount = random.randint(1, 5)
+                details.append((random.randint(1, args.products), sale_id, date, amount,
+                                round(amount * random.uniform(1, 500), 2)))
+                remaining -= 1
+        cursor.executemany(
+            'INSERT INTO sales ("id_Sale", "DescripcionSale", "iD_User", "DateCreated") VALUES (?, ?, ?, ?)', sales
+        )
+        cursor.executemany(
+            'INSERT INTO sales_detail ("id_Product", "id_Sale", "DateSales", amount, "ValueSale") '
+            'VALUES (?, ?, ?, ?, ?)', details
+        )
+    connection.commit()
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def python_aggregations(connection, sql):
+    """Las mismas agrupaciones recorriendo las filas con diccionarios"""
+    by_day = {}
+    by_product = {}
+    by_sale = {}
+    for sale, product, amount, value, day in connection.execute(sql):
+        revenue, units = by_day.get(day, (0.0, 0))
+        by_day[day] = (revenue + value, units + amount)
+        revenue, units = by_product.get(product, (0.0, 0))
+        by_product[product] = (revenue + value, units + amount)
+        by_sale[sale] = by_sale.get(sale, 0.0) + value
+
+    by_month = {}
+    for day, (revenue, units) in by_day.items():
+        month = (datetime(1970, 1, 1) + timedelta(days=day)).strftime('%Y-%m')
+        total_revenue, total_units = by_month.get(month, (0.0, 0))
+        by_month[month] = (total_revenue + revenue, total_units + units)
+
+    top = sorted(by_product.items(), key=lambda item: -item[1][0])[:10]
+
+    by_category = {}
+    for product, category in connection.execute('SELECT "id_Product", "id_Category" FROM "PRODUC_Category"'):
+        if product in by_product:
+            by_category[category] = by_category.get(category, 0.0) + by_product[product][0]
+
+    values = sorted(by_sale.values())
+    percentiles = {p: values[min(len(values) - 1, int(len(values) * p / 100))] for p in (50, 90, 95, 99)}
+    return by_month, top, by_category, percentiles
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de analítica de ventas con NumPy')
+    parser.add_argument('--details', type=int, default=10000000, help='Filas de sales_detail')
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=3 * 365, help='Días cubiertos por las ventas')
+    parser.add_argument('--chunk-size', type=int, default=200000)
+    parser.add_argument('--skip-python', action='store_true', help='No medir el bucle de Python')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'database', 'ecommerce.db'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(args.db, db_path)
+
+        connection = sqlite3.connect(db_path)
+        _, seconds = timed(seed, connection, args)
+        connection.close()
+        print(f'{args.details} detalles, {args.products} productos ({seconds:.1f} s para generar)\n')
+
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+        os.environ.setdefault('METRICS_ENABLED', 'False')
+        os.environ.setdefault('SLOW_QUERY_ENABLED', 'False')
+        from app import create_app
+        from app import analytics
+
+        app = create_app()
+        with app.app_context():
+            columns, load_seconds = timed(analytics.load_columns, args.chunk_size)
+            print(f'carga a NumPy:        {load_seconds:8.2f} s  '
+                  f'({len(columns)} filas, {sum(a.nbytes for a in vars(columns).values()) / 2 ** 20:.0f} MiB)')
+
+            numpy_total = 0
+            for label, function, function_args in (
+                ('serie diaria', analytics.revenue_series, (columns, 'day')),
+                ('serie semanal', analytics.revenue_series, (columns, 'week')),
+                ('serie mensual', analytics.revenue_series, (columns, 'month')),
+                ('top 10 productos', analytics.top_products, (columns, 10)),
+                ('categorías', analytics.category_breakdown, (columns,)),
+                ('percentiles por venta', analytics.order_percentiles, (columns,)),
+            ):
+                _, seconds = timed(function, *function_args)
+                numpy_total += seconds
+                print(f'{label + ":":22}{seconds * 1000:10.1f} ms')
+            print(f'{"total agrupaciones:":22}{numpy_total * 1000:10.1f} ms')
+
+            # Snapshot columnar: exportación completa, incremental y lectura con memmap
+            from app import snapshot
+            snapshot_dir = os.path.join(tmp, 'snapshot')
+            result = snapshot.export_snapshot(snapshot_dir, args.chunk_size)
+            print(f'\n{"snapshot completo:":28}{result["seconds"]:8.2f} s  ({result["rows"]} filas)')
+            result = snapshot.export_snapshot(snapshot_dir, args.chunk_size)
+            print(f'{"snapshot incremental:":28}{result["seconds"] * 1000:8.1f} ms ({result["added"]} filas nuevas)')
+
+            manifest = snapshot.read_manifest(snapshot_dir)
+            mapped, open_seconds = timed(snapshot.open_columns, snapshot_dir, manifest)
+            print(f'{"abrir con memmap:":28}{open_seconds * 1000:8.1f} ms')
+            _, seconds = timed(analytics.revenue_series, mapped, 'month')
+            print(f'{"serie mensual (memmap):":28}{seconds * 1000:8.1f} ms')
+            _, seconds = timed(analytics.sales_totals, mapped, analytics.np.datetime64('2024-01-01'))
+            print(f'{"totales de /stats (memmap):":28}{seconds * 1000:8.1f} ms')
+
+        if not args.skip_python:
+            connection = sqlite3.connect(db_path)
+            _, python_seconds = timed(python_aggregations, connection, analytics.DETAILS_SQL)
+            connection.close()
+            print(f'\nbucle de Python (lectura + agrupaciones): {python_seconds:.2f} s')
+            print(f'NumPy (carga + todas las agrupaciones):   {load_seconds + numpy_total:.2f} s')
+            print(f'NumPy con columnas en memoria:            {numpy_total:.2f} s '
+                  f'(x{python_seconds / numpy_total:.0f})')
+
+if __name__ == '__main__':
+    main()
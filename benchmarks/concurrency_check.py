@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Prueba de carreras: reservas de stock e Idempotency-Key.
+
+Sobre una copia de la base de datos de ejemplo lanza --threads peticiones a la
+vez (detrás de una barrera) y comprueba los invariantes:
+  - primera reserva: varios usuarios agregan al carrito un producto sin fila
+    en stock_counter; ninguna petición falla y Reserved coincide con la suma
+    de las reservas
+  - idempotencia: el mismo usuario repite POST /api/sales/cart/add con la
+    misma Idempotency-Key; se ejecuta una sola vez, el resto recibe la
+    respuesta guardada (o 409 si seguía en curso) y el carrito suma 1
+
+Termina con código 1 si algún invariante no se cumple.
+
+Uso:
+    python benchmarks/concurrency_check.py --rounds 20 --threads 8
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def run_concurrently(count, request):
+    """Ejecutar request(i) en `count` hilos que arrancan a la vez"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        barrier.wait()
+        results[index] = request(index)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def clear_product(app, db, product_id, counters=False):
+    """Vaciar carritos y reservas del producto (y su fila de stock_counter)"""
+    from app.models import TemporalSales, StockReservation, StockCounter
+
+    tables = [TemporalSales, StockReservation] + ([StockCounter] if counters else [])
+    with app.app_context():
+        for model in tables:
+            db.session.execute(model.__table__.delete().where(model.__table__.c.id_Product == product_id))
+        db.session.commit()
+
+def check_first_reservation(app, db, clients, tokens, product_id):
+    """Primera reserva simultánea del mismo producto"""
+    clear_product(app, db, product_id, counters=True)
+
+    statuses = run_concurrently(len(clients), lambda i: clients[i].post(
+        '/api/sales/cart/add', headers={'Authorization': f'Bearer {tokens[i]}'},
+        json={'id_Product': product_id, 'quantity': 1}
+    ).status_code)
+
+    from app.models import StockReservation, StockCounter
+
+    with app.app_context():
+        reserved = db.session.get(StockCounter, product_id).Reserved
+        held = db.session.query(db.func.coalesce(db.func.sum(StockReservation.quantity), 0)).filter(
+            StockReservation.id_Product == product_id).scalar()
+
+    errors = []
+    if any(status != 200 for status in statuses):
+        errors.append(f'códigos {statuses}')
+    if reserved != held or held != statuses.count(200):
+        errors.append(f'Reserved={reserved}, reservas={held}, agregados={statuses.count(200)}')
+    return errors
+
+def check_idempotent_add(app, db, client, token, product_id, count):
+    """La misma Idempotency-Key repetida a la vez"""
+    clear_product(app, db, product_id)
+
+    headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': uuid.uuid4().hex}
+    responses = run_concurrently(count, lambda i: client.post(
+        '/api/sales/cart/add', headers=headers, json={'id_Product': product_id, 'quantity': 1}
+    ))
+    executed = [r for r in responses if r.status_code == 200 and 'Idempotent-Replayed' not in r.headers]
+    others = [r.status_code for r in responses if r not in executed]
+
+    cart = client.get('/api/sales/cart', headers={'Authorization': f'Bearer {token}'}).get_json()
+    quantity = sum(item['quantity'] for item in cart['cart_items'] if item['id_Product'] == product_id)
+
+    errors = []
+    if len(executed) != 1:
+        errors.append(f'{len(executed)} ejecuciones')
+    if any(status not in (200, 409) for status in others):
+        errors.append(f'códigos de los duplicados {others}')
+    if quantity != 1:
+        errors.append(f'cantidad en el carrito {quantity}')
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Carreras de reservas e idempotencia')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'database', 'ecommerce.db'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'race.db')
+        shutil.copy(args.db, db_path)
+        os.environ.update({
+            'DATABASE_URL': f'sqlite:///{db_path}',
+            'RATE_LIMIT_ENABLED': 'False',
+            'ANALYTICS_SNAPSHOT_INTERVAL': '0',
+            'RESERVATION_SWEEP_INTERVAL': '0',
+            'IDEMPOTENCY_PURGE_INTERVAL': '0',
+        })
+        from app import create_app, db
+
+        app = create_app()
+        clients = [app.test_client() for _ in range(args.threads)]
+        tokens = []
+        for index, client in enumerate(clients):
+            response = client.post('/api/auth/register', json={
+                'UserName': f'race{index}', 'Email': f'race{index}@example.com', 'PasswoRDkey': 'race1234'
+            })
+            tokens.append(response.get_json()['token'])
+
+        from app.models import Product
+
+        with app.app_context():
+            product = Product.query.order_by(Product.id_Product).first()
+            product.Stock = 1000000
+            db.session.commit()
+            product_id = product.id_Product
+
+        failures = 0
+        for round_number in range(1, args.rounds + 1):
+            for name, errors in (
+                ('primera reserva', check_first_reservation(app, db, clients, tokens, product_id)),
+                ('idempotencia', check_idempotent_add(app, db, clients[0], tokens[0], product_id, args.threads)),
+            ):
+                if errors:
+                    failures += 1
+                    print(f'ronda {round_number} {name}: ' + '; '.join(errors))
+
+        print(f'{args.rounds} rondas x {args.threads} hilos: {failures} fallos')
+        sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
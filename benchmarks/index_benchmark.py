@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark de las migraciones de índices (app/migrations.py).
+
+Copia la base de datos de ejemplo, la llena con datos sintéticos y mide
+el plan (EXPLAIN QUERY PLAN) y la latencia mediana de las consultas más
+frecuentes antes y después de aplicar las migraciones.
+
+Uso:
+    python benchmarks/index_benchmark.py --products 50000 --cart-rows 200000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = [
+    ('carrito (usuario, venta NULL, producto)',
+     'SELECT * FROM temporal_sales WHERE "iD_User" = ? AND "id_Sale" IS NULL AND "id_Product" = ?',
+     lambda args: (random.randint(1, args.users), random.randint(1, args.products))),
+    ('carrito del usuario',
+     'SELECT * FROM temporal_sales WHERE "iD_User" = ? AND "id_Sale" IS NULL',
+     lambda args: (random.randint(1, args.users),)),
+    ('categorías de un producto',
+     'SELECT category.* FROM category JOIN "PRODUC_Category" pc ON pc."id_Category" = category."id_Category" '
+     'WHERE pc."id_Product" = ?',
+     lambda args: (random.randint(1, args.products),)),
+    ('conteo por rango de precio',
+     'SELECT count(*) FROM product WHERE "Price" >= ? AND "Price" <= ?',
+     lambda args: (lambda low: (low, low + 5))(random.uniform(1, 995))),
+    ('destacados (ORDER BY Stock)',
+     'SELECT * FROM product WHERE "Stock" > 0 ORDER BY "Stock" DESC LIMIT 8',
+     lambda args: ()),
+    ('imágenes de un producto',
+     'SELECT * FROM produc_image WHERE "id_Product" = ?',
+     lambda args: (random.randint(1, args.products),)),
+]
+
+def seed(connection, args):
+    """Insertar productos, categorías, imágenes, usuarios y carritos sintéticos"""
+    random.seed(42)
+    cursor = connection.cursor()
+    category_ids = [row[0] for row in cursor.execute('SELECT "id_Category" FROM category')]
+    password_hash = 'pbkdf2:sha256:600000$x$y'
+
+    cursor.execute('DELETE FROM temporal_sales')
+    cursor.execute('DELETE FROM "PRODUC_Category"')
+    cursor.execute('DELETE FROM produc_image')
+
+    max_product = cursor.execute('SELECT max("id_Product") FROM product').fetchone()[0] or 0
+    cursor.executemany(
+        'INSERT INTO product ("id_Product", "Price", "ProductName", "Stock") VALUES (?, ?, ?, ?)',
+        ((i, round(random.uniform(1, 1000), 2), f'Producto {i}', random.choice([0, 0] + list(range(1, 200))))
+         for i in range(max_product + 1, args.products + 1))
+    )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO "PRODUC_Category" ("id_Category", "id_Product") VALUES (?, ?)',
+        ((random.choice(category_ids), i) for i in range(1, args.products + 1) for _ in range(2))
+    )
+    cursor.executemany(
+        'INSERT INTO produc_image ("id_Product", pathimage, alt_text, is_main_image) VALUES (?, ?, ?, ?)',
+        ((i, f'/img/{i}_{n}.jpg', f'Imagen {n}', 1 if n == 0 else 0)
+         for i in range(1, args.products + 1) for n in range(2))
+    )
+
+    max_user = cursor.execute('SELECT max("iD_User") FROM users').fetchone()[0] or 0
+    cursor.executemany(
+        'INSERT INTO users ("iD_User", "UserName", "Email", "PasswoRDkey") VALUES (?, ?, ?, ?)',
+        ((i, f'user{i}', f'user{i}@bench.local', password_hash)
+         for i in range(max_user + 1, args.users + 1))
+    )
+    cursor.executemany(
+        'INSERT INTO temporal_sales ("iD_User", "id_Sale", "id_Product", quantity) VALUES (?, ?, ?, ?)',
+        ((random.randint(1, args.users),
+          None if random.random() < 0.2 else 1,
+          random.randint(1, args.products),
+          random.randint(1, 3))
+         for _ in range(args.cart_rows))
+    )
+    connection.commit()
+    cursor.execute('ANALYZE')
+
+def measure(connection, args):
+    """Plan y latencia mediana (ms) de cada consulta"""
+    results = []
+    for label, sql, make_params in QUERIES:
+        plan = [row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', make_params(args))]
+        samples = []
+        for _ in range(args.iterations):
+            params = make_params(args)
+            start = time.perf_counter()
+            connection.execute(sql, params).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        results.append((label, plan, statistics.median(samples)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de índices antes/después de migrar')
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--cart-rows', type=int, default=200000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'database', 'ecommerce.db'))
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from app.migrations import run_migrations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(args.db, db_path)
+
+        connection = sqlite3.connect(db_path)
+        for index in ('ix_temporal_sales_user_sale_product', 'ix_produc_category_product',
+                      'ix_product_price', 'ix_product_stock', 'ix_produc_image_product'):
+            connection.execute(f'DROP INDEX IF EXISTS {index}')
+        connection.execute('DROP TABLE IF EXISTS schema_migrations')
+        seed(connection, args)
+        before = measure(connection, args)
+        connection.close()
+
+        engine = create_engine(f'sqlite:///{db_path}')
+        run_migrations(engine)
+        engine.dispose()
+
+        connection = sqlite3.connect(db_path)
+        connection.execute('ANALYZE')
+        after = measure(connection, args)
+        connection.close()
+
+    print(f'{args.products} productos, {args.users} usuarios, {args.cart_rows} filas de carrito\n')
+    for (label, plan_before, ms_before), (_, plan_after, ms_after) in zip(before, after):
+        print(f'{label}')
+        print(f'  antes:   {ms_before:8.3f} ms  {" | ".join(plan_before)}')
+        print(f'  después: {ms_after:8.3f} ms  {" | ".join(plan_after)}')
+        print(f'  mejora:  x{ms_before / ms_after:.1f}\n' if ms_after else '')
+
+if __name__ == '__main__':
+    main()
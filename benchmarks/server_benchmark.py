@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga: servidor de desarrollo (python app.py) contra gunicorn
+(gunicorn -c gunicorn.conf.py wsgi:app).
+
+Arranca cada servidor sobre una copia de la base de datos de ejemplo, lanza
+--clients procesos cliente con --connections conexiones cada uno durante
+--seconds segundos contra una mezcla de lecturas de la API y reporta
+peticiones por segundo, latencias (p50/p95/p99) y errores.
+
+Uso:
+    python benchmarks/server_benchmark.py --seconds 20 --clients 4 --connections 8
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = [
+    '/api/products/featured',
+    '/api/products/?page=1&per_page=20',
+    '/api/products/{id}',
+    '/api/products/{id}/availability',
+    '/api/products/search?q=camista',
+    '/api/categories/',
+]
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'El servidor no respondió en el puerto {port}')
+
+def client_thread(port, deadline, product_ids, latencies, errors):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < deadline:
+        path = random.choice(PATHS).format(id=random.choice(product_ids))
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.close()
+
+def client_process(args):
+    """Un proceso cliente con varias conexiones (hilos) a la vez"""
+    port, seconds, connections, product_ids = args
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+    threads = [
+        threading.Thread(target=client_thread, args=(port, deadline, product_ids, latencies, errors))
+        for _ in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors)
+
+def run_load(port, args, product_ids):
+    with Pool(args.clients) as pool:
+        results = pool.map(client_process, [(port, args.seconds, args.connections, product_ids)] * args.clients)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / args.seconds,
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'mean': statistics.mean(latencies) * 1000,
+        'errors': errors
+    }
+
+def start_server(command, env, port):
+    # Grupo de procesos propio: el recargador del servidor de desarrollo crea un hijo
+    process = subprocess.Popen(command, cwd=ROOT, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_ready(port)
+    return process
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor de desarrollo contra gunicorn')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--clients', type=int, default=4, help='Procesos cliente')
+    parser.add_argument('--connections', type=int, default=8, help='Conexiones por proceso cliente')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'database', 'ecommerce.db'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(args.db, db_path)
+
+        env = {
+            **os.environ,
+            'DATABASE_URL': f'sqlite:///{db_path}',
+            'METRICS_DIR': os.path.join(tmp, 'metrics'),
+            'RATE_LIMIT_ENABLED': 'False',
+            'ANALYTICS_SNAPSHOT_INTERVAL': '0',
+        }
+
+        import sqlite3
+        connection = sqlite3.connect(db_path)
+        product_ids = [row[0] for row in connection.execute('SELECT "id_Product" FROM product')]
+        connection.close()
+
+        servers = [
+            ('desarrollo (app.py)', [sys.executable, 'app.py'], 5050),
+            ('gunicorn', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], 5051),
+        ]
+        print(f'{args.clients} procesos x {args.connections} conexiones, {args.seconds:g} s por servidor\n')
+        results = {}
+        for label, command, port in servers:
+            server_env = {**env, 'WEB_BIND': f'127.0.0.1:{port}'}
+            process = start_server(command, server_env, port)
+            try:
+                # Calentar índices y cachés antes de medir
+                warmup = argparse.Namespace(**{**vars(args), 'seconds': 2})
+                run_load(port, warmup, product_ids)
+                results[label] = run_load(port, args, product_ids)
+            finally:
+                stop_server(process)
+
+            result = results[label]
+            if not result['requests']:
+                print(f'{label:22} sin respuestas ({result["errors"]} errores)')
+                continue
+            print(f'{label:22}{result["rps"]:9.0f} req/s  p50 {result["p50"]:7.1f} ms  '
+                  f'p95 {result["p95"]:7.1f} ms  p99 {result["p99"]:7.1f} ms  errores {result["errors"]}')
+
+        print('\n' + json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark de arranque de la API.
+
+Lanza procesos nuevos (como haría cada worker al escalar) y mide:
+  - import: tiempo de `from app import create_app`
+  - create_app: tiempo de create_app() con cada SCHEMA_MODE / LAZY_BLUEPRINTS
+  - first_request: tiempo del primer GET /api/products/featured
+
+Uso:
+    python benchmarks/startup_benchmark.py --runs 15
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = """
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+app.test_client().get('/api/products/featured')
+t3 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'first_request': t3 - t2}))
+"""
+
+CONFIGURATIONS = [
+    ('create', 'false'),
+    ('verify', 'false'),
+    ('verify', 'true'),
+    ('skip', 'true'),
+]
+
+def run_once(db_path, schema_mode, lazy):
+    """Ejecutar un proceso hijo y devolver sus tiempos"""
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'SCHEMA_MODE': schema_mode,
+        'LAZY_BLUEPRINTS': lazy,
+        'PYTHONPATH': ROOT,
+    })
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD_CODE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de arranque de la API')
+    parser.add_argument('--runs', type=int, default=10, help='Procesos por configuración')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'database', 'ecommerce.db'),
+                        help='Base de datos de origen (se copia a un directorio temporal)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'ecommerce.db')
+        shutil.copy(args.db, db_path)
+
+        # Guardar la huella una vez para que el modo verify la encuentre
+        run_once(db_path, 'verify', 'false')
+
+        print(f'{"SCHEMA_MODE":<12}{"LAZY":<7}{"import ms":>11}{"create_app ms":>15}'
+              f'{"1er request ms":>16}{"total ms":>10}')
+        for schema_mode, lazy in CONFIGURATIONS:
+            samples = [run_once(db_path, schema_mode, lazy) for _ in range(args.runs)]
+            medians = {
+                key: statistics.median(sample[key] for sample in samples) * 1000
+                for key in ('import', 'create_app', 'first_request')
+            }
+            total = sum(medians.values())
+            print(f'{schema_mode:<12}{lazy:<7}{medians["import"]:>11.1f}'
+                  f'{medians["create_app"]:>15.1f}{medians["first_request"]:>16.1f}{total:>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Configuración de gunicorn para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+La app se crea una vez en el proceso maestro (WEB_PRELOAD, default True) y
+los workers se crean con fork. Variables: WEB_BIND, WEB_WORKERS, WEB_THREADS,
+WEB_WORKER_CLASS, WEB_STREAM_THREADS, WEB_PRELOAD, WEB_MAX_REQUESTS,
+WEB_TIMEOUT, WEB_ACCESS_LOG.
+"""
+
+import os
+from app.background import defer_threads
+from app.metrics import mark_process_dead
+from app.server import worker_settings, limit_streams, before_fork, after_fork
+
+settings = worker_settings()
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5050')
+workers = settings['workers']
+threads = settings['threads']
+worker_class = settings['worker_class']
+stream_threads = settings['stream_threads']
+preload_app = os.getenv('WEB_PRELOAD', 'True').lower() in ('true', '1')
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+keepalive = 5
+
+# Reciclar workers cada N peticiones (con variación para que no reinicien juntos)
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-' if os.getenv('WEB_ACCESS_LOG', 'False').lower() in ('true', '1') else None
+
+if preload_app:
+    # Los hilos de fondo de create_app se inician en cada worker, no en el maestro
+    defer_threads()
+
+def on_starting(server):
+    server.log.info('Workers: %s x %s hilos (%s)', workers, threads, worker_class)
+    server.log.info('Streams SSE por worker: %s', stream_threads or 'sin tope (PRODUCT_STREAM_MAX_SUBSCRIBERS)')
+
+def pre_fork(server, worker):
+    if preload_app:
+        before_fork(server.app.wsgi())
+
+def post_fork(server, worker):
+    if preload_app:
+        after_fork(server.app.wsgi(), stream_threads)
+
+def child_exit(server, worker):
+    # Conservar los totales del worker terminado sin dejar su archivo en METRICS_DIR
+    if os.getenv('METRICS_DIR'):
+        mark_process_dead(os.getenv('METRICS_DIR'), worker.pid)
+
+def post_worker_init(worker):
+    if not preload_app:
+        # Sin preload cada worker creó su propia app (y sus hilos de fondo)
+        limit_streams(worker.wsgi, stream_threads)
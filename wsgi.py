@@ -0,0 +1,4 @@
+from app import create_app
+
+# Punto de entrada WSGI para servidores de producción (gunicorn -c gunicorn.conf.py wsgi:app)
+app = create_app()